@@ -33,123 +33,154 @@ def test_supabase_connection():
         logger.error(f"Supabase connection failed: {e}")
         return False
 
+# Posts snapshot shared by the post-level detectors (1-3): one scan of only the
+# columns they read, streamed in pages ordered by id (keyset pagination)
+POST_SNAPSHOT_COLUMNS = "id, user_id, views_count, likes_count, comments_count, shares_count, total_earnings, is_frozen"
+POST_SNAPSHOT_PAGE_SIZE = int(os.getenv('POST_SNAPSHOT_PAGE_SIZE', '1000'))
+
+def scan_posts(page_size=POST_SNAPSHOT_PAGE_SIZE):
+    last_id = None
+    while True:
+        query = supabase.table("posts").select(POST_SNAPSHOT_COLUMNS).order("id").limit(page_size)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = query.execute().data or []
+        # Stop on an empty page rather than a short one: the API may cap rows per request below page_size
+        if not page:
+            return
+        yield page
+        last_id = page[-1]['id']
+
 # 1. Detect Suspicious Engagement Patterns
-def detect_suspicious_engagement():
-    try:
-        # Get posts with unusually high engagement rates
-        posts = supabase.table("posts").select("*").execute()
+def detect_suspicious_engagement(posts):
+    # Flag posts with unusually high engagement rates
+    alerts = []
+    for post in posts:
+        # Calculate engagement rate
+        total_engagement = (post.get('likes_count', 0) + 
+                          post.get('comments_count', 0) + 
+                          post.get('shares_count', 0))
+        views = post.get('views_count', 1)
+        engagement_rate = (total_engagement / views) * 100 if views > 0 else 0
         
-        alerts = []
-        for post in posts.data:
-            # Calculate engagement rate
-            total_engagement = (post.get('likes_count', 0) + 
-                              post.get('comments_count', 0) + 
-                              post.get('shares_count', 0))
-            views = post.get('views_count', 1)
-            engagement_rate = (total_engagement / views) * 100 if views > 0 else 0
+        # Flag if engagement rate > 15% (unusually high)
+        if engagement_rate > 15 and total_engagement > 100:
+            alert = {
+                "post_id": post['id'],
+                "alert_type": "Suspicious Engagement",
+                "severity": "high",
+                "description": f"Post has {engagement_rate:.1f}% engagement rate ({total_engagement} total engagements on {views} views)",
+                "detected_at": datetime.now().isoformat(),
+                "is_resolved": False
+            }
             
-            # Flag if engagement rate > 15% (unusually high)
-            if engagement_rate > 15 and total_engagement > 100:
-                alert = {
-                    "post_id": post['id'],
-                    "alert_type": "Suspicious Engagement",
-                    "severity": "high",
-                    "description": f"Post has {engagement_rate:.1f}% engagement rate ({total_engagement} total engagements on {views} views)",
-                    "detected_at": datetime.now().isoformat(),
-                    "is_resolved": False
-                }
-                
-                # Check if alert already exists
-                existing = supabase.table("fraud_alerts").select("id").eq("post_id", post['id']).eq("alert_type", "Suspicious Engagement").execute()
-                if not existing.data:
-                    supabase.table("fraud_alerts").insert(alert).execute()
-                    alerts.append(alert)
-        
-        return alerts
-    except Exception as e:
-        logger.error(f"Error in detect_suspicious_engagement: {e}")
-        return []
+            # Check if alert already exists
+            existing = supabase.table("fraud_alerts").select("id").eq("post_id", post['id']).eq("alert_type", "Suspicious Engagement").execute()
+            if not existing.data:
+                supabase.table("fraud_alerts").insert(alert).execute()
+                alerts.append(alert)
+    
+    return alerts
 
 # 2. Detect Rapid Earnings Growth
-def detect_rapid_earnings_growth():
-    try:
-        # Get posts with unusually high earnings for their view count
-        posts = supabase.table("posts").select("*").execute()
+def detect_rapid_earnings_growth(posts):
+    # Flag posts with unusually high earnings for their view count
+    alerts = []
+    for post in posts:
+        views = post.get('views_count', 1)
+        earnings = float(post.get('total_earnings', 0))
         
-        alerts = []
-        for post in posts.data:
-            views = post.get('views_count', 1)
-            earnings = float(post.get('total_earnings', 0))
-            
-            # Calculate earnings per 1k views
-            earnings_per_1k = (earnings / views * 1000) if views > 0 else 0
-            
-            # Flag if earnings per 1k views > $50 (unusually high)
-            if earnings_per_1k > 50 and earnings > 100:
-                alert = {
-                    "post_id": post['id'],
-                    "alert_type": "Suspicious Earnings",
-                    "severity": "high",
-                    "description": f"Post earning ${earnings_per_1k:.2f} per 1k views (${earnings:.2f} total on {views} views)",
-                    "detected_at": datetime.now().isoformat(),
-                    "is_resolved": False
-                }
-                
-                # Check if alert already exists
-                existing = supabase.table("fraud_alerts").select("id").eq("post_id", post['id']).eq("alert_type", "Suspicious Earnings").execute()
-                if not existing.data:
-                    supabase.table("fraud_alerts").insert(alert).execute()
-                    alerts.append(alert)
+        # Calculate earnings per 1k views
+        earnings_per_1k = (earnings / views * 1000) if views > 0 else 0
         
-        return alerts
-    except Exception as e:
-        logger.error(f"Error in detect_rapid_earnings_growth: {e}")
-        return []
+        # Flag if earnings per 1k views > $50 (unusually high)
+        if earnings_per_1k > 50 and earnings > 100:
+            alert = {
+                "post_id": post['id'],
+                "alert_type": "Suspicious Earnings",
+                "severity": "high",
+                "description": f"Post earning ${earnings_per_1k:.2f} per 1k views (${earnings:.2f} total on {views} views)",
+                "detected_at": datetime.now().isoformat(),
+                "is_resolved": False
+            }
+            
+            # Check if alert already exists
+            existing = supabase.table("fraud_alerts").select("id").eq("post_id", post['id']).eq("alert_type", "Suspicious Earnings").execute()
+            if not existing.data:
+                supabase.table("fraud_alerts").insert(alert).execute()
+                alerts.append(alert)
+    
+    return alerts
 
 # 3. Detect Frozen Account Patterns
-def detect_frozen_patterns():
-    try:
-        # Get user posts grouped by user to detect patterns
-        posts = supabase.table("posts").select("*").execute()
-        
-        # Group by user_id
-        user_posts = {}
-        for post in posts.data:
-            user_id = post['user_id']
-            if user_id not in user_posts:
-                user_posts[user_id] = []
-            user_posts[user_id].append(post)
-        
-        alerts = []
-        for user_id, posts_list in user_posts.items():
-            frozen_count = sum(1 for post in posts_list if post.get('is_frozen'))
-            total_posts = len(posts_list)
+def tally_frozen_posts(posts, user_stats):
+    # Per user: [reference post id, frozen posts, total posts]; counts only, so the snapshot is never held in memory
+    for post in posts:
+        stats = user_stats.setdefault(post['user_id'], [post['id'], 0, 0])
+        stats[1] += 1 if post.get('is_frozen') else 0
+        stats[2] += 1
+    return []
+
+def detect_frozen_patterns(user_stats):
+    alerts = []
+    for user_id, (post_id, frozen_count, total_posts) in user_stats.items():
+        # Flag if >50% of posts are frozen and user has >3 posts
+        if total_posts > 3 and frozen_count / total_posts > 0.5:
+            # Get profile info
+            profile = supabase.table("profiles").select("*").eq("user_id", user_id).execute()
+            username = profile.data[0].get('username', 'Unknown') if profile.data else 'Unknown'
             
-            # Flag if >50% of posts are frozen and user has >3 posts
-            if total_posts > 3 and frozen_count / total_posts > 0.5:
-                # Get profile info
-                profile = supabase.table("profiles").select("*").eq("user_id", user_id).execute()
-                username = profile.data[0].get('username', 'Unknown') if profile.data else 'Unknown'
-                
-                alert = {
-                    "post_id": posts_list[0]['id'],  # Use first post as reference
-                    "alert_type": "Suspicious Account Pattern",
-                    "severity": "medium",
-                    "description": f"User {username} has {frozen_count}/{total_posts} posts frozen ({frozen_count/total_posts*100:.1f}%)",
-                    "detected_at": datetime.now().isoformat(),
-                    "is_resolved": False
-                }
-                
-                # Check if alert already exists for this user
-                existing = supabase.table("fraud_alerts").select("id").eq("alert_type", "Suspicious Account Pattern").eq("description", alert["description"]).execute()
-                if not existing.data:
-                    supabase.table("fraud_alerts").insert(alert).execute()
-                    alerts.append(alert)
-        
-        return alerts
+            alert = {
+                "post_id": post_id,  # Use first post as reference
+                "alert_type": "Suspicious Account Pattern",
+                "severity": "medium",
+                "description": f"User {username} has {frozen_count}/{total_posts} posts frozen ({frozen_count/total_posts*100:.1f}%)",
+                "detected_at": datetime.now().isoformat(),
+                "is_resolved": False
+            }
+            
+            # Check if alert already exists for this user
+            existing = supabase.table("fraud_alerts").select("id").eq("alert_type", "Suspicious Account Pattern").eq("description", alert["description"]).execute()
+            if not existing.data:
+                supabase.table("fraud_alerts").insert(alert).execute()
+                alerts.append(alert)
+    
+    return alerts
+
+# Snapshot stage: scan posts once and hand every page to each detector (1-3)
+def run_post_snapshot_detectors():
+    results = {"suspicious_engagement": [], "rapid_earnings": [], "frozen_patterns": []}
+    user_stats = {}
+    detectors = {
+        "suspicious_engagement": detect_suspicious_engagement,
+        "rapid_earnings": detect_rapid_earnings_growth,
+        "frozen_patterns": lambda posts: tally_frozen_posts(posts, user_stats),
+    }
+    failed = set()
+    
+    try:
+        for posts in scan_posts():
+            for name, detector in detectors.items():
+                if name in failed:
+                    continue
+                try:
+                    results[name].extend(detector(posts))
+                except Exception as e:
+                    # A failing detector is dropped for the rest of the scan; the others keep going
+                    logger.error(f"Error in {name} detection: {e}")
+                    failed.add(name)
     except Exception as e:
-        logger.error(f"Error in detect_frozen_patterns: {e}")
-        return []
+        # Per-user ratios from a partial scan would be wrong, so skip the frozen pattern check
+        logger.error(f"Error scanning posts: {e}")
+        return results
+    
+    if "frozen_patterns" not in failed:
+        try:
+            results["frozen_patterns"] = detect_frozen_patterns(user_stats)
+        except Exception as e:
+            logger.error(f"Error in detect_frozen_patterns: {e}")
+    
+    return results
 
 # 4. Detect Low Quality Content
 def detect_low_quality_content():
@@ -215,9 +246,10 @@ def run_fraud_detection():
     
     try:
         # Run all fraud detection checks
-        suspicious_engagement = detect_suspicious_engagement()
-        rapid_earnings = detect_rapid_earnings_growth()
-        frozen_patterns = detect_frozen_patterns()
+        snapshot = run_post_snapshot_detectors()
+        suspicious_engagement = snapshot["suspicious_engagement"]
+        rapid_earnings = snapshot["rapid_earnings"]
+        frozen_patterns = snapshot["frozen_patterns"]
         low_quality = detect_low_quality_content()
         
         # Combine all alerts
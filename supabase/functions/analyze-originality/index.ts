@@ -11,6 +11,35 @@ interface AnalyzeRequest {
   processAll?: boolean;
 }
 
+interface BatchResult {
+  url: string;
+  original?: boolean;
+  indexed?: boolean;
+  error?: string;
+}
+
+// One request for the whole batch: the analyzer downloads and fingerprints the
+// URLs concurrently and ranks them together. Results come back in request order
+// and are keyed by the URL as sent (the analyzer may normalize the echoed URL).
+async function callAnalyzerBatch(
+  baseUrl: string,
+  endpoint: 'index' | 'analyze',
+  urls: string[],
+  timeoutMs: number,
+): Promise<Map<string, BatchResult>> {
+  const response = await fetch(`${baseUrl}/${endpoint}/batch`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ urls }),
+    signal: AbortSignal.timeout(timeoutMs),
+  });
+  if (!response.ok) {
+    throw new Error(`${response.status} - ${await response.text()}`);
+  }
+  const { results }: { results: BatchResult[] } = await response.json();
+  return new Map(urls.map((url, i) => [url, results[i]]));
+}
+
 serve(async (req) => {
   if (req.method === 'OPTIONS') {
     return new Response(null, { headers: corsHeaders });
@@ -66,7 +95,6 @@ serve(async (req) => {
       );
     }
 
-    const results = [];
     const originality_analyzer_url = Deno.env.get('ORIGINALITY_ANALYZER_URL');
 
     if (!originality_analyzer_url) {
@@ -77,86 +105,63 @@ serve(async (req) => {
       );
     }
 
-    for (const post of posts) {
-      try {
-        console.log(`Analyzing post ${post.id}: ${post.video_url}`);
+    const urls = [...new Set(posts.map((post) => post.video_url))];
+    console.log(`Analyzing ${posts.length} posts (${urls.length} videos)`);
 
-        // First, index the video in the analyzer
-        const indexResponse = await fetch(`${originality_analyzer_url}/index`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ url: post.video_url }),
-          signal: AbortSignal.timeout(30000) // 30 second timeout for video processing
-        });
-        
-        if (!indexResponse.ok) {
-          const errorText = await indexResponse.text();
-          console.warn(`Failed to index video ${post.id}: ${indexResponse.status} - ${errorText}`);
-          // Continue to analysis even if indexing fails
-        } else {
-          console.log(`Successfully indexed video ${post.id}`);
+    // First, index the videos in the analyzer
+    try {
+      const indexed = await callAnalyzerBatch(originality_analyzer_url, 'index', urls, 120000);
+      for (const [url, r] of indexed) {
+        if (r.error) {
+          console.warn(`Failed to index video ${url}: ${r.error}`);
         }
+      }
+    } catch (error) {
+      // Continue to analysis even if indexing fails
+      console.warn(`Failed to index videos: ${error.message}`);
+    }
 
-        // Then analyze for originality
-        const analyzeResponse = await fetch(`${originality_analyzer_url}/analyze`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ url: post.video_url }),
-          signal: AbortSignal.timeout(45000) // 45 second timeout for analysis
-        });
+    // Then analyze them for originality
+    let analyzed: Map<string, BatchResult>;
+    try {
+      analyzed = await callAnalyzerBatch(originality_analyzer_url, 'analyze', urls, 180000);
+    } catch (error) {
+      console.error(`Batch analysis failed: ${error.message}`);
+      return new Response(
+        JSON.stringify({ error: `Analysis service error: ${error.message}` }),
+        { status: 502, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+      );
+    }
 
-        if (!analyzeResponse.ok) {
-          const errorText = await analyzeResponse.text();
-          console.error(`Analysis failed for post ${post.id}: ${analyzeResponse.status} - ${errorText}`);
-          results.push({
-            post_id: post.id,
-            success: false,
-            error: `Analysis service error: ${analyzeResponse.status}`
-          });
-          continue;
-        }
+    const results = await Promise.all(posts.map(async (post) => {
+      const analysis = analyzed.get(post.video_url);
+      if (!analysis || analysis.error || typeof analysis.original !== 'boolean') {
+        const error = analysis?.error ?? 'missing result';
+        console.error(`Analysis failed for post ${post.id}: ${error}`);
+        return { post_id: post.id, success: false, error: `Analysis service error: ${error}` };
+      }
 
-        const analysisResult = await analyzeResponse.json();
-        const isOriginal = analysisResult.original === true;
-        
-        console.log(`Analysis completed for post ${post.id}: ${isOriginal ? 'Original' : 'Not Original'}`);
-
-        // Store quality assessment using service role (bypasses RLS)
-        const { error: insertError } = await supabase
-          .from('quality_assessments')
-          .insert({
-            post_id: post.id,
-            originality_score: isOriginal,
-            overall_grade: isOriginal ? 'original' : 'not_original',
-            assessed_at: new Date().toISOString(),
-            is_final: true
-          });
-
-        if (insertError) {
-          console.error(`Error inserting assessment for post ${post.id}:`, insertError);
-          results.push({
-            post_id: post.id,
-            success: false,
-            error: insertError.message
-          });
-        } else {
-          console.log(`Successfully analyzed post ${post.id}: ${isOriginal ? 'Original' : 'Not Original'}`);
-          results.push({
-            post_id: post.id,
-            success: true,
-            original: isOriginal
-          });
-        }
+      const isOriginal = analysis.original;
+      console.log(`Analysis completed for post ${post.id}: ${isOriginal ? 'Original' : 'Not Original'}`);
 
-      } catch (error) {
-        console.error(`Error processing post ${post.id}:`, error);
-        results.push({
+      // Store quality assessment using service role (bypasses RLS)
+      const { error: insertError } = await supabase
+        .from('quality_assessments')
+        .insert({
           post_id: post.id,
-          success: false,
-          error: error.message
+          originality_score: isOriginal,
+          overall_grade: isOriginal ? 'original' : 'not_original',
+          assessed_at: new Date().toISOString(),
+          is_final: true
         });
+
+      if (insertError) {
+        console.error(`Error inserting assessment for post ${post.id}:`, insertError);
+        return { post_id: post.id, success: false, error: insertError.message };
       }
-    }
+      return { post_id: post.id, success: true, original: isOriginal };
+    }));
+
 
     return new Response(
       JSON.stringify({
@@ -0,0 +1,240 @@
+from __future__ import annotations
+from pathlib import Path
+import numpy as np
+
+from app.config import ANN_NPROBE, ANN_RERANK
+from app.frame_index import _expand_ranges
+
+# ---------------- IVF (+ optional PQ) approximate search for coarse vectors ----------------
+#
+# Spherical k-means splits the corpus into `nlist` cells; a query scores only
+# the rows of its `nprobe` closest cells. Cell membership is stored CSR-style
+# (offsets + row postings sorted by cell) like the frame hash index, and rows
+# added or changed since the last build sit in a small pending set that is
+# checked directly. With PQ, candidates are first scored from m-byte codes
+# (asymmetric lookup tables) and only the best ANN_RERANK are scored exactly.
+
+_ASSIGN_CHUNK = 8192  # rows per assignment matmul
+
+def _nearest(X: np.ndarray, C: np.ndarray) -> np.ndarray:
+    out = np.empty((X.shape[0],), dtype=np.int32)
+    for s in range(0, X.shape[0], _ASSIGN_CHUNK):
+        out[s:s + _ASSIGN_CHUNK] = np.argmax(X[s:s + _ASSIGN_CHUNK] @ C.T, axis=1)
+    return out
+
+def kmeans(X: np.ndarray, k: int, iters: int = 20, seed: int = 0, spherical: bool = True) -> np.ndarray:
+    """Lloyd's k-means on the rows of X (inner-product assignment when spherical); (k, d) float32."""
+    rng = np.random.default_rng(seed)
+    X = np.asarray(X, dtype=np.float32)
+    k = min(k, X.shape[0])
+    C = X[rng.choice(X.shape[0], k, replace=False)].copy()
+    for _ in range(iters):
+        if spherical:
+            a = _nearest(X, C)
+        else:  # squared L2: argmin |x|^2 - 2 x.c + |c|^2
+            a = np.argmax(X @ C.T - 0.5 * (C * C).sum(axis=1)[None, :], axis=1)
+        counts = np.bincount(a, minlength=k)
+        # cell sums via one sort + reduceat (np.add.at is unbuffered and slow)
+        order = np.argsort(a, kind="stable")
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        sums = np.zeros_like(C)
+        sums[nonempty] = np.add.reduceat(X[order], starts, axis=0)
+        empty = counts == 0
+        C = sums / np.maximum(counts, 1)[:, None]
+        if empty.any():  # re-seed empty cells with random rows
+            C[empty] = X[rng.choice(X.shape[0], int(empty.sum()), replace=False)]
+        if spherical:
+            C /= np.linalg.norm(C, axis=1, keepdims=True) + 1e-12
+    return C.astype(np.float32)
+
+class IVFIndex:
+    """
+    Approximate top-k over the rows of one corpus group. Rows are addressed by
+    the group's row numbers; the owner keeps it in sync via set_rows/move/truncate.
+    """
+
+    def __init__(self, centroids: np.ndarray, codebooks: np.ndarray | None = None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)  # (nlist, d)
+        self.codebooks = codebooks  # (m, 256, d / m) float32, or None without PQ
+        self.dim = self.centroids.shape[1]
+        self._assign = np.empty((1024,), dtype=np.int32)
+        self._codes = np.empty((1024, self.pq_m), dtype=np.uint8) if codebooks is not None else None
+        self._size = 0
+        self._offsets = np.zeros((self.nlist + 1,), dtype=np.int64)
+        self._postings = np.empty((0,), dtype=np.int64)
+        self._built = 0                 # rows covered by the CSR lists
+        self._pending: set[int] = set() # rows (re)assigned since the last build
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def pq_m(self) -> int:
+        return 0 if self.codebooks is None else self.codebooks.shape[0]
+
+    # ----- training / persistence -----
+
+    @classmethod
+    def train(cls, X: np.ndarray, nlist: int, pq_m: int = 0, iters: int = 10,
+              sample: int = 64, seed: int = 0) -> "IVFIndex":
+        """Fit centroids (and PQ codebooks) on at most `sample` rows per cell of X."""
+        X = np.asarray(X, dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        if X.shape[0] > nlist * sample:
+            X = X[rng.choice(X.shape[0], nlist * sample, replace=False)]
+        centroids = kmeans(X, nlist, iters=iters, seed=seed)
+        codebooks = None
+        if pq_m:
+            if X.shape[1] % pq_m:
+                raise ValueError(f"PQ subquantizers ({pq_m}) must divide the dimension ({X.shape[1]})")
+            sub = X.shape[1] // pq_m
+            codebooks = np.stack([
+                kmeans(X[:, j * sub:(j + 1) * sub], 256, iters=iters, seed=seed + j, spherical=False)
+                for j in range(pq_m)
+            ])
+        return cls(centroids, codebooks)
+
+    def save(self, path: Path, ids: list[str], watermark: int):
+        """Persist the model plus each row's cell/codes keyed by video id (atomic replace)."""
+        n = self._size
+        arrays = {
+            "centroids": self.centroids,
+            "ids": np.array(ids[:n], dtype=str),
+            "assign": self._assign[:n],
+            "watermark": np.array(watermark, dtype=np.int64),
+        }
+        if self.codebooks is not None:
+            arrays["codebooks"] = self.codebooks
+            arrays["codes"] = self._codes[:n]
+        tmp = Path(path).with_suffix(".tmp.npz")
+        np.savez(tmp, **arrays)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> tuple["IVFIndex", dict]:
+        """(model without rows, saved state: ids/assign/codes/watermark) from save()."""
+        with np.load(path) as z:
+            state = {k: z[k] for k in z.files}
+        return cls(state.pop("centroids"), state.pop("codebooks", None)), state
+
+    # ----- row maintenance (called by the owning group under its lock) -----
+
+    def _reserve(self, n: int):
+        cap = self._assign.shape[0]
+        if n <= cap:
+            return
+        while cap < n:
+            cap *= 2
+        assign = np.empty((cap,), dtype=np.int32)
+        assign[:self._size] = self._assign[:self._size]
+        self._assign = assign
+        if self._codes is not None:
+            codes = np.empty((cap, self.pq_m), dtype=np.uint8)
+            codes[:self._size] = self._codes[:self._size]
+            self._codes = codes
+
+    def encode(self, X: np.ndarray) -> np.ndarray:
+        """PQ codes (n, m) of float32 rows."""
+        sub = self.dim // self.pq_m
+        out = np.empty((X.shape[0], self.pq_m), dtype=np.uint8)
+        for j, cb in enumerate(self.codebooks):
+            part = X[:, j * sub:(j + 1) * sub]
+            out[:, j] = np.argmax(part @ cb.T - 0.5 * (cb * cb).sum(axis=1)[None, :], axis=1)
+        return out
+
+    def set_rows(self, rows: np.ndarray, X: np.ndarray | None = None, assign: np.ndarray | None = None,
+                 codes: np.ndarray | None = None, defer: bool = False):
+        """
+        Assign rows from their float32 vectors X, or restore saved `assign`/`codes`;
+        rows past the end extend the index. `defer` skips the automatic rebuild
+        (for bulk loads that call rebuild() themselves).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0:
+            return
+        if X is not None:
+            X = np.asarray(X, dtype=np.float32).reshape(rows.size, -1)
+        self._reserve(int(rows.max()) + 1)
+        self._assign[rows] = _nearest(X, self.centroids) if assign is None else assign
+        if self._codes is not None:
+            self._codes[rows] = self.encode(X) if codes is None else codes
+        self._size = max(self._size, int(rows.max()) + 1)
+        self._pending.update(rows.tolist())
+        if not defer and len(self._pending) > max(1024, self._built // 10):
+            self.rebuild()
+
+    def move(self, src: int, dst: int):
+        """Row `src` now lives at `dst` (the group swap-removed `dst`)."""
+        self._assign[dst] = self._assign[src]
+        if self._codes is not None:
+            self._codes[dst] = self._codes[src]
+        self._pending.add(dst)
+
+    def truncate(self, size: int):
+        self._size = size
+        self._pending = {r for r in self._pending if r < size}
+
+    def rebuild(self):
+        """Re-sort all rows into the CSR lists and clear the pending set."""
+        a = self._assign[:self._size]
+        order = np.argsort(a, kind="stable")
+        self._postings = order.astype(np.int64)
+        self._offsets = np.zeros((self.nlist + 1,), dtype=np.int64)
+        np.cumsum(np.bincount(a, minlength=self.nlist), out=self._offsets[1:])
+        self._built = self._size
+        self._pending = set()
+
+    # ----- queries -----
+
+    def candidates(self, Q: np.ndarray, nprobe: int = ANN_NPROBE) -> list[np.ndarray]:
+        """Rows in each query's `nprobe` closest cells (stale postings dropped)."""
+        Q = np.atleast_2d(np.asarray(Q, dtype=np.float32))
+        nprobe = max(1, min(nprobe, self.nlist))
+        size, assign = self._size, self._assign
+        offsets, postings = self._offsets, self._postings
+        pending = np.fromiter(self._pending, dtype=np.int64) if self._pending else None
+        cells = np.argpartition(-(Q @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        out = []
+        for probe in cells:
+            starts = offsets[probe]
+            rows = postings[_expand_ranges(starts, offsets[probe + 1] - starts)]
+            if pending is not None:
+                rows = np.concatenate([rows, pending])
+            rows = rows[rows < size]
+            # a row may have been moved/reassigned since the build: keep it only
+            # where it currently belongs
+            rows = rows[np.isin(assign[rows], probe)]
+            out.append(np.unique(rows))
+        return out
+
+    def adc_scores(self, q: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Approximate q . x for the given rows from their PQ codes."""
+        sub = self.dim // self.pq_m
+        tables = np.einsum("mkd,md->mk", self.codebooks, q.reshape(self.pq_m, sub))  # (m, 256)
+        codes = self._codes[rows]
+        return tables[np.arange(self.pq_m)[None, :], codes].sum(axis=1)
+
+    def search(self, Q: np.ndarray, top_k: int, score_rows, nprobe: int = ANN_NPROBE,
+               rerank: int = ANN_RERANK) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Per query: (rows, exact scores) of the approximate top-k, best first.
+        `score_rows(q, rows)` computes exact scores from the owner's vectors.
+        """
+        Q = np.atleast_2d(np.asarray(Q, dtype=np.float32))
+        results = []
+        for q, rows in zip(Q, self.candidates(Q, nprobe)):
+            if self._codes is not None and rows.size > max(rerank, top_k):
+                approx = self.adc_scores(q, rows)
+                keep = np.argpartition(-approx, max(rerank, top_k) - 1)[:max(rerank, top_k)]
+                rows = rows[keep]
+            s = score_rows(q, rows)
+            k = min(top_k, rows.size)
+            if k == 0:
+                results.append((rows[:0], s[:0]))
+                continue
+            best = np.argpartition(-s, k - 1)[:k]
+            best = best[np.argsort(-s[best], kind="stable")]
+            results.append((rows[best], s[best]))
+        return results
@@ -1,103 +1,211 @@
 from __future__ import annotations
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, HttpUrl
-
-from app.netio import download_video
-from app.fetchers import build_video_meta
-from app.fingerprint import fingerprint_video
-from app.store import FingerprintStore
-from app.matcher import rank_matches
-from app.config import NOT_ORIGINAL_THRESHOLD
+import asyncio
+import time
+from typing import Literal
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field, HttpUrl
+
+from app import metrics
+from app.netio import cache_stats
+from app.jobs import Job, QueueFull, get_job_manager
+from app.config import (
+    JOB_WAIT_MAX_SECONDS, MAX_BATCH_URLS, PROFILER_ENDPOINTS, PROFILER_INTERVAL_SECONDS, PROFILER_MAX_SECONDS,
+)
+from app.profiler import get_profiler
+from app.startup import get_warmup
+
+# The corpus (numpy, SQLite, indexes) and the decode / download stack are not
+# imported here: the startup warmup or the first request that needs them loads
+# them, so the process is live as soon as FastAPI is.
 
 app = FastAPI(title="Video Originality Analyzer")
 
+def _corpus_size() -> int:
+    from app.shards import get_corpus
+    return len(get_corpus())
+
+def _verdict_cache():
+    from app.verdicts import get_verdict_cache
+    return get_verdict_cache()
+
 class AnalyzeRequest(BaseModel):
     url: HttpUrl
 
 class IndexRequest(BaseModel):
     url: HttpUrl
 
+class BatchRequest(BaseModel):
+    urls: list[HttpUrl] = Field(min_length=1, max_length=MAX_BATCH_URLS)
+
+class JobRequest(BaseModel):
+    url: HttpUrl
+    kind: Literal["analyze", "index"] = "analyze"
+
+@app.on_event("startup")
+def _startup():
+    get_warmup().start()
+
+@app.on_event("shutdown")
+def _shutdown():
+    get_job_manager().shutdown()
+
+@app.middleware("http")
+async def _time_requests(request: Request, call_next):
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")  # the path template, e.g. /jobs/{job_id}
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint=getattr(route, "path", "unmatched"))
+    return response
+
 @app.get("/health")
 def health():
-    return {"ok": True}
+    """Liveness: answers as soon as the process serves requests; cache and queue stats once warmed up."""
+    if not get_warmup().ready:
+        return {"ok": True, "ready": False}
+    return {"ok": True, "ready": True, "download_cache": cache_stats(), "verdict_cache": _verdict_cache().stats(),
+            "jobs": get_job_manager().depth()}
+
+@app.get("/ready")
+def ready():
+    """Readiness: 200 once the startup warmup has finished, else 503 with its progress (or error)."""
+    status = get_warmup().status()
+    if not status["ready"]:
+        return JSONResponse(status, status_code=503)
+    return status
+
+def _queue_full(e: QueueFull) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
+def _submit(kind: str, url: str) -> tuple[Job, bool]:
+    try:
+        return get_job_manager().submit(kind, url)
+    except QueueFull as e:
+        raise _queue_full(e)
+
+async def _wait(job: Job, timeout: float | None) -> Job:
+    """Wait (without holding a worker thread) until the job finishes or `timeout` passes."""
+    try:
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.future)), timeout)
+    except asyncio.TimeoutError:
+        pass
+    return job
+
+async def _run_blocking(kind: str, url: str, timings: bool = False) -> dict:
+    job, _ = _submit(kind, url)
+    await _wait(job, None)
+    if job.error is not None:
+        raise HTTPException(status_code=500, detail=job.error)
+    return {**job.result, "timings": job.timings} if timings else job.result
+
+# ---------------- job API ----------------
+
+@app.post("/jobs", status_code=202)
+def submit_job(req: JobRequest):
+    """
+    Queue an index/analyze job and return its id right away. A job for the same
+    URL and kind that is still in flight is shared. 429 when the queue is full.
+    """
+    job, dedup = _submit(req.kind, str(req.url))
+    return {**job.to_dict(), "deduplicated": dedup}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0, timings: bool = False):
+    """
+    Job status and result; `wait` > 0 long-polls up to that many seconds for
+    completion, `timings` adds the seconds spent per pipeline stage.
+    """
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job.")
+    if wait > 0 and not job.finished:
+        await _wait(job, min(wait, JOB_WAIT_MAX_SECONDS))
+    return job.to_dict(timings)
+
+# ---------------- synchronous wrappers (same jobs, awaited) ----------------
 
 @app.post("/index")
-def index_url(req: IndexRequest):
+async def index_url(req: IndexRequest, timings: bool = False):
     """
     Download, fingerprint, and store a video for future comparisons.
     Returns a simple boolean for consistency.
     """
-    try:
-        path = download_video(str(req.url))
-        meta = build_video_meta(str(req.url), path)
-        vec = fingerprint_video(path)
-        store = FingerprintStore()
-        store.upsert(meta.id, meta.url, meta.title, vec)
-        return {"indexed": True}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await _run_blocking("index", str(req.url), timings)
 
 @app.post("/analyze")
-def analyze(req: AnalyzeRequest):
+async def analyze(req: AnalyzeRequest, timings: bool = False):
     """
     Returns {"original": true} if the video is original vs DB,
     else {"original": false} if it's the same or very similar.
     Uses a coarse first pass + precise frame-level pHash overlap second pass.
+    ?timings=true adds {"timings": {stage: seconds}} (stages may nest).
     """
-    try:
-        path = download_video(str(req.url))
-        meta = build_video_meta(str(req.url), path)
-        from app.config import NOT_ORIGINAL_THRESHOLD
-        from app.fingerprint import fingerprint_video, frame_phashes, cosine_similarity
-
-        # query features
-        qvec = fingerprint_video(path)
-        qhashes = frame_phashes(path)
-
-        store = FingerprintStore()
-        rows = list(store.all())
-        if not rows:
-            return {"original": True}
-
-        # exact same TikTok id already stored -> NOT original
-        for vid, url, title, _vec in rows:
-            if vid == meta.id:
-                return {"original": False}
-
-        # compare only against fingerprints with same dimensionality
-        corpus = [(vid, url, title, vec) for (vid, url, title, vec) in rows if vec.shape[0] == qvec.shape[0]]
-        if not corpus:
-            return {"original": True}
-
-        # first pass: coarse similarity
-        matches = rank_matches(qvec, corpus, top_k=3)
-        best = matches[0]
-        if best.similarity >= NOT_ORIGINAL_THRESHOLD:
-            return {"original": False}
-
-        # second pass: precise pHash overlap against the best candidate
-        # (re-download candidate video and compute its frame pHashes)
-        candidate_path = download_video(best.url)
-        chashes = frame_phashes(candidate_path)
-
-        # compute fraction of query frames that have a close match in candidate
-        # close = Hamming distance <= 10 bits out of 64
-        def hamming(a: np.uint64, b: np.uint64) -> int:
-            return int((int(a) ^ int(b)).bit_count())
-
-        close = 0
-        for a in qhashes:
-            md = min((hamming(a, b) for b in chashes), default=64)
-            if md <= 10:
-                close += 1
-        overlap = close / max(1, len(qhashes))
-
-        # if enough frames overlap, mark as NOT original
-        if overlap >= 0.25:   # 25% of frames are near-identical
-            return {"original": False}
-
-        # otherwise, treat as original
-        return {"original": True}
+    return await _run_blocking("analyze", str(req.url), timings)
 
+# ---------------- batches ----------------
+
+async def _run_batch(kind: str, urls: list[HttpUrl], timings: bool = False) -> dict:
+    try:
+        fut = get_job_manager().run_batch(kind, [str(u) for u in urls])
+    except QueueFull as e:
+        raise _queue_full(e)
+    try:
+        results, stages = await asyncio.wrap_future(fut)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return {"results": results, "timings": stages} if timings else {"results": results}
+
+@app.post("/index/batch")
+async def index_batch(req: BatchRequest, timings: bool = False):
+    """
+    Index many URLs in one request (downloads and fingerprinting run concurrently).
+    Returns {"results": [{"url", "indexed": true} | {"url", "error"}]} in request order.
+    """
+    return await _run_batch("index", req.urls, timings)
+
+@app.post("/analyze/batch")
+async def analyze_batch(req: BatchRequest, timings: bool = False):
+    """
+    Analyze many URLs in one request; all queries are ranked against the corpus
+    in one matrix product. Returns {"results": [{"url", "original"} | {"url", "error"}]}
+    in request order.
+    """
+    return await _run_batch("analyze", req.urls, timings)
+
+# ---------------- observability ----------------
+
+metrics.Callback("analyzer_corpus_size", "Fingerprints in the corpus (all shards).", _corpus_size)
+metrics.Callback("analyzer_download_cache_events_total", "Download cache lookups and evictions.",
+                 lambda: {k: v for k, v in cache_stats().items() if k != "bytes_evicted"},
+                 kind="counter", labels=("event",))
+metrics.Callback("analyzer_download_cache_evicted_bytes_total", "Bytes evicted from the download cache.",
+                 lambda: cache_stats()["bytes_evicted"], kind="counter")
+metrics.Callback("analyzer_verdict_cache_events_total", "Verdict cache lookups and incremental re-checks.",
+                 lambda: {k: v for k, v in _verdict_cache().stats().items() if k != "entries"},
+                 kind="counter", labels=("event",))
+metrics.Callback("analyzer_verdict_cache_entries", "Video ids in the verdict cache.",
+                 lambda: len(_verdict_cache()))
+metrics.Callback("analyzer_jobs", "Analysis jobs by state.",
+                 lambda: {k: v for k, v in get_job_manager().depth().items() if k != "max_pending"},
+                 labels=("state",))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Stage latency histograms and pipeline counters in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+if PROFILER_ENDPOINTS:
+    @app.post("/debug/profiler/start")
+    def profiler_start(interval: float = PROFILER_INTERVAL_SECONDS, max_seconds: float = PROFILER_MAX_SECONDS):
+        """Start sampling this process' Python stacks every `interval` seconds."""
+        started = get_profiler().start(interval, max_seconds)
+        return {"started": started, **get_profiler().status()}
+
+    @app.get("/debug/profiler")
+    def profiler_status():
+        return get_profiler().status()
+
+    @app.post("/debug/profiler/stop", response_class=PlainTextResponse)
+    def profiler_stop():
+        """Stop sampling; folded stacks ("frame;frame;frame count" lines) for flamegraph tools."""
+        return PlainTextResponse(get_profiler().stop())
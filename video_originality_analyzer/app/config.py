@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Paths
@@ -5,14 +6,84 @@ ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = ROOT / "data"
 TMP_DIR = DATA_DIR / "tmp"
 DB_PATH = DATA_DIR / "fingerprints.sqlite"
+FRAME_INDEX_PATH = DATA_DIR / "frame_hashes.mih"   # append-only log for the frame hash index
+ANN_PATH = DATA_DIR / "ann_ivf.npz"                # trained IVF model for the coarse vectors
+SEGMENT_INDEX_PATH = DATA_DIR / "segments.mih"     # append-only log for the segment signature index
+DOWNLOAD_CACHE_DIR = TMP_DIR / "cache"
+# Directories are created by the code that writes into them (store, download cache), not on import.
 
-DATA_DIR.mkdir(parents=True, exist_ok=True)
-TMP_DIR.mkdir(parents=True, exist_ok=True)
+# ----- Fingerprint store (SQLite, WAL) -----
+# "float32" | "compact" (uint8 codes + per-block scales, ~4x smaller; see app/quantize.py).
+# Applies to new writes and the in-memory index; stored rows of either format are read.
+FINGERPRINT_ENCODING = "float32"
+SQLITE_CACHE_KIB = 64 * 1024               # page cache per connection
+SQLITE_MMAP_BYTES = 256 * 1024 ** 2        # memory-mapped reads of the DB file
+SQLITE_BUSY_TIMEOUT_MS = 10_000            # wait this long for a concurrent writer
+# Append-only memory-mapped copy of the standard-length vectors next to the DB
+# (see app/vecfile.py): every worker maps the same pages instead of loading
+# its own copy from SQLite. The store keeps it in sync after each write.
+SHARED_VECTORS = True
+
+# ----- Shards (see app/shards.py) -----
+# The corpus can be split into partitions by a hash of the video id, each with its
+# own store file and indexes; queries fan out to all of them and merge the top-k.
+SHARDS = 1                                 # local partitions; 1 = the single DB_PATH store
+SHARD_URLS: list[str] = []                 # shard servers (scripts/shard_server.py) used instead when set
+SHARD_TIMEOUT_SECONDS = 30                 # per shard request
+
+# ----- Download cache -----
+DOWNLOAD_CACHE_MAX_BYTES = 5 * 1024 ** 3   # disk budget; least-recently-used entries evicted beyond it
+DOWNLOAD_CACHE_LOW_WATER = 0.9             # eviction frees space down to this fraction of the budget
+DOWNLOAD_CACHE_MODE = "keep"               # "keep" (LRU cache) | "ephemeral" (delete after fingerprinting)
+RESOLVER_CACHE_SIZE = 100_000              # URL -> video id entries kept in memory
+
+# ----- Analysis jobs (see app/jobs.py) -----
+DOWNLOAD_CONCURRENCY = 4                   # simultaneous media transfers (cache hits don't count)
+FINGERPRINT_WORKERS = os.cpu_count() or 2  # processes decoding + hashing frames
+JOB_WORKERS = 16                           # threads orchestrating jobs (they mostly wait on I/O / the pool)
+MAX_PENDING_JOBS = 256                     # queued + running; beyond it submissions get 429
+JOB_TTL_SECONDS = 600                      # finished jobs stay pollable this long
+JOB_WAIT_MAX_SECONDS = 60                  # longest long-poll a client may ask for
+MAX_BATCH_URLS = 100                       # URLs per /analyze/batch or /index/batch request
+
+# ----- Analyze verdict cache (see app/verdicts.py) -----
+# Repeat analyses of a known video id skip the download: the cached verdict is
+# re-checked against only the fingerprints indexed since it was decided.
+VERDICT_CACHE_SIZE = 20_000                # video ids remembered (LRU); 0 = off
+VERDICT_CACHE_TTL_SECONDS = 24 * 3600      # older entries are recomputed from scratch
+VERDICT_RECHECK_MAX_ROWS = 5_000           # more corpus rows added since than this -> recompute instead
+
+# ----- Observability (see app/metrics.py, app/profiler.py) -----
+# Stage timings and counters are always recorded and served on GET /metrics;
+# ?timings=true on a request adds its own per-stage breakdown to the response.
+# The profiler endpoints are unauthenticated: only turn them on where the port
+# isn't reachable from outside.
+PROFILER_ENDPOINTS = False                 # POST /debug/profiler/start|stop (sampling profiler)
+PROFILER_INTERVAL_SECONDS = 0.005          # default sampling period
+PROFILER_MAX_SECONDS = 300                 # a started profiler stops itself after at most this long
+
+# ----- Startup (see app/startup.py) -----
+# Load the corpus indexes, the decode / download stack and the fingerprinting
+# workers on a background thread at startup; GET /ready answers 200 once done.
+WARMUP_ON_STARTUP = True                   # False: ready at once, everything loads on first use
 
 # ----- Fingerprint + accuracy settings -----
 FRAME_SAMPLES = 64          # more frames => better accuracy
 HASH_SIZE = 8               # 8x8 => 64 bits per hash
 
+# Frame decoding strategy: "auto" | "seek" | "sequential" | "keyframe" (see app/frames.py)
+FRAME_SOURCE_MODE = "auto"
+GOP_PROBE_PACKETS = 600     # packets scanned (demux only) to estimate the GOP size
+DEFAULT_GOP = 250           # assumed GOP when it can't be probed (x264 default keyint)
+
+# Streaming ingest (needs ffmpeg): fingerprint straight from the media URL at the
+# lowest usable resolution instead of downloading the full file first.
+# Stream fingerprints come from a rescaled source, so they are close to, not
+# bit-identical with, download fingerprints of the same video.
+STREAM_INGEST = False
+STREAM_MIN_SIDE = 292       # 256 / (1 - 2 * CENTER_CROP_MARGIN): still >= 256 px after the crop
+STREAM_DECODE_SIZE = 292    # ffmpeg scales sampled frames to this square at decode time
+
 # These are required by fingerprint.py (advanced features)
 EDGE_GRID = 4               # edge histogram grid (4x4)
 HSV_BINS = (8, 8, 8)        # HSV histogram bins (H,S,V) = 512-dim hist
@@ -22,5 +93,47 @@ CENTER_CROP_MARGIN = 0.06   # crop borders (6%) to ignore letterboxing
 # Decision rule: if similarity >= threshold -> NOT original (return {"original": false})
 NOT_ORIGINAL_THRESHOLD = 0.90
 
+# Second pass: frame-level pHash overlap against the best coarse candidates
+SECOND_PASS_TOP_K = 3          # candidates re-ranked by frame overlap
+HAMMING_MAX_BITS = 10          # frames "close" if <= 10 of 64 bits differ
+FRAME_OVERLAP_THRESHOLD = 0.25 # >= 25% of query frames close -> NOT original
+
+# Progressive sampling for analyze: decode a small evenly spaced sample first and
+# stop as soon as the verdict is clear; only videos close to a threshold get the
+# full FRAME_SAMPLES decode. Downloaded files only (not STREAM_INGEST). With
+# SEGMENTS_ENABLED, an early "original" also needs the sampled frames to be at
+# most (SEGMENT_MIN_RUN - 1) * SEGMENT_SECONDS apart (at the last stage of 16
+# frames: videos up to about 50 s) and none close to an indexed segment; longer
+# videos get the full decode for that verdict. "Not original" ends early as before.
+PROGRESSIVE_SAMPLING = False
+PROGRESSIVE_STAGES = (8, 16)   # partial sample sizes tried, in order, before the full decode
+SIMILARITY_BAND = 0.05         # best coarse similarity within this of NOT_ORIGINAL_THRESHOLD -> decode more
+OVERLAP_BAND = 0.15            # frame overlap within this of FRAME_OVERLAP_THRESHOLD -> decode more
+
+# Segment fingerprints (see app/segments.py): besides the 64-frame sample, the
+# video timeline is hashed in fixed windows, so a clip lifted from a longer
+# video is found through an inverted index as a time-aligned run of matching
+# windows, with its offset. Downloaded files only (not STREAM_INGEST).
+# Opt-in: the timeline is decoded at SEGMENT_FRAMES / SEGMENT_SECONDS frames per
+# second on top of the sample (3-min 640x360 clip: 423 frames, 1.7-2.1 s to
+# fingerprint vs 64 frames, 0.5-0.9 s without). Turning it on needs a re-index.
+SEGMENTS_ENABLED = False
+SEGMENT_SECONDS = 2.0          # window length (changing it needs a re-index)
+SEGMENT_FRAMES = 4             # frames hashed per window, one every SEGMENT_SECONDS / SEGMENT_FRAMES
+SEGMENT_MAX_WINDOWS = 900      # timeline hashed up to 30 min at 2 s windows
+SEGMENT_HAMMING_MAX_BITS = 10  # window signatures "close" if <= 10 of 64 bits differ
+SEGMENT_MIN_RUN = 4            # consecutive aligned windows (8 s) -> NOT original
+
+# Approximate first pass (IVF + optional PQ, see app/ann.py); built by scripts/build_ann.py
+ANN_MIN_ROWS = 50_000          # smaller groups always use the exact scan
+ANN_NLIST = 0                  # k-means cells; 0 = 4 * sqrt(rows)
+ANN_NPROBE = 16                # cells scanned per query: the recall / latency knob
+ANN_PQ_M = 0                   # PQ sub-quantizers (must divide 736, e.g. 46 or 92); 0 = off
+ANN_RERANK = 256               # with PQ: candidates re-scored exactly
+
+# Corpus-wide frame hash index (multi-index hashing over 64-bit pHashes)
+MIH_BANDS = 4                  # 4 x 16-bit bands; band radius = HAMMING_MAX_BITS // MIH_BANDS
+MIH_MAX_BUCKET = 50_000        # skip "stop-word" buckets (black/blank frames shared by everything)
+
 # Small floor used elsewhere if needed
 MIN_ORIGINALITY = 0.01
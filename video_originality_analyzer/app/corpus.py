@@ -0,0 +1,455 @@
+from __future__ import annotations
+import threading
+import numpy as np
+
+from app.matcher import Match, top_k_indices
+from app import quantize
+from app.ann import IVFIndex
+from app.config import (
+    FINGERPRINT_ENCODING, SHARED_VECTORS, DB_PATH, ANN_PATH, ANN_MIN_ROWS, ANN_NLIST, ANN_NPROBE, ANN_PQ_M
+)
+from app.metrics import timed
+from app.store import FingerprintStore
+from app.vecfile import VectorFile
+
+# ---------------- process-resident corpus index ----------------
+
+class _Group:
+    """
+    All fingerprints of one vector length, packed into one matrix: float32, or
+    uint8 codes + per-block scales when `compact` (see app/quantize.py).
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024, compact: bool = False):
+        self.dim = dim
+        self.compact = compact
+        self.matrix = np.empty((capacity, dim), dtype=np.uint8 if compact else np.float32)
+        self.scales = np.empty((capacity, quantize.N_BLOCKS), dtype=np.float32) if compact else None
+        self.ids: list[str] = []
+        self.urls: list[str] = []
+        self.titles: list[str | None] = []
+        self.ann: IVFIndex | None = None  # kept in sync row for row when attached
+        self._viewed = False  # matrix/scales handed out by view(), maybe still being scored
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    def float_rows(self, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """float32 copy of rows [start, stop) (dequantized in a compact group)."""
+        stop = self.size if stop is None else stop
+        if not self.compact:
+            return self.matrix[start:stop]
+        return quantize.decode(self.matrix[start:stop], self.scales[start:stop])
+
+    def _reserve(self, n: int):
+        cap = self.matrix.shape[0]
+        if n <= cap:
+            return
+        while cap < n:
+            cap *= 2
+        grown = np.empty((cap, self.dim), dtype=self.matrix.dtype)
+        grown[:self.size] = self.matrix[:self.size]
+        self.matrix = grown
+        if self.compact:
+            scales = np.empty((cap, quantize.N_BLOCKS), dtype=np.float32)
+            scales[:self.size] = self.scales[:self.size]
+            self.scales = scales
+        self._viewed = False
+
+    def set_row(self, row: int, vec: np.ndarray | None, encoded: tuple[np.ndarray, np.ndarray] | None = None):
+        """Write a float32 vector, or (codes, scales) straight into a compact group."""
+        if not self.compact:
+            self.matrix[row] = vec if vec is not None else quantize.decode(*encoded)[0]
+        else:
+            codes, scales = encoded if encoded is not None else quantize.encode(vec)
+            self.matrix[row] = codes.reshape(-1)
+            self.scales[row] = scales.reshape(-1)
+        if self.ann is not None:
+            self.ann.set_rows(np.array([row]), self.float_rows(row, row + 1))
+
+    def append(self, video_id: str, url: str, title: str | None, vec: np.ndarray | None,
+               encoded: tuple[np.ndarray, np.ndarray] | None = None) -> int:
+        row = self.size
+        self._reserve(row + 1)
+        self.set_row(row, vec, encoded)
+        self.ids.append(video_id)
+        self.urls.append(url)
+        self.titles.append(title)
+        return row
+
+    def remove(self, row: int) -> str | None:
+        """Swap-remove a row; returns the id that moved into `row` (if any)."""
+        last = self.size - 1
+        moved = None
+        # copy-on-write so readers holding the old lists and arrays stay consistent:
+        # once viewed, the row moved here and the slot freed for the next append
+        # belong to a snapshot that is scored outside the lock
+        ids, urls, titles = list(self.ids), list(self.urls), list(self.titles)
+        if self._viewed:
+            self.matrix = self.matrix.copy()
+            if self.compact:
+                self.scales = self.scales.copy()
+            self._viewed = False
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            if self.compact:
+                self.scales[row] = self.scales[last]
+            ids[row], urls[row], titles[row] = ids[last], urls[last], titles[last]
+            moved = ids[row]
+            if self.ann is not None:
+                self.ann.move(last, row)
+        ids.pop(); urls.pop(); titles.pop()
+        self.ids, self.urls, self.titles = ids, urls, titles
+        if self.ann is not None:
+            self.ann.truncate(last)
+        return moved
+
+    def view(self) -> tuple[list[str], list[str] | None, list[str | None] | None, np.ndarray,
+                            np.ndarray | None, np.ndarray | None]:
+        """
+        Consistent (ids, urls, titles, rows, scales, alive) snapshot; call under the
+        index lock. urls/titles are None when they live in the store only, alive is
+        None when every row is live.
+        """
+        n = len(self.ids)
+        self._viewed = True
+        return self.ids, self.urls, self.titles, self.matrix[:n], \
+            (self.scales[:n] if self.compact else None), None
+
+    def attach_ann(self, ann: IVFIndex, saved: dict | None = None, stale: set[str] = frozenset()):
+        """
+        Index every row with `ann`, reusing saved cells/codes (IVFIndex.load) for
+        ids not in `stale`; the rest are assigned from their vectors.
+        """
+        n = self.size
+        reuse = np.zeros((n,), dtype=bool)
+        if saved is not None and saved["ids"].size:
+            pos = {vid: i for i, vid in enumerate(saved["ids"].tolist())}
+            src = np.array([pos.get(vid, -1) if vid not in stale else -1 for vid in self.ids], dtype=np.int64)
+            reuse = src >= 0
+            rows = np.flatnonzero(reuse)
+            ann.set_rows(rows, assign=saved["assign"][src[rows]],
+                         codes=saved["codes"][src[rows]] if "codes" in saved else None, defer=True)
+        todo = np.flatnonzero(~reuse)
+        for s in range(0, todo.size, 8192):
+            part = todo[s:s + 8192]
+            X = quantize.decode(self.matrix[part], self.scales[part]) if self.compact else self.matrix[part]
+            ann.set_rows(part, X, defer=True)
+        ann.rebuild()
+        self.ann = ann
+
+    @staticmethod
+    def scores(M: np.ndarray, scales: np.ndarray | None, Q: np.ndarray) -> np.ndarray:
+        """(queries, rows) cosine scores of a (queries, dim) float32 stack against a view."""
+        if scales is None:
+            return Q @ M.T
+        return quantize.scores_many(M, scales, Q)
+
+class _MappedGroup(_Group):
+    """
+    The store's shared vector file (app/vecfile.py) as a group: rows are the
+    file's read-only pages and only ever appended. A re-indexed video gets a new
+    row and its old one is marked dead; urls/titles stay in the store and are
+    looked up for the matches only.
+    """
+
+    def __init__(self, vectors: VectorFile, store: FingerprintStore):
+        super().__init__(vectors.dim, capacity=0, compact=vectors.fmt == quantize.FORMAT_COMPACT)
+        self.vectors = vectors
+        self.store = store
+        self.urls = self.titles = None
+        self.alive = np.zeros((0,), dtype=bool)
+        self.dead = 0
+        self.generation = -1   # file header generation last pulled
+        self.ids_bytes = 0
+        self.watermark = 0     # store seq covered by the rows pulled so far
+        self.epoch = 0         # file header epoch the pulled rows belong to
+
+    def pull(self) -> tuple[list[str], list[tuple[int, str]]]:
+        """
+        Map rows published since the last pull. Returns the ids dropped because
+        the file was refilled for another store (see app/vecfile.py), then the
+        new rows' (row, video_id).
+        """
+        h = self.vectors.header()
+        if h.generation == self.generation:
+            return [], []
+        dropped: list[str] = []
+        if h.epoch != self.epoch:
+            dropped, self.ids = self.ids, []
+            self.ids_bytes, self.dead, self.epoch = 0, 0, h.epoch
+            if self.ann is not None:
+                self.ann.truncate(0)
+                self.ann.rebuild()
+        start = self.size
+        new_ids = self.vectors.read_ids(self.ids_bytes, h.ids_bytes)
+        if h.count > self.matrix.shape[0]:
+            self.matrix, self.scales = self.vectors.map()
+            alive = np.empty((self.matrix.shape[0],), dtype=bool)
+            alive[:start] = self.alive[:start]
+            self.alive = alive
+        self.alive[start:h.count] = True
+        self.ids = self.ids + new_ids  # copy-on-write, like remove()
+        self.generation, self.ids_bytes, self.watermark = h.generation, h.ids_bytes, h.watermark
+        if self.ann is not None and new_ids:
+            self.ann.set_rows(np.arange(start, h.count), self.float_rows(start, h.count))
+        return dropped, list(zip(range(start, h.count), new_ids))
+
+    def set_row(self, row, vec, encoded=None):
+        raise TypeError("Shared vector rows are written through the store")
+
+    def append(self, video_id, url, title, vec, encoded=None):
+        raise TypeError("Shared vector rows are written through the store")
+
+    def remove(self, row: int) -> str | None:
+        """Mark a row dead (rows never move)."""
+        if self.alive[row]:
+            self.alive[row] = False
+            self.dead += 1
+        return None
+
+    def view(self):
+        ids, _urls, _titles, M, scales, _ = super().view()
+        return ids, None, None, M, scales, (self.alive[:len(ids)] if self.dead else None)
+
+class CorpusIndex:
+    """
+    In-memory view of the fingerprint store used for first-pass ranking.
+    Vectors are grouped by length; each group is one contiguous matrix,
+    so a query is a single matrix-vector product plus an argpartition top-k.
+    With `compact`, groups of the standard fingerprint length hold the
+    quantized form (about 4x less memory) and are scored on it directly.
+    Loaded from a store with SHARED_VECTORS, the standard-length group is the
+    store's memory-mapped vector file instead, shared by every worker process.
+    """
+
+    def __init__(self, compact: bool = FINGERPRINT_ENCODING == "compact", nprobe: int = ANN_NPROBE):
+        self.compact = compact
+        self.nprobe = nprobe
+        self._groups: dict[int, _Group] = {}
+        self._where: dict[str, tuple[int, int]] = {}  # video_id -> (dim, row)
+        self._lock = threading.Lock()
+        self.watermark = 0  # store seq this index has loaded up to (rows outside the mapped group)
+        self._mapped: _MappedGroup | None = None
+        self._store: FingerprintStore | None = None  # source of refresh() on the query path
+        self._refreshing = threading.Lock()
+
+    @classmethod
+    def from_store(cls, store: FingerprintStore) -> "CorpusIndex":
+        index = cls()
+        index._store = store
+        if SHARED_VECTORS:
+            index.map_vectors(store)
+        index.refresh(store)
+        return index
+
+    def map_vectors(self, store: FingerprintStore):
+        """Serve the standard-length group from the store's shared vector file (before any load)."""
+        vectors = store.vectors()
+        if self.compact != (vectors.fmt == quantize.FORMAT_COMPACT) or vectors.dim in self._groups:
+            raise ValueError("The vector file must match the index encoding and be mapped before loading")
+        self._mapped = self._groups[vectors.dim] = _MappedGroup(vectors, store)
+
+    def _pull(self) -> int:
+        """Pick up rows other processes published to the shared vector file."""
+        group = self._mapped
+        with self._lock:
+            dropped, new = group.pull()
+            for vid in dropped:
+                if self._where.get(vid, (None,))[0] == group.dim:
+                    del self._where[vid]
+            for row, vid in new:
+                loc = self._where.get(vid)
+                if loc is not None:
+                    old_dim, old_row = loc
+                    moved = self._groups[old_dim].remove(old_row)
+                    if moved is not None:
+                        self._where[moved] = (old_dim, old_row)
+                self._where[vid] = (group.dim, row)
+        return len(new)
+
+    def refresh(self, store: FingerprintStore | None = None) -> int:
+        """
+        Load rows written to the store since the last load (e.g. by other
+        workers); returns how many. Queries call it through _catch_up().
+        """
+        store = store or self._store
+        top = store.version()  # rows up to here are loaded below or live in the mapped group
+        n = 0
+        skip = None
+        if self._mapped is not None:
+            store.sync_vectors()  # first use / rows written with SHARED_VECTORS off
+            n += self._pull()
+            skip = self._mapped.dim
+        cols = ("video_id", "url", "title", "vec_len", "vec_format", "vec_blob", "seq")
+        for vid, url, title, dim, fmt, blob, seq in store.iter_rows(cols, since=self.watermark, skip_vec_len=skip):
+            if fmt == quantize.FORMAT_COMPACT and self.compact:
+                self._put(vid, url, title, dim, None, quantize.from_blob(blob))  # no float32 round trip
+            else:
+                self._put(vid, url, title, dim, quantize.vec_from_blob(fmt, blob), None)
+            self.watermark = max(self.watermark, seq)
+            n += 1
+        self.watermark = max(self.watermark, top)
+        return n
+
+    def _catch_up(self):
+        """refresh() when the store has moved past the watermark: one MAX(seq) lookup otherwise."""
+        if self._store is None or self._store.version() <= self.watermark:
+            return
+        if self._refreshing.acquire(blocking=False):  # a concurrent query is already loading them
+            try:
+                self.refresh()
+            finally:
+                self._refreshing.release()
+
+    # ----- approximate search -----
+
+    def build_ann(self, dim: int = quantize.COMPACT_DIM, nlist: int = ANN_NLIST,
+                  pq_m: int = ANN_PQ_M, seed: int = 0) -> IVFIndex:
+        """Train an IVF(-PQ) model on the group of length `dim` and attach it."""
+        with self._lock:
+            group = self._groups.get(dim)
+            if group is None or group.size == 0:
+                raise ValueError(f"No fingerprints of length {dim} to train on.")
+            n = group.size
+            nlist = nlist or int(np.clip(4 * np.sqrt(n), 16, 65536))
+            sample = np.random.default_rng(seed).choice(n, min(n, nlist * 64), replace=False)
+            X = group.float_rows()[np.sort(sample)]
+        ann = IVFIndex.train(X, nlist, pq_m=pq_m, seed=seed)
+        with self._lock:
+            group.attach_ann(ann)
+        return ann
+
+    def attach_ann(self, ann: IVFIndex, saved: dict | None = None, stale: set[str] = frozenset()):
+        with self._lock:
+            group = self._groups.get(ann.dim)
+            if group is not None:
+                group.attach_ann(ann, saved, stale)
+
+    def save_ann(self, path=ANN_PATH):
+        """Persist every attached model with its rows' cells, stamped with the store watermark its rows cover."""
+        with self._lock:
+            for group in self._groups.values():
+                if group.ann is not None:
+                    watermark = group.watermark if group is self._mapped else self.watermark
+                    group.ann.save(path, group.ids, watermark)
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, video_id: str) -> bool:
+        self._catch_up()
+        if self._mapped is not None:
+            self._pull()
+        return video_id in self._where
+
+    def add(self, video_id: str, url: str, title: str | None, vec: np.ndarray):
+        """
+        Insert or replace a fingerprint in place. Vectors of the mapped length
+        are not copied: the row must already be in the store, and is picked up
+        from the shared vector file.
+        """
+        vec = np.asarray(vec, dtype=np.float32).reshape(-1)
+        if self._mapped is not None and vec.shape[0] == self._mapped.dim:
+            self._pull()
+            return
+        self._put(video_id, url, title, int(vec.shape[0]), vec, None)
+
+    def _put(self, video_id: str, url: str, title: str | None, dim: int,
+             vec: np.ndarray | None, encoded: tuple[np.ndarray, np.ndarray] | None):
+        with self._lock:
+            loc = self._where.get(video_id)
+            if loc is not None:
+                old_dim, row = loc
+                group = self._groups[old_dim]
+                if old_dim == dim:
+                    group.set_row(row, vec, encoded)
+                    group.urls[row] = url
+                    group.titles[row] = title
+                    return
+                moved = group.remove(row)
+                if moved is not None:
+                    self._where[moved] = (old_dim, row)
+                del self._where[video_id]
+            group = self._groups.get(dim)
+            if group is None:
+                group = self._groups[dim] = _Group(dim, compact=self.compact and quantize.compactable(dim))
+            self._where[video_id] = (dim, group.append(video_id, url, title, vec, encoded))
+
+    def search(self, query_vec: np.ndarray, top_k: int = 5) -> list[Match]:
+        """Top-k cosine matches among fingerprints with the query's dimensionality."""
+        return self.search_many([query_vec], top_k)[0]
+
+    @timed("rank")
+    def search_many(self, query_vecs: list[np.ndarray], top_k: int = 5) -> list[list[Match]]:
+        """search() for many queries: one matrix product per vector length."""
+        qs = [np.asarray(q, dtype=np.float32).reshape(-1) for q in query_vecs]
+        out: list[list[Match]] = [[] for _ in qs]
+        self._catch_up()
+        if self._mapped is not None:
+            self._pull()
+        by_dim: dict[int, list[int]] = {}
+        for i, q in enumerate(qs):
+            by_dim.setdefault(int(q.shape[0]), []).append(i)
+        for dim, rows in by_dim.items():
+            with self._lock:
+                group = self._groups.get(dim)
+                if group is None or group.size == 0:
+                    continue
+                ids, urls, titles, M, scales, alive = group.view()
+                ann = group.ann if group.size >= ANN_MIN_ROWS else None
+                store = group.store if group is self._mapped else None
+            Q = np.stack([qs[i] for i in rows])
+            hits: list[tuple[int, list[tuple[int, float]]]] = []
+            if ann is not None:
+                def score_rows(q, sel):
+                    return _Group.scores(M[sel], None if scales is None else scales[sel], q[None, :])[0]
+                k = top_k if alive is None else top_k + 8  # slack for superseded rows
+                for (sel, sims), i in zip(ann.search(Q, k, score_rows, nprobe=self.nprobe), rows):
+                    hits.append((i, [(int(j), float(np.clip(v, 0.0, 1.0))) for j, v in zip(sel, sims)]))
+            else:
+                sims = _Group.scores(M, scales, Q)  # (queries, corpus)
+                if alive is not None:
+                    sims[:, ~alive] = -np.inf
+                for s, i in zip(sims, rows):
+                    hits.append((i, [(int(j), float(np.clip(s[j], 0.0, 1.0))) for j in top_k_indices(s, top_k)
+                                     if np.isfinite(s[j])]))
+            if alive is not None:
+                hits = [(i, [(j, v) for j, v in h if alive[j]][:top_k]) for i, h in hits]
+            meta = None
+            if urls is None:  # mapped group: metadata comes from the store
+                meta = store.get_meta([ids[j] for _, h in hits for j, _ in h])
+            for i, h in hits:
+                out[i] = [
+                    Match(video_id=ids[j], similarity=v,
+                          url=urls[j] if meta is None else meta.get(ids[j], ("", None))[0],
+                          title=titles[j] if meta is None else meta.get(ids[j], ("", None))[1])
+                    for j, v in h
+                ]
+        return out
+
+_INDEXES: dict[str, CorpusIndex] = {}
+_INDEX_LOCK = threading.Lock()
+
+@timed("store_load")
+def load_corpus_index(store: FingerprintStore, ann_path=ANN_PATH) -> CorpusIndex:
+    """Index over `store`, with the saved ANN model at `ann_path` attached when there is one."""
+    index = CorpusIndex.from_store(store)
+    if ann_path.exists():
+        ann, saved = IVFIndex.load(ann_path)
+        # rows written after the model was saved get fresh cell assignments
+        stale = {vid for (vid,) in store.iter_rows(("video_id",), since=int(saved["watermark"]))}
+        index.attach_ann(ann, saved, stale)
+    return index
+
+def get_corpus_index(db_path=DB_PATH, ann_path=ANN_PATH) -> CorpusIndex:
+    """Process-wide index of one store file, loaded on first use."""
+    key = str(db_path)
+    index = _INDEXES.get(key)
+    if index is None:
+        with _INDEX_LOCK:
+            index = _INDEXES.get(key)
+            if index is None:
+                index = _INDEXES[key] = load_corpus_index(FingerprintStore(db_path), ann_path)
+    return index
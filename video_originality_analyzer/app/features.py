@@ -0,0 +1,128 @@
+from __future__ import annotations
+import math
+from functools import lru_cache
+import numpy as np
+
+from app.config import HASH_SIZE, EDGE_GRID, HSV_BINS
+from app.lazyimport import lazy_module
+
+cv2 = lazy_module("cv2")
+fftpack = lazy_module("scipy.fftpack")
+Image = lazy_module("PIL.Image")
+
+# ---------------- batched per-frame features ----------------
+#
+# Vectorized equivalent of fingerprint._per_frame_feature for a stack of
+# (n, 256, 256, 3) BGR frames. The hashes reproduce imagehash bit for bit:
+# PIL's RGB->L conversion runs once on the stacked frames, its fixed-point
+# Lanczos resampler is replayed with integer-valued float64 matrix products
+# (exact), and the pHash DCT uses the same scipy.fftpack transform imagehash
+# calls, applied along a batch axis.
+
+_PIL_PRECISION_BITS = 32 - 8 - 2
+
+def _lanczos(x: float) -> float:
+    if -3.0 <= x < 3.0:
+        return _sinc(x) * _sinc(x / 3.0)
+    return 0.0
+
+def _sinc(x: float) -> float:
+    if x == 0.0:
+        return 1.0
+    x *= math.pi
+    return math.sin(x) / x
+
+@lru_cache(maxsize=None)
+def _pil_resample_matrix(in_size: int, out_size: int) -> np.ndarray:
+    """(out, in) fixed-point Lanczos weights exactly as PIL's precompute/normalize_coeffs_8bpc."""
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = 3.0 * filterscale
+    K = np.zeros((out_size, in_size), dtype=np.float64)
+    for xx in range(out_size):
+        center = (xx + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size) - xmin
+        w = [_lanczos((x + xmin - center + 0.5) / filterscale) for x in range(xmax)]
+        ww = sum(w)
+        for x in range(xmax):
+            k = w[x] / ww if ww != 0.0 else w[x]
+            K[xx, xmin + x] = int(-0.5 + k * (1 << _PIL_PRECISION_BITS)) if k < 0 \
+                else int(0.5 + k * (1 << _PIL_PRECISION_BITS))
+    return K
+
+def _pil_clip8(acc: np.ndarray) -> np.ndarray:
+    acc = acc + float(1 << (_PIL_PRECISION_BITS - 1))
+    return np.clip(np.floor(acc / float(1 << _PIL_PRECISION_BITS)), 0, 255)
+
+def _pil_resize_many(gray: np.ndarray, sizes: list[tuple[int, int]]) -> list[np.ndarray]:
+    """
+    PIL Image.resize((w, h), LANCZOS) of a (n, H, W) stack of 8-bit L images to
+    several sizes at once: all horizontal passes share one matrix product.
+    """
+    n, h, w = gray.shape
+    x = gray.astype(np.float64)
+    Kh = np.concatenate([_pil_resample_matrix(w, ow) for ow, _ in sizes])
+    horiz = _pil_clip8(x @ Kh.T)  # (n, H, sum of widths); PIL runs the horizontal pass first
+    out, col = [], 0
+    for ow, oh in sizes:
+        part = horiz[:, :, col:col + ow]
+        col += ow
+        if oh != h:
+            part = _pil_clip8(np.matmul(_pil_resample_matrix(h, oh), part))
+        out.append(part)  # integer-valued float64, 0..255
+    return out
+
+def _pil_gray(frames_bgr: np.ndarray) -> np.ndarray:
+    """PIL convert('L') of the RGB frames, run once on the whole stack as one tall image."""
+    n, h, w, _ = frames_bgr.shape
+    rgb = cv2.cvtColor(frames_bgr.reshape(n * h, w, 3), cv2.COLOR_BGR2RGB)
+    return np.asarray(Image.fromarray(rgb).convert("L")).reshape(n, h, w)
+
+def hash_bits(frames_bgr: np.ndarray) -> np.ndarray:
+    """(n, 192) float32 pHash+dHash+aHash bits, identical to fingerprint._hash_bits per frame."""
+    n = frames_bgr.shape[0]
+    hs = HASH_SIZE
+    small, d, a = _pil_resize_many(_pil_gray(frames_bgr), [(hs * 4, hs * 4), (hs + 1, hs), (hs, hs)])
+
+    dct = fftpack.dct(fftpack.dct(small, axis=1), axis=2)
+    low = dct[:, :hs, :hs].reshape(n, -1)
+    ph = low > np.median(low, axis=1, keepdims=True)
+
+    dh = (d[:, :, 1:] > d[:, :, :-1]).reshape(n, -1)
+
+    a = a.reshape(n, -1)
+    ah = a > a.mean(axis=1, keepdims=True)
+
+    return np.concatenate([ph, dh, ah], axis=1).astype(np.float32)
+
+def hsv_hist(frames_bgr: np.ndarray) -> np.ndarray:
+    """(n, 512) normalized HSV histograms; one color conversion for the whole stack."""
+    n, h, w, _ = frames_bgr.shape
+    hsv = cv2.cvtColor(frames_bgr.reshape(n * h, w, 3), cv2.COLOR_BGR2HSV).reshape(n, h, w, 3)
+    # calcHist per frame beats any numpy bincount over n*h*w pixels, and keeps bins identical
+    hist = np.stack([
+        cv2.calcHist([f], [0, 1, 2], None, HSV_BINS, [0, 180, 0, 256, 0, 256]).reshape(-1)
+        for f in hsv
+    ]).astype(np.float32)
+    s = hist.sum(axis=1, keepdims=True) + np.float32(1e-8)
+    return hist / s
+
+def edge_histogram(frames_bgr: np.ndarray) -> np.ndarray:
+    """(n, EDGE_GRID**2) normalized Canny edge densities per tile (reshape-based tiling)."""
+    n, h, w, _ = frames_bgr.shape
+    gray = cv2.cvtColor(frames_bgr.reshape(n * h, w, 3), cv2.COLOR_BGR2GRAY).reshape(n, h, w)
+    edges = np.stack([cv2.Canny(g, 100, 200) for g in gray])  # Canny has no batch form
+    g = EDGE_GRID
+    by, bx = max(1, h // g), max(1, w // g)
+    tiles = (edges[:, :by * g, :bx * g] != 0).reshape(n, g, by, g, bx)
+    v = (tiles.sum(axis=(2, 4)) / float(by * bx)).reshape(n, -1).astype(np.float32)
+    s = v.sum(axis=1, keepdims=True) + np.float32(1e-8)
+    return v / s
+
+def frame_features(frames_bgr: np.ndarray) -> np.ndarray:
+    """(n, 720) per-frame features for cropped + resized (n, 256, 256, 3) BGR frames."""
+    frames_bgr = np.ascontiguousarray(frames_bgr, dtype=np.uint8)
+    return np.concatenate(
+        [hash_bits(frames_bgr), hsv_hist(frames_bgr), edge_histogram(frames_bgr)], axis=1
+    ).astype(np.float32)
@@ -1,28 +1,91 @@
 from __future__ import annotations
+import re
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
-import yt_dlp
+
+from app.config import RESOLVER_CACHE_SIZE
+from app.lazyimport import lazy_module
+from app.metrics import timed
+from app.netio import cached_info
+
+yt_dlp = lazy_module("yt_dlp")
 
 @dataclass
 class VideoMeta:
     url: str
     id: str
     title: str | None
-    filepath: Path
+    filepath: Path | None  # None when fingerprinted from a stream
 
+@timed("metadata")
 def fetch_metadata_only(url: str) -> dict:
     """Return metadata (no download)."""
     ydl_opts = {"quiet": True, "noprogress": True, "skip_download": True}
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         return ydl.extract_info(url, download=False)
 
-def build_video_meta(url: str, filepath: Path) -> VideoMeta:
-    """Build a minimal metadata object; fall back to filename stem if needed."""
+def build_video_meta(url: str, filepath: Path, info: dict | None = None) -> VideoMeta:
+    """
+    Build a minimal metadata object; fall back to filename stem if needed.
+    Pass the info dict from download_video_with_info to skip a second yt-dlp round trip.
+    """
     try:
-        info = fetch_metadata_only(url)
+        if info is None:
+            info = fetch_metadata_only(url)
         vid = info.get("id") or filepath.stem
         title = info.get("title")
     except Exception:
         vid = filepath.stem
         title = None
+    remember_video_id(url, str(vid))
     return VideoMeta(url=url, id=str(vid), title=title, filepath=filepath)
+
+# ---------------- URL -> video id resolution (no media transfer) ----------------
+
+# ids yt-dlp reports for the common short-video hosts, recoverable from the URL alone
+_ID_PATTERNS = [
+    re.compile(r"tiktok\.com/.*?/video/(\d+)"),
+    re.compile(r"(?:youtube\.com/(?:shorts|embed|live)/|youtu\.be/)([A-Za-z0-9_-]{11})"),
+    re.compile(r"youtube\.com/watch\?(?:.*&)?v=([A-Za-z0-9_-]{11})"),
+]
+
+_resolved: OrderedDict[str, str] = OrderedDict()
+_resolved_lock = threading.Lock()
+
+def remember_video_id(url: str, video_id: str):
+    with _resolved_lock:
+        _resolved[url] = video_id
+        _resolved.move_to_end(url)
+        while len(_resolved) > RESOLVER_CACHE_SIZE:
+            _resolved.popitem(last=False)
+
+def resolve_video_id(url: str, allow_network: bool = False) -> str | None:
+    """
+    Best-effort video id for a URL before downloading: in-memory cache, then
+    well-known URL shapes, then the download cache's metadata. Only with
+    allow_network does it fall back to a metadata-only yt-dlp call.
+    """
+    with _resolved_lock:
+        vid = _resolved.get(url)
+        if vid is not None:
+            _resolved.move_to_end(url)
+            return vid
+    for pat in _ID_PATTERNS:
+        m = pat.search(url)
+        if m:
+            vid = m.group(1)
+            break
+    else:
+        info = cached_info(url)
+        vid = str(info["id"]) if info and info.get("id") else None
+    if vid is None and allow_network:
+        try:
+            vid = fetch_metadata_only(url).get("id")
+        except Exception:
+            vid = None
+    if vid is not None:
+        remember_video_id(url, str(vid))
+        return str(vid)
+    return None
@@ -1,13 +1,24 @@
 from __future__ import annotations
+import os
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Iterable
 import numpy as np
-import cv2
-from PIL import Image
-import imagehash
 
+from app.hamming import pack_bits
+from app.frames import KEYFRAME, sample_frames, sample_frames_at, sample_frames_timed
+from app.features import frame_features, hash_bits
+from app.metrics import span, timed_iter
 from app.config import (
-    FRAME_SAMPLES, HASH_SIZE, EDGE_GRID, HSV_BINS, MOTION_BINS, CENTER_CROP_MARGIN
+    FRAME_SAMPLES, FRAME_SOURCE_MODE, HASH_SIZE, EDGE_GRID, HSV_BINS, MOTION_BINS, CENTER_CROP_MARGIN,
+    SEGMENTS_ENABLED, SEGMENT_SECONDS, SEGMENT_FRAMES, SEGMENT_MAX_WINDOWS,
 )
+from app.lazyimport import lazy_module
+
+cv2 = lazy_module("cv2")
+Image = lazy_module("PIL.Image")
+imagehash = lazy_module("imagehash")
 
 # --------------------- helpers ---------------------
 
@@ -19,13 +30,6 @@ def _central_crop(img: np.ndarray, margin: float) -> np.ndarray:
         return img
     return img[dy:h - dy, dx:w - dx]
 
-def _frame_indices(total_frames: int, k: int) -> list[int]:
-    if total_frames <= 0:
-        return []
-    if k >= total_frames:
-        return list(range(total_frames))
-    return list(np.linspace(0, total_frames - 1, num=k, dtype=int))
-
 def _hsv_hist(img_bgr: np.ndarray) -> np.ndarray:
     hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
     hist = cv2.calcHist([hsv], [0, 1, 2], None, HSV_BINS, [0, 180, 0, 256, 0, 256])
@@ -63,9 +67,13 @@ def _hash_bits(pil_im: Image.Image) -> np.ndarray:
 
 # ---------------- coarse per-frame feature (720 dims) ----------------
 
-def _per_frame_feature(img_bgr: np.ndarray) -> np.ndarray:
+def _prepare_frame(img_bgr: np.ndarray) -> np.ndarray:
     img_bgr = _central_crop(img_bgr, CENTER_CROP_MARGIN)
-    img_bgr = cv2.resize(img_bgr, (256, 256), interpolation=cv2.INTER_AREA)
+    return cv2.resize(img_bgr, (256, 256), interpolation=cv2.INTER_AREA)
+
+def _per_frame_feature(img_bgr: np.ndarray) -> np.ndarray:
+    """Reference single-frame implementation; extraction uses features.frame_features."""
+    img_bgr = _prepare_frame(img_bgr)
 
     # hashes (192)
     img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
@@ -79,41 +87,21 @@ def _per_frame_feature(img_bgr: np.ndarray) -> np.ndarray:
     feat = np.concatenate([hbits, hsvh, eh])  # 720
     return feat.astype(np.float32)
 
-# ---------------- video-level fingerprint (736 dims) ----------------
-
-def fingerprint_video(video_path: Path, samples: int = FRAME_SAMPLES) -> np.ndarray:
-    """Coarse video-level vector used for fast first-pass ranking."""
-    cap = cv2.VideoCapture(str(video_path))
-    if not cap.isOpened():
-        raise RuntimeError(f"Cannot open video: {video_path}")
-
-    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    idxs = _frame_indices(total, samples)
-
-    frame_feats: list[np.ndarray] = []
-    motion_vals: list[float] = []
-    prev_gray = None
-
-    for idx in idxs:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-        ok, frame = cap.read()
-        if not ok or frame is None:
-            continue
-
-        frame_feats.append(_per_frame_feature(frame))
-
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        if prev_gray is not None:
-            diff = cv2.absdiff(gray, prev_gray)
-            motion_vals.append(float(diff.mean()) / 255.0)
-        prev_gray = gray
+# ---------------- single-decode extraction ----------------
 
-    cap.release()
+class NoFramesError(RuntimeError):
+    """The video opened but none of the sampled frames could be decoded."""
 
-    if not frame_feats:
-        raise RuntimeError("No frames captured for fingerprint.")
+@dataclass
+class Fingerprint:
+    vec: np.ndarray        # (736,) coarse video-level vector, L2-normalized
+    hashes: np.ndarray     # (n,) packed uint64 frame pHashes
+    motion: np.ndarray     # (n-1,) mean abs gray difference between sampled frames, 0..1
+    frames_decoded: int
+    timeline: np.ndarray | None = None  # (m,) pHashes every SEGMENT_SECONDS / SEGMENT_FRAMES s (app/segments.py)
 
-    M = np.vstack(frame_feats)        # (n, 720)
+def _video_vector(M: np.ndarray, motion_vals: list[float]) -> np.ndarray:
+    # M: (n, 720) per-frame features
     visual_mean = M.mean(axis=0)      # (720,)
 
     if len(motion_vals) == 0:
@@ -130,6 +118,194 @@ def fingerprint_video(video_path: Path, samples: int = FRAME_SAMPLES) -> np.ndar
     vec = np.concatenate([visual_w * visual_mean, motion_w * motion_hist])  # 736
     return _l2_normalize(vec)
 
+def fingerprint_frames(frames: Iterable[np.ndarray]) -> Fingerprint:
+    """
+    Derive everything from one pass over decoded BGR frames (in temporal order):
+    the coarse vector for first-pass ranking and the frame pHashes for the
+    overlap check. Frames are consumed as they arrive, so a streaming source
+    overlaps decode with the per-frame work.
+    """
+    prepared: list[np.ndarray] = []
+    motion_vals: list[float] = []
+    prev_gray = None
+
+    for frame in timed_iter("decode", frames):
+        prepared.append(_prepare_frame(frame))
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if prev_gray is not None:
+            diff = cv2.absdiff(gray, prev_gray)
+            motion_vals.append(float(diff.mean()) / 255.0)
+        prev_gray = gray
+
+    if not prepared:
+        raise NoFramesError("No frames captured for fingerprint.")
+
+    with span("features"):
+        M = frame_features(np.stack(prepared))  # (n, 720), one batched pass
+    # the first 64 feature dims are the frame's pHash bits
+    phash_bits = M[:, :HASH_SIZE * HASH_SIZE] > 0.5
+    return Fingerprint(
+        vec=_video_vector(M, motion_vals),
+        hashes=pack_bits(phash_bits),
+        motion=np.array(motion_vals, dtype=np.float32),
+        frames_decoded=len(prepared),
+    )
+
+class _Timeline:
+    """pHashes of the timed frames, computed in batches as they are decoded; stops at the first gap."""
+
+    def __init__(self, batch: int = 64):
+        self.batch = batch
+        self.next = 0
+        self._pending: list[np.ndarray] = []
+        self._parts: list[np.ndarray] = []
+
+    def add(self, pos: int, frame: np.ndarray):
+        if pos != self.next:
+            return
+        self._pending.append(_prepare_frame(frame))
+        self.next += 1
+        if len(self._pending) >= self.batch:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            with span("segment_hashes"):
+                bits = hash_bits(np.stack(self._pending))[:, :HASH_SIZE * HASH_SIZE] > 0.5
+            self._parts.append(pack_bits(bits))
+            self._pending = []
+
+    def hashes(self) -> np.ndarray:
+        self._flush()
+        return np.concatenate(self._parts) if self._parts else np.empty((0,), dtype=np.uint64)
+
+def extract_fingerprint(video_path: Path, samples: int = FRAME_SAMPLES,
+                        mode: str = FRAME_SOURCE_MODE, segments: bool = SEGMENTS_ENABLED) -> Fingerprint:
+    """
+    Decode each sampled frame of a local file once and fingerprint it.
+    `mode` picks the frame source (seek / sequential / keyframe / auto).
+    With `segments`, the same decode also hashes the timeline for segment
+    signatures (a separate pass in keyframe mode, which has no fixed timing).
+    """
+    if not segments:
+        return fingerprint_frames(frame for _idx, frame in sample_frames(video_path, samples, mode))
+    timeline = _Timeline()
+    step, limit = SEGMENT_SECONDS / SEGMENT_FRAMES, SEGMENT_MAX_WINDOWS * SEGMENT_FRAMES
+    decoded = 0
+
+    def grid():
+        nonlocal decoded
+        for frame, on_grid, pos in sample_frames_timed(video_path, samples, step, limit, mode):
+            decoded += 1
+            if pos is not None:
+                timeline.add(pos, frame)
+            if on_grid:
+                yield frame
+
+    if mode == KEYFRAME:
+        fp = fingerprint_frames(frame for _idx, frame in sample_frames(video_path, samples, mode))
+        decoded = fp.frames_decoded
+        for frame, _on_grid, pos in sample_frames_timed(video_path, 0, step, limit, mode):
+            decoded += 1
+            timeline.add(pos, frame)
+    else:
+        fp = fingerprint_frames(grid())
+    fp.timeline = timeline.hashes()
+    fp.frames_decoded = decoded
+    return fp
+
+def warm_codec() -> int:
+    """
+    Run a tiny synthetic clip through encode, decode and feature extraction so
+    this process has cv2 / PIL / scipy imported and its decoder backend loaded
+    before the first real video. Returns the process id (pool warmup spreads
+    one call per worker).
+    """
+    frames = np.random.default_rng(0).integers(0, 256, (2, 64, 64, 3), dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "warm.avi"
+        writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 25, (64, 64))
+        for frame in frames:
+            writer.write(frame)
+        writer.release()
+        try:
+            extract_fingerprint(path, samples=2, mode="sequential")
+        except RuntimeError:  # no writer/decoder backend (NoFramesError too): warm the feature path only
+            fingerprint_frames(iter(frames))
+    return os.getpid()
+
+# ---------------- progressive (partial) sampling ----------------
+#
+# A partial sample decodes only some positions of the FRAME_SAMPLES grid, as
+# adjacent pairs (p, p + 1): per-frame features and pHashes are exact, and each
+# pair gives one exact motion value of the full sample, so the motion histogram
+# (a large share of the vector) is estimated from the right distribution.
+
+@dataclass
+class FrameSample:
+    grid: int               # frames in the full sample grid of the video
+    positions: np.ndarray   # (n,) decoded grid positions, increasing
+    feats: np.ndarray       # (n, 720) per-frame features
+    motion: np.ndarray      # motion values of decoded neighbour pairs (p, p + 1)
+    seconds: float = 0.0    # video duration; grid position p is at about p * seconds / (grid - 1)
+
+def pair_positions(anchors: list[int]) -> list[int]:
+    return [q for a in anchors for q in (a, a + 1)]
+
+def sample_features(video_path: Path, positions: list[int], samples: int = FRAME_SAMPLES,
+                    mode: str = FRAME_SOURCE_MODE) -> FrameSample:
+    """Decode and featurize the given positions of the video's sample grid."""
+    with span("decode"):
+        grid, seconds, decoded = sample_frames_at(video_path, positions, samples, mode)
+    if not decoded:
+        return FrameSample(grid, np.empty((0,), np.int64), np.empty((0, 720), np.float32),
+                           np.empty((0,), np.float32), seconds)
+    motion, prev = [], None
+    for p, frame in decoded:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if prev is not None and prev[0] == p - 1:
+            motion.append(float(cv2.absdiff(gray, prev[1]).mean()) / 255.0)
+        prev = (p, gray)
+    with span("features"):
+        feats = frame_features(np.stack([_prepare_frame(f) for _p, f in decoded]))
+    return FrameSample(
+        grid=grid,
+        positions=np.array([p for p, _f in decoded], dtype=np.int64),
+        feats=feats,
+        motion=np.array(motion, dtype=np.float32),
+        seconds=seconds,
+    )
+
+def sample_gap(parts: list[FrameSample]) -> float:
+    """Longest stretch of the video (seconds) without a decoded frame in a partial sample."""
+    grid, seconds = parts[0].grid, parts[0].seconds
+    positions = np.unique(np.concatenate([p.positions for p in parts]))
+    if positions.size == 0 or grid < 2:
+        return seconds
+    t = positions * (seconds / (grid - 1))
+    return float(np.diff(np.r_[0.0, t, seconds]).max())
+
+def partial_fingerprint(parts: list[FrameSample]) -> Fingerprint:
+    """Approximate fingerprint from all frames decoded so far."""
+    positions = np.concatenate([p.positions for p in parts])
+    if positions.size == 0:
+        raise NoFramesError("No frames captured for fingerprint.")
+    M = np.concatenate([p.feats for p in parts])[np.argsort(positions, kind="stable")]
+    motion = np.concatenate([p.motion for p in parts])
+    return Fingerprint(
+        vec=_video_vector(M, motion.tolist()),
+        hashes=pack_bits(M[:, :HASH_SIZE * HASH_SIZE] > 0.5),
+        motion=motion,
+        frames_decoded=int(positions.size),
+    )
+
+# ---------------- video-level fingerprint (736 dims) ----------------
+
+def fingerprint_video(video_path: Path, samples: int = FRAME_SAMPLES) -> np.ndarray:
+    """Coarse video-level vector used for fast first-pass ranking."""
+    return extract_fingerprint(video_path, samples, segments=False).vec
+
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     # a and b expected to be L2-normalized
     sim = float(np.dot(a, b))
@@ -139,34 +315,9 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
 
 # ---------------- precise second-pass: frame-level pHashes ----------------
 
-def _pack_bits_to_uint64(bits: np.ndarray) -> np.uint64:
-    """Pack 64 boolean bits into a single uint64 (big-endian)."""
-    val = 0
-    for b in bits.astype(int):
-        val = (val << 1) | (1 if b else 0)
-    return np.uint64(val)
-
 def frame_phashes(video_path: Path, samples: int = FRAME_SAMPLES) -> np.ndarray:
     """Return an array of uint64 pHashes for sampled frames (for overlap check)."""
-    cap = cv2.VideoCapture(str(video_path))
-    if not cap.isOpened():
-        raise RuntimeError(f"Cannot open video: {video_path}")
-
-    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    idxs = _frame_indices(total, samples)
-    out: list[np.uint64] = []
-
-    for idx in idxs:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-        ok, frame = cap.read()
-        if not ok or frame is None:
-            continue
-        frame = _central_crop(frame, CENTER_CROP_MARGIN)
-        frame = cv2.resize(frame, (256, 256), interpolation=cv2.INTER_AREA)
-        pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        h = imagehash.phash(pil, hash_size=HASH_SIZE)  # 8x8 => 64 bits
-        bits = np.array(h.hash, dtype=np.uint8).reshape(-1)  # shape (64,)
-        out.append(_pack_bits_to_uint64(bits))
-
-    cap.release()
-    return np.array(out, dtype=np.uint64)
+    try:
+        return extract_fingerprint(video_path, samples, segments=False).hashes
+    except NoFramesError:
+        return np.empty((0,), dtype=np.uint64)
@@ -0,0 +1,334 @@
+from __future__ import annotations
+import fcntl
+import os
+import struct
+import threading
+from itertools import combinations
+from pathlib import Path
+import numpy as np
+
+from app.config import FRAME_INDEX_PATH, HAMMING_MAX_BITS, MIH_BANDS, MIH_MAX_BUCKET
+from app.hamming import distance_matrix, popcount
+from app.store import FingerprintStore
+
+# ---------------- corpus-wide multi-index hashing over frame pHashes ----------------
+#
+# Every 64-bit hash is split into MIH_BANDS bands. If two hashes are within
+# Hamming radius r, at least one band differs by <= r // MIH_BANDS bits
+# (pigeonhole), so probing each band's inverted list with that small radius
+# finds every true neighbour; candidates are then verified on the full hash.
+
+_MAGIC = b"MIH1"
+_RECORD = struct.Struct("<HI")  # id length, number of hashes
+
+def _band_masks(bits: int, radius: int) -> np.ndarray:
+    """All `bits`-wide values with at most `radius` bits set (XOR probes)."""
+    out = [0]
+    for r in range(1, radius + 1):
+        for pos in combinations(range(bits), r):
+            out.append(sum(1 << p for p in pos))
+    return np.array(out, dtype=np.int64)
+
+def _expand_ranges(starts: np.ndarray, lens: np.ndarray) -> np.ndarray:
+    """Concatenate arange(s, s + l) for every (s, l) without a Python loop."""
+    total = int(lens.sum())
+    if total == 0:
+        return np.empty((0,), dtype=np.int64)
+    shift = starts - np.concatenate([[0], np.cumsum(lens)[:-1]])
+    return np.repeat(shift, lens) + np.arange(total)
+
+def _append(path: Path, payload: bytes):
+    """
+    One O_APPEND write under an exclusive flock, so the header goes in exactly
+    once even when several processes find the file empty at the same time.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if os.fstat(fd).st_size == 0:
+            payload = _MAGIC + payload
+        os.write(fd, payload)
+    finally:
+        os.close(fd)  # releases the lock
+
+def append_record(path: Path, video_id: str, hashes: np.ndarray):
+    """Append one video's hashes to the on-disk log (single write, O_APPEND)."""
+    append_records(path, [(video_id, hashes)])
+
+def append_records(path: Path, records: list[tuple[str, np.ndarray]]):
+    """Append many videos' hashes to the log in one write."""
+    if not records:
+        return
+    parts = []
+    for video_id, hashes in records:
+        vid = video_id.encode("utf-8")
+        h = np.ascontiguousarray(hashes, dtype="<u8")
+        parts += [_RECORD.pack(len(vid), int(h.size)), vid, h.tobytes()]
+    _append(path, b"".join(parts))
+
+def seed_log(path: Path, store: FingerprintStore | None = None, table: str = "frame_hashes") -> bool:
+    """Create the log from the store's hashes in `table` if it doesn't exist yet; True if seeded."""
+    if Path(path).exists() and Path(path).stat().st_size > 0:
+        return False
+    for vid, hashes in (store or FingerprintStore()).all_hashes(table=table):
+        append_record(path, vid, hashes)
+    return True
+
+def read_tail(path: Path, offset: int = 0) -> tuple[list[tuple[str, np.ndarray]], int]:
+    """
+    (video_id, hashes) records appended after byte `offset`, and the offset
+    just past the last complete one; a partly written tail record is left for
+    the next read. A record header that can't be one (a second file header,
+    an empty or undecodable id) raises instead of stalling every later read.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    pos = 0
+    if offset == 0:
+        if len(data) < len(_MAGIC):
+            return [], 0
+        if not data.startswith(_MAGIC):
+            raise RuntimeError(f"Not a frame index file: {path}")
+        pos = len(_MAGIC)
+    out = []
+    while pos + _RECORD.size <= len(data):
+        id_len, n = _RECORD.unpack_from(data, pos)
+        if id_len == 0 or data.startswith(_MAGIC, pos):
+            raise RuntimeError(f"Corrupt frame index file {path} at byte {offset + pos}")
+        end = pos + _RECORD.size + id_len + 8 * n
+        if end > len(data):
+            if pos + _RECORD.size + id_len <= len(data):
+                _record_id(data, pos, id_len, path, offset)  # a bad header fails here, not forever
+            break
+        vid = _record_id(data, pos, id_len, path, offset)
+        hashes = np.frombuffer(data, dtype="<u8", count=n, offset=pos + _RECORD.size + id_len)
+        out.append((vid, hashes.astype(np.uint64)))
+        pos = end
+    return out, offset + pos
+
+def _record_id(data: bytes, pos: int, id_len: int, path: Path, offset: int) -> str:
+    try:
+        return data[pos + _RECORD.size:pos + _RECORD.size + id_len].decode("utf-8")
+    except UnicodeDecodeError:
+        raise RuntimeError(f"Corrupt frame index file {path} at byte {offset + pos}") from None
+
+def read_records(path: Path):
+    """Yield (video_id, hashes) from the log; a truncated tail record is ignored."""
+    yield from read_tail(path)[0]
+
+class FrameHashIndex:
+    """
+    Inverted lists keyed by band value, stored CSR-style per band
+    (offsets into a postings array sorted by band value). Hashes added since
+    the last rebuild sit in a small pending tail that is scanned directly.
+
+    With a log path, the log is the source of truth: other processes (uvicorn
+    workers, bulk loads) append to it too, so queries first replay whatever
+    was appended past the byte offset read so far.
+    """
+
+    def __init__(self, path: Path | None = None, bands: int = MIH_BANDS):
+        if 64 % bands != 0:
+            raise ValueError("MIH_BANDS must divide 64")
+        self.path = path
+        self.bands = bands
+        self.band_bits = 64 // bands
+        self._hashes = np.empty((4096,), dtype=np.uint64)
+        self._owner = np.empty((4096,), dtype=np.int32)
+        self._size = 0
+        self._videos: list[str] = []
+        self._alive = np.zeros((1024,), dtype=bool)  # per owner slot
+        self._start = np.zeros((1024,), dtype=np.int64)  # per owner slot: its first entry
+        self._slot: dict[str, int] = {}   # video_id -> owner slot
+        self._csr: list[tuple[np.ndarray, np.ndarray]] = []
+        self._built = 0                   # entries covered by the CSR lists
+        self._masks: dict[int, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._offset = 0                  # log bytes replayed so far
+        self._tail_lock = threading.Lock()
+
+    # ----- construction / persistence -----
+
+    @classmethod
+    def load(cls, path: Path = FRAME_INDEX_PATH, store: FingerprintStore | None = None,
+             table: str = "frame_hashes") -> "FrameHashIndex":
+        """Replay the log next to the DB; on first use, seed it from the store's hashes in `table`."""
+        index = cls(path)
+        seed_log(path, store, table)
+        index.refresh()
+        index.rebuild()
+        return index
+
+    def refresh(self) -> int:
+        """Replay records appended to the log since the last read; returns how many (a stat when none)."""
+        if self.path is None:
+            return 0
+        try:
+            if os.stat(self.path).st_size == self._offset:
+                return 0
+        except FileNotFoundError:
+            return 0
+        with self._tail_lock:
+            records, self._offset = read_tail(self.path, self._offset)
+            for vid, hashes in records:
+                self._add_memory(vid, hashes)
+        return len(records)
+
+    def __len__(self) -> int:
+        return len(self._slot)
+
+    def add(self, video_id: str, hashes: np.ndarray):
+        """Add (or replace) a video's frame hashes, persisting them to the log."""
+        if self.path is None:
+            self._add_memory(video_id, hashes)
+            return
+        append_record(self.path, video_id, hashes)
+        self.refresh()  # picks up this record with anything appended before it
+
+    def _add_memory(self, video_id: str, hashes: np.ndarray):
+        h = np.asarray(hashes, dtype=np.uint64).reshape(-1)
+        with self._lock:
+            old = self._slot.get(video_id)
+            if old is not None:
+                self._alive[old] = False
+            slot = len(self._videos)
+            if slot >= self._alive.shape[0]:
+                alive = np.zeros((2 * self._alive.shape[0],), dtype=bool)
+                alive[:slot] = self._alive[:slot]
+                self._alive = alive
+                self._start = np.resize(self._start, alive.shape[0])
+            self._videos.append(video_id)
+            self._alive[slot] = True
+            self._start[slot] = self._size
+            self._slot[video_id] = slot
+
+            n = self._size + h.size
+            if n > self._hashes.shape[0]:
+                cap = max(n, 2 * self._hashes.shape[0])
+                self._hashes = np.resize(self._hashes, cap)
+                self._owner = np.resize(self._owner, cap)
+            self._hashes[self._size:n] = h
+            self._owner[self._size:n] = slot
+            self._size = n
+            pending = self._size - self._built
+        if pending > max(65536, self._built // 4):
+            self.rebuild()
+
+    def rebuild(self):
+        """Re-sort all hashes into per-band CSR inverted lists."""
+        with self._lock:
+            size = self._size
+            H = self._hashes[:size]
+        mask = np.uint64((1 << self.band_bits) - 1)
+        csr = []
+        for b in range(self.bands):
+            keys = ((H >> np.uint64(b * self.band_bits)) & mask).astype(np.int64)
+            postings = np.argsort(keys, kind="stable").astype(np.int32)
+            counts = np.bincount(keys, minlength=1 << self.band_bits)
+            offsets = np.zeros(((1 << self.band_bits) + 1,), dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            csr.append((offsets, postings))
+        with self._lock:
+            self._csr = csr
+            self._built = size
+
+    # ----- query -----
+
+    def _probe_masks(self, radius: int) -> np.ndarray:
+        rb = radius // self.bands
+        if rb not in self._masks:
+            self._masks[rb] = _band_masks(self.band_bits, rb)
+        return self._masks[rb]
+
+    def query(self, hashes: np.ndarray, radius: int = HAMMING_MAX_BITS, min_frames: int = 1) -> dict[str, int]:
+        """
+        Corpus videos with at least `min_frames` query frames within `radius` bits
+        of one of their frames -> {video_id: matched query frames}.
+        """
+        self.refresh()
+        q = np.asarray(hashes, dtype=np.uint64).reshape(-1)
+        n = q.shape[0]
+        frames, owners, _entries, videos, _start = self._hits(q, radius)
+        if owners.size == 0:
+            return {}
+        # count distinct query frames per owner
+        pairs = np.unique(owners * n + frames)
+        counts = np.bincount(pairs // n)
+        hit = np.flatnonzero(counts >= max(1, min_frames))
+        return {videos[o]: int(counts[o]) for o in hit}
+
+    def positions(self, hashes: np.ndarray, radius: int = HAMMING_MAX_BITS) -> list[tuple[int, str, int]]:
+        """
+        Every (query position, video id, position within that video's hashes)
+        pair within `radius` bits; positions follow the order hashes were added.
+        """
+        self.refresh()
+        q = np.asarray(hashes, dtype=np.uint64).reshape(-1)
+        frames, owners, entries, videos, start = self._hits(q, radius)
+        # a pair close in several bands is found once per band
+        _, first = np.unique(entries * q.shape[0] + frames, return_index=True)
+        frames, owners, entries = frames[first], owners[first], entries[first]
+        at = entries - start[owners]
+        return [(int(f), videos[o], int(p)) for f, o, p in zip(frames, owners, at)]
+
+    def _hits(self, q: np.ndarray, radius: int):
+        """(query positions, owner slots, entries, videos, slot starts) of verified live matches."""
+        empty = np.empty((0,), dtype=np.int64)
+        n = q.shape[0]
+        with self._lock:
+            size, built, csr = self._size, self._built, self._csr
+            H, owner = self._hashes[:size], self._owner[:size]
+            alive, start = self._alive, self._start
+            videos = self._videos
+        if n == 0:
+            return empty, empty, empty, videos, start
+
+        masks = self._probe_masks(radius)
+        band_mask = np.uint64((1 << self.band_bits) - 1)
+        frames_l: list[np.ndarray] = []
+        entries_l: list[np.ndarray] = []
+        for b, (offsets, postings) in enumerate(csr):
+            keys = ((q >> np.uint64(b * self.band_bits)) & band_mask).astype(np.int64)
+            probe = (keys[:, None] ^ masks[None, :]).ravel()       # (n * P,)
+            starts = offsets[probe]
+            lens = offsets[probe + 1] - starts
+            lens[lens > MIH_MAX_BUCKET] = 0
+            idx = _expand_ranges(starts, lens)
+            if idx.size == 0:
+                continue
+            entries_l.append(postings[idx])
+            frames_l.append(np.repeat(np.repeat(np.arange(n), masks.shape[0]), lens))
+        if size > built:
+            f, e = np.nonzero(distance_matrix(q, H[built:size]) <= radius)
+            frames_l.append(f)
+            entries_l.append(e + built)
+        if not entries_l:
+            return empty, empty, empty, videos, start
+
+        frames = np.concatenate(frames_l)
+        entries = np.concatenate(entries_l).astype(np.int64)
+        close = popcount(q[frames] ^ H[entries]) <= radius
+        frames, entries = frames[close], entries[close]
+        owners = owner[entries].astype(np.int64)
+        live = alive[owners]
+        return frames[live], owners[live], entries[live], videos, start
+
+_INDEXES: dict[str, FrameHashIndex] = {}
+_INDEX_LOCK = threading.Lock()
+
+def get_frame_index(path: Path = FRAME_INDEX_PATH, store: FingerprintStore | None = None,
+                    table: str = "frame_hashes") -> FrameHashIndex:
+    """
+    Process-wide hash index of one log file (default FRAME_INDEX_PATH), loaded
+    on first use and kept current with the log on every query; `table` is
+    the store table a missing log is seeded from.
+    """
+    key = str(path)
+    index = _INDEXES.get(key)
+    if index is None:
+        with _INDEX_LOCK:
+            index = _INDEXES.get(key)
+            if index is None:
+                index = _INDEXES[key] = FrameHashIndex.load(path, store, table)
+    return index
@@ -0,0 +1,197 @@
+from __future__ import annotations
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Iterator
+import numpy as np
+
+from app.config import FRAME_SOURCE_MODE, GOP_PROBE_PACKETS, DEFAULT_GOP
+from app.lazyimport import lazy_module
+from app.metrics import span
+
+cv2 = lazy_module("cv2")
+
+# ---------------- frame sources ----------------
+#
+# seek:       cap.set(POS_FRAMES) per sample; each seek re-decodes from the
+#             keyframe before it, so cost ~ samples * (GOP / 2 + 16).
+# sequential: one pass with grab() (decode only) and retrieve() (BGR convert)
+#             on target indices; cost ~ frames up to the last sample.
+# keyframe:   ffmpeg decodes keyframes only (-skip_frame nokey) and samples
+#             evenly among them; fastest, but a coarser fingerprint.
+# auto:       seek or sequential, whichever the cost model says is cheaper.
+
+SEEK, SEQUENTIAL, KEYFRAME, AUTO = "seek", "sequential", "keyframe", "auto"
+MODES = (SEEK, SEQUENTIAL, KEYFRAME, AUTO)
+
+_SEEK_OVERHEAD = 16  # OpenCV seeks to (target - 16) and decodes forward
+DEFAULT_FPS = 25.0   # assumed when the container reports none
+
+def frame_indices(total_frames: int, k: int) -> list[int]:
+    if total_frames <= 0:
+        return []
+    if k >= total_frames:
+        return list(range(total_frames))
+    return list(np.linspace(0, total_frames - 1, num=k, dtype=int))
+
+def timed_indices(total_frames: int, fps: float, step: float, limit: int) -> list[int]:
+    """Frame numbers every `step` seconds from the start, at most `limit` of them."""
+    if total_frames <= 0 or limit <= 0:
+        return []
+    every = step * (fps if fps > 0 else DEFAULT_FPS)
+    n = min(limit, int((total_frames - 1) / every) + 1)
+    return [int(round(k * every)) for k in range(n)]
+
+def progressive_order(n: int) -> list[int]:
+    """
+    0..n-1 ordered coarse to fine: every power-of-two prefix is an evenly spaced
+    subset (stride halves each time the prefix doubles), so a sample can grow in
+    steps and stay evenly spread over the video.
+    """
+    order, seen = [], set()
+    stride = 1
+    while stride < n:
+        stride *= 2
+    while stride >= 1:
+        for p in range(0, n, stride):
+            if p not in seen:
+                seen.add(p)
+                order.append(p)
+        stride //= 2
+    return order
+
+def estimate_gop(video_path: Path, max_packets: int = GOP_PROBE_PACKETS) -> int | None:
+    """Median keyframe distance from a demux-only scan of the first packets (no decode)."""
+    cap = cv2.VideoCapture(str(video_path))
+    try:
+        if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+            return None
+        keys: list[int] = []
+        for i in range(max_packets):
+            if not cap.grab():
+                break
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keys.append(i)
+        if len(keys) < 2:
+            return None
+        return int(np.median(np.diff(keys)))
+    except cv2.error:
+        return None
+    finally:
+        cap.release()
+
+def choose_mode(total_frames: int, n_samples: int, gop: int | None) -> str:
+    """Cost model: decoded frames for per-sample seeks vs one sequential pass."""
+    g = gop or DEFAULT_GOP
+    seek_cost = n_samples * (g / 2 + _SEEK_OVERHEAD)
+    return SEQUENTIAL if total_frames <= seek_cost else SEEK
+
+def _seek_frames(cap: cv2.VideoCapture, idxs: list[int]) -> Iterator[tuple[int, np.ndarray]]:
+    for idx in idxs:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        ok, frame = cap.read()
+        if not ok or frame is None:
+            continue
+        yield idx, frame
+
+def _sequential_frames(cap: cv2.VideoCapture, idxs: list[int]) -> Iterator[tuple[int, np.ndarray]]:
+    pos = 0
+    for idx in sorted(set(idxs)):
+        while pos < idx:
+            if not cap.grab():
+                return
+            pos += 1
+        ok, frame = cap.read()
+        pos += 1
+        if not ok or frame is None:
+            return
+        yield idx, frame
+
+def _keyframe_frames(video_path: Path, n_samples: int, size: int = 288) -> Iterator[tuple[int, np.ndarray]]:
+    """Decode keyframes only via ffmpeg, scaled to size x size, then keep n evenly spaced ones."""
+    cmd = [
+        "ffmpeg", "-v", "error", "-skip_frame", "nokey", "-i", str(video_path),
+        "-an", "-vsync", "0", "-vf", f"scale={size}:{size}",
+        "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1",
+    ]
+    raw = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    n = len(raw) // (size * size * 3)
+    frames = np.frombuffer(raw, dtype=np.uint8, count=n * size * size * 3).reshape(n, size, size, 3)
+    for i in frame_indices(n, n_samples):
+        yield i, frames[i]
+
+def sample_frames(video_path: Path, n_samples: int, mode: str = FRAME_SOURCE_MODE) -> Iterator[tuple[int, np.ndarray]]:
+    """Yield (index, BGR frame) for ~n_samples evenly spaced frames, decoded with `mode`."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown frame source mode: {mode}")
+    if mode == KEYFRAME:
+        if shutil.which("ffmpeg"):
+            yield from _keyframe_frames(video_path, n_samples)
+            return
+        mode = AUTO  # no ffmpeg: fall back to a full-decode strategy
+
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {video_path}")
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        yield from _decode(video_path, cap, total, frame_indices(total, n_samples), mode)
+    finally:
+        cap.release()
+
+def sample_frames_timed(video_path: Path, n_samples: int, step: float, limit: int,
+                        mode: str = FRAME_SOURCE_MODE) -> Iterator[tuple[np.ndarray, bool, int | None]]:
+    """
+    One decode for both the n_samples evenly spaced frames and a frame every
+    `step` seconds (at most `limit`, see timed_indices). Yields (BGR frame, on
+    the even grid, position on the timed grid or None) in frame order. The
+    keyframe mode has no fixed timing and decodes with the auto strategy here.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown frame source mode: {mode}")
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {video_path}")
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        grid = set(frame_indices(total, n_samples))
+        timed: dict[int, int] = {}
+        for pos, idx in enumerate(timed_indices(total, cap.get(cv2.CAP_PROP_FPS), step, limit)):
+            timed.setdefault(idx, pos)
+        for idx, frame in _decode(video_path, cap, total, sorted(grid | timed.keys()), mode):
+            yield frame, idx in grid, timed.get(idx)
+    finally:
+        cap.release()
+
+def _decode(video_path: Path, cap: cv2.VideoCapture, total: int, idxs: list[int],
+            mode: str) -> Iterator[tuple[int, np.ndarray]]:
+    if mode in (AUTO, KEYFRAME):
+        with span("gop_probe"):
+            gop = estimate_gop(video_path)
+        mode = choose_mode(total, len(idxs), gop)
+    source = _sequential_frames if mode == SEQUENTIAL else _seek_frames
+    yield from source(cap, idxs)
+
+def sample_frames_at(video_path: Path, positions: list[int], n_samples: int,
+                     mode: str = FRAME_SOURCE_MODE) -> tuple[int, float, list[tuple[int, np.ndarray]]]:
+    """
+    Decode only some of the n_samples evenly spaced frames: (grid size, video
+    seconds, [(position, BGR frame)]) for the given grid positions, in temporal
+    order. The keyframe mode has no fixed grid and decodes with the auto
+    strategy here.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown frame source mode: {mode}")
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {video_path}")
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        seconds = total / (cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS)
+        grid = frame_indices(total, n_samples)
+        wanted = sorted({p for p in positions if 0 <= p < len(grid)})
+        pos_of = {grid[p]: p for p in wanted}
+        return len(grid), seconds, [(pos_of[idx], frame) for idx, frame in _decode(video_path, cap, total,
+                                                                                   [grid[p] for p in wanted], mode)]
+    finally:
+        cap.release()
@@ -0,0 +1,74 @@
+from __future__ import annotations
+import numpy as np
+
+from app.config import HAMMING_MAX_BITS
+
+# ---------------- vectorized Hamming distance on packed uint64 hashes ----------------
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_CHUNK_COLS = 1 << 16  # candidate hashes per block, bounds the (n, m) temporaries
+
+def popcount(x: np.ndarray) -> np.ndarray:
+    """Per-element number of set bits of a uint64 array (uint8 result, same shape)."""
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(x)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+def pack_bits(bits: np.ndarray) -> np.ndarray:
+    """Pack (..., 64) boolean bits into uint64 values (big-endian, first bit = MSB)."""
+    bits = np.asarray(bits, dtype=bool)
+    packed = np.packbits(bits, axis=-1)  # (..., 8) uint8
+    return np.ascontiguousarray(packed).view(">u8")[..., 0].astype(np.uint64)
+
+def distance_matrix(query: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """(n, m) uint8 matrix of Hamming distances between every query/candidate hash pair."""
+    q = np.asarray(query, dtype=np.uint64).reshape(-1)
+    c = np.asarray(candidate, dtype=np.uint64).reshape(-1)
+    return popcount(q[:, None] ^ c[None, :])
+
+def min_distances(query: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """Distance from each query hash to its nearest candidate hash (64 if no candidates)."""
+    q = np.asarray(query, dtype=np.uint64).reshape(-1)
+    c = np.asarray(candidate, dtype=np.uint64).reshape(-1)
+    out = np.full((q.shape[0],), 64, dtype=np.uint8)
+    for s in range(0, c.shape[0], _CHUNK_COLS):
+        np.minimum(out, distance_matrix(q, c[s:s + _CHUNK_COLS]).min(axis=1), out=out)
+    return out
+
+def overlap_fraction(query: np.ndarray, candidate: np.ndarray, max_bits: int = HAMMING_MAX_BITS) -> float:
+    """Fraction of query frames with a candidate frame within `max_bits`."""
+    q = np.asarray(query, dtype=np.uint64).reshape(-1)
+    if q.shape[0] == 0:
+        return 0.0
+    return float(np.count_nonzero(min_distances(q, candidate) <= max_bits)) / q.shape[0]
+
+def batch_min_distances(query: np.ndarray, candidates: list[np.ndarray]) -> np.ndarray:
+    """
+    (n_candidates, n_query) nearest distances of each query hash within each candidate,
+    computed over the concatenated candidate hashes in a few large blocks.
+    """
+    q = np.asarray(query, dtype=np.uint64).reshape(-1)
+    out = np.full((len(candidates), q.shape[0]), 64, dtype=np.uint8)
+    sizes = np.array([np.asarray(c).size for c in candidates], dtype=np.int64)
+    if q.shape[0] == 0 or sizes.sum() == 0:
+        return out
+    flat = np.concatenate([np.asarray(c, dtype=np.uint64).reshape(-1) for c in candidates])
+    owner = np.repeat(np.arange(len(candidates)), sizes)
+    for s in range(0, flat.shape[0], _CHUNK_COLS):
+        d = distance_matrix(q, flat[s:s + _CHUNK_COLS])  # (n, block)
+        own = owner[s:s + _CHUNK_COLS]
+        # owners are contiguous runs: reduce each run with one reduceat
+        starts = np.flatnonzero(np.r_[True, own[1:] != own[:-1]])
+        mins = np.minimum.reduceat(d, starts, axis=1)  # (n, runs)
+        rows = own[starts]
+        out[rows] = np.minimum(out[rows], mins.T)
+    return out
+
+def batch_overlap(query: np.ndarray, candidates: list[np.ndarray], max_bits: int = HAMMING_MAX_BITS) -> np.ndarray:
+    """Overlap fraction of the query against each candidate, shape (n_candidates,)."""
+    q = np.asarray(query, dtype=np.uint64).reshape(-1)
+    if q.shape[0] == 0:
+        return np.zeros((len(candidates),), dtype=np.float64)
+    close = batch_min_distances(q, candidates) <= max_bits
+    return close.sum(axis=1) / q.shape[0]
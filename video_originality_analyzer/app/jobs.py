@@ -0,0 +1,183 @@
+from __future__ import annotations
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from app.config import FINGERPRINT_WORKERS, JOB_WORKERS, MAX_PENDING_JOBS, JOB_TTL_SECONDS
+from app.metrics import breakdown, collect
+
+# ---------------- asynchronous analysis jobs ----------------
+#
+# A job is one index/analyze request for one URL. Job threads only orchestrate:
+# media transfers are bounded by netio's transfer slots, and frame decoding +
+# hashing run on a process pool, so CPU work never competes with the API for
+# the GIL. Identical (kind, url) submissions share the in-flight job, and
+# submissions beyond MAX_PENDING_JOBS are refused instead of queued.
+# app.pipeline (and with it the decode / download stack) is imported on the
+# first job or at warmup, not with this module.
+
+KINDS = ("analyze", "index")
+
+def _runner(kind: str, batch: bool = False):
+    from app import pipeline
+    return getattr(pipeline, f"{kind}_urls" if batch else f"{kind}_url")
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+class QueueFull(RuntimeError):
+    """Too many pending jobs; the client should retry later."""
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    url: str
+    status: str = QUEUED
+    result: dict | None = None
+    error: str | None = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    timings: dict[str, float] | None = None  # seconds per pipeline stage (see app/metrics.py)
+    future: Future = field(default_factory=Future, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self, timings: bool = False) -> dict:
+        out = {
+            "job_id": self.id, "kind": self.kind, "url": self.url, "status": self.status,
+            "result": self.result, "error": self.error,
+            "submitted_at": self.submitted_at, "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if timings:
+            out["timings"] = self.timings
+        return out
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, cpu_workers: int = FINGERPRINT_WORKERS,
+                 max_pending: int = MAX_PENDING_JOBS, ttl: float = JOB_TTL_SECONDS):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        # spawn: forking a process that already runs threads (uvicorn, job threads) is unsafe
+        self._cpu = ProcessPoolExecutor(
+            max_workers=cpu_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._cpu_workers = cpu_workers
+        self._jobs: dict[str, Job] = {}
+        self._inflight: dict[tuple[str, str], Job] = {}
+        self._batched = 0  # URLs inside running batches, counted against max_pending
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, url: str) -> tuple[Job, bool]:
+        """Queue a job; returns (job, deduplicated). Raises QueueFull under backpressure."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        with self._lock:
+            self._prune()
+            existing = self._inflight.get((kind, url))
+            if existing is not None:
+                return existing, True
+            if self._pending() >= self.max_pending:
+                raise QueueFull(f"{self._pending()} jobs pending (limit {self.max_pending}).")
+            job = Job(id=uuid.uuid4().hex, kind=kind, url=url)
+            self._jobs[job.id] = job
+            self._inflight[(kind, url)] = job
+        self._threads.submit(self._run, job)
+        return job, False
+
+    def run_batch(self, kind: str, urls: list[str]) -> Future:
+        """
+        Run index/analyze over a list of URLs as one unit (fetched concurrently,
+        ranked together); the future resolves to (per-URL results in input order,
+        seconds per pipeline stage summed over the batch).
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        n = len(urls)
+        with self._lock:
+            if self._pending() + n > self.max_pending:
+                raise QueueFull(f"{self._pending()} jobs pending, batch of {n} exceeds limit {self.max_pending}.")
+            self._batched += n
+
+        def run() -> tuple[list[dict], dict[str, float]]:
+            try:
+                with collect() as spans:
+                    results = _runner(kind, batch=True)(urls, self._cpu)
+                return results, breakdown(spans)
+            finally:
+                with self._lock:
+                    self._batched -= n
+
+        try:
+            return self._threads.submit(run)
+        except BaseException:
+            with self._lock:
+                self._batched -= n
+            raise
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def depth(self) -> dict:
+        with self._lock:
+            running = sum(1 for j in self._inflight.values() if j.status == RUNNING)
+            return {"queued": len(self._inflight) - running, "running": running,
+                    "batched_urls": self._batched, "max_pending": self.max_pending}
+
+    def warm(self) -> int:
+        """
+        Import the pipeline here and start every fingerprinting worker with its
+        decoder warmed, so the first jobs don't pay for process spawn and
+        imports. Blocks until done; returns the number of workers that ran it.
+        """
+        from app.fingerprint import warm_codec
+        _runner("analyze")
+        futures = [self._cpu.submit(warm_codec) for _ in range(self._cpu_workers)]
+        return len({f.result() for f in futures})
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        self._cpu.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job):
+        job.status, job.started_at = RUNNING, time.time()
+        with collect() as spans:
+            try:
+                job.result = _runner(job.kind)(job.url, self._cpu)
+                job.status = DONE
+            except Exception as e:
+                job.error, job.status = str(e), FAILED
+        job.timings = breakdown(spans)
+        job.finished_at = time.time()
+        with self._lock:
+            self._inflight.pop((job.kind, job.url), None)
+        job.future.set_result(job)
+
+    def _pending(self) -> int:
+        return len(self._inflight) + self._batched
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        expired = [jid for jid, j in self._jobs.items() if j.finished and j.finished_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+
+_MANAGER: JobManager | None = None
+_MANAGER_LOCK = threading.Lock()
+
+def get_job_manager() -> JobManager:
+    """Process-wide job manager (thread + process pools start on first use)."""
+    global _MANAGER
+    if _MANAGER is None:
+        with _MANAGER_LOCK:
+            if _MANAGER is None:
+                _MANAGER = JobManager()
+    return _MANAGER
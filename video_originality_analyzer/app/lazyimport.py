@@ -0,0 +1,59 @@
+from __future__ import annotations
+import importlib
+import threading
+from types import ModuleType
+
+# ---------------- deferred imports of heavy dependencies ----------------
+#
+# cv2, PIL, imagehash, scipy and yt_dlp take most of the service's import time
+# but are only needed once a video is decoded or fetched. Modules bind them as
+#
+#     cv2 = lazy_module("cv2")
+#
+# and the real import happens on the first attribute access, so importing the
+# API (and answering /health) does not pay for them. Attribute lookups go to
+# the real module every time, so patching it (e.g. yt_dlp.YoutubeDL in
+# scripts/bench_suite.py) still takes effect.
+
+class LazyModule:
+    def __init__(self, name: str):
+        self._name = name
+        self._module: ModuleType | None = None
+        self._lock = threading.Lock()
+
+    def load(self) -> ModuleType:
+        """Import the module now (no-op once loaded)."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r}{' (loaded)' if self.loaded else ''}>"
+
+_MODULES: dict[str, LazyModule] = {}
+_MODULES_LOCK = threading.Lock()
+
+def lazy_module(name: str) -> LazyModule:
+    """Process-wide deferred handle for `name` (one per module name)."""
+    with _MODULES_LOCK:
+        mod = _MODULES.get(name)
+        if mod is None:
+            mod = _MODULES[name] = LazyModule(name)
+        return mod
+
+def load_all() -> list[str]:
+    """Import every module registered so far; returns their names."""
+    with _MODULES_LOCK:
+        mods = list(_MODULES.values())
+    for mod in mods:
+        mod.load()
+    return [m._name for m in mods]
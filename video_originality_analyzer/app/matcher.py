@@ -2,8 +2,8 @@ from __future__ import annotations
 from dataclasses import dataclass
 import numpy as np
 from typing import List, Tuple
-from app.fingerprint import cosine_similarity
 from app.config import MIN_ORIGINALITY
+from app.metrics import span
 
 @dataclass
 class Match:
@@ -12,13 +12,28 @@ class Match:
     title: str | None
     similarity: float  # 0..1 (1 = very similar)
 
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first (argpartition + sort of k only)."""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty((0,), dtype=np.intp)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
 def rank_matches(query_vec: np.ndarray, corpus: List[Tuple[str, str, str | None, np.ndarray]], top_k: int = 5) -> list[Match]:
-    scored: list[Match] = []
-    for vid, url, title, vec in corpus:
-        sim = float(cosine_similarity(query_vec, vec))
-        scored.append(Match(video_id=vid, url=url, title=title, similarity=sim))
-    scored.sort(key=lambda m: m.similarity, reverse=True)
-    return scored[:top_k]
+    if not corpus:
+        return []
+    # vectors are L2-normalized, so one matrix-vector product gives all cosines
+    with span("rank"):
+        M = np.vstack([vec for _vid, _url, _title, vec in corpus]).astype(np.float32, copy=False)
+        sims = np.clip(M @ query_vec.astype(np.float32, copy=False), 0.0, 1.0)
+    out: list[Match] = []
+    for i in top_k_indices(sims, top_k):
+        vid, url, title, _vec = corpus[int(i)]
+        out.append(Match(video_id=vid, url=url, title=title, similarity=float(sims[i])))
+    return out
 
 def originality_score(max_similarity: float) -> float:
     # more sensitive: punish high similarity with a square-root shrink
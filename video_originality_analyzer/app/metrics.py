@@ -0,0 +1,232 @@
+from __future__ import annotations
+import contextvars
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+# ---------------- metrics: stage timing spans, counters, Prometheus text ----------------
+#
+# span("download") times one pipeline stage into the analyzer_stage_seconds
+# histogram and, when the current request collects a breakdown (collect()),
+# into that request's span list too. The list travels through a context
+# variable; pool threads see it via carry(), and process-pool work returns its
+# spans with the result (call_collected / merge), so decoding and features
+# measured in worker processes land in the serving process' metrics.
+# render() writes every registered metric in the Prometheus text format.
+
+_DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt_value(v: float) -> str:
+    return repr(float(v)) if v != int(v) or abs(v) >= 1e15 else str(int(v))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> Labels:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def lines(self) -> list[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def values(self) -> dict[Labels, float]:
+        """Current value of every label combination seen so far."""
+        with self._lock:
+            return dict(self._values)
+
+    def lines(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_fmt_labels(self.labels, k)} {_fmt_value(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Labels = (), buckets: tuple[float, ...] = _DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[Labels, list] = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[bisect_left(self.buckets, value)] += 1
+            row[-1] += value
+
+    def lines(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = []
+        for key, row in items:
+            cum = 0
+            for bound, n in zip(self.buckets + (float("inf"),), row[:-1]):
+                cum += n
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else _fmt_value(bound))
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {cum}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {_fmt_value(row[-1])}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {cum}")
+        return out
+
+class Callback(_Metric):
+    """A counter or gauge read from elsewhere at scrape time: fn() -> value or {label values: value}."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float | dict], kind: str = "gauge",
+                 labels: Labels = ()):
+        super().__init__(name, help, labels)
+        self.kind, self._fn = kind, fn
+
+    def lines(self) -> list[str]:
+        try:
+            got = self._fn()
+        except Exception:
+            return []  # an unavailable source (e.g. a shard down) must not break the scrape
+        items = sorted(got.items()) if isinstance(got, dict) else [((), got)]
+        return [f"{self.name}{_fmt_labels(self.labels, k if isinstance(k, tuple) else (k,))} {_fmt_value(v)}"
+                for k, v in items]
+
+_REGISTRY: list[_Metric] = []
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format (0.0.4)."""
+    out = []
+    for m in list(_REGISTRY):
+        lines = m.lines()
+        if not lines:
+            continue
+        out.append(f"# HELP {m.name} {m.help}")
+        out.append(f"# TYPE {m.name} {m.kind}")
+        out += lines
+    return "\n".join(out) + "\n"
+
+# ----- pipeline metrics -----
+
+STAGE_SECONDS = Histogram("analyzer_stage_seconds", "Time spent in one pipeline stage.", ("stage",))
+REQUEST_SECONDS = Histogram("analyzer_request_seconds", "API request latency.", ("endpoint",))
+FRAMES_DECODED = Counter("analyzer_frames_decoded_total", "Video frames decoded for fingerprints.")
+BYTES_DOWNLOADED = Counter("analyzer_download_bytes_total", "Media bytes downloaded (cache misses).")
+VERDICTS = Counter("analyzer_verdicts_total", "Analyze verdicts by the check that decided them.",
+                   ("decided_by", "original"))
+SECOND_PASS = Counter("analyzer_second_pass_total", "Analyses that went past the coarse first pass.")
+
+# ----- spans -----
+
+_spans: contextvars.ContextVar[list | None] = contextvars.ContextVar("analyzer_spans", default=None)
+
+def record(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+def timed(stage: str) -> Callable:
+    """Decorator: each call of the function is one `stage` span."""
+    def wrap(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return run
+    return wrap
+
+def timed_iter(stage: str, items: Iterable) -> Iterator:
+    """Yield from `items`, recording the time spent producing them as one `stage` span."""
+    it, total = iter(items), 0.0
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - t0
+            yield item
+    finally:
+        record(stage, total)
+
+@contextmanager
+def collect() -> Iterator[list[tuple[str, float]]]:
+    """Collect the spans recorded in this context (and carry()-ed pool work) into a list."""
+    spans: list[tuple[str, float]] = []
+    token = _spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _spans.reset(token)
+
+def carry(fn: Callable) -> Callable:
+    """fn recording its spans into the caller's collection when run on a pool thread."""
+    spans = _spans.get()
+    if spans is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _spans.set(spans)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _spans.reset(token)
+    return run
+
+def call_collected(fn: Callable, *args):
+    """(fn(*args), its spans): for process-pool work, replayed in the parent with merge()."""
+    with collect() as spans:
+        return fn(*args), spans
+
+def merge(spans: list[tuple[str, float]]):
+    for stage, seconds in spans:
+        record(stage, seconds)
+
+def breakdown(spans: list[tuple[str, float]]) -> dict[str, float]:
+    """Seconds per stage (summed over calls and threads; stages may nest), in first-seen order."""
+    out: dict[str, float] = {}
+    for stage, seconds in spans:
+        out[stage] = out.get(stage, 0.0) + seconds
+    return {stage: round(s, 6) for stage, s in out.items()}
@@ -1,17 +1,276 @@
 from __future__ import annotations
-import tempfile
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from dataclasses import dataclass, asdict
 from pathlib import Path
-import yt_dlp
 
-from app.config import TMP_DIR
+from app.config import (
+    DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_LOW_WATER, DOWNLOAD_CACHE_MAX_BYTES, DOWNLOAD_CACHE_MODE,
+    DOWNLOAD_CONCURRENCY
+)
+from app.lazyimport import lazy_module
+from app.metrics import BYTES_DOWNLOADED, span
 
-def download_video(url: str) -> Path:
+yt_dlp = lazy_module("yt_dlp")
+
+# ---------------- content-addressed download cache ----------------
+#
+# media/<key>/      one finished download per video (key = extractor + video id);
+#                   its "aliases" file lists the URL digests pointing at it
+# urls/<sha1(url)>  alias file: URL -> key, so a repeated URL skips yt-dlp entirely
+# partial/<uuid>/   in-progress downloads, renamed into media/ when complete
+# locks/<key>       pin lock: flock'd shared by every user of media/<key> in any
+#                   worker until release_video(), exclusively to evict it
+#
+# The rename is atomic, so readers never see a half-written entry; concurrent
+# requests for the same URL in this process wait on one download (URLs hash to
+# a fixed set of lock stripes, so unrelated URLs rarely share one). A running
+# byte total is kept per process; once a download takes it past
+# DOWNLOAD_CACHE_MAX_BYTES the cache is rescanned (other workers share it) and
+# entries are evicted least-recently-used (directory mtime) down to
+# DOWNLOAD_CACHE_LOW_WATER of the budget, together with their alias files;
+# entries some worker has pinned are skipped. Cache hits never scan. In "ephemeral" mode media is deleted on release.
+
+MEDIA_DIR = DOWNLOAD_CACHE_DIR / "media"
+URLS_DIR = DOWNLOAD_CACHE_DIR / "urls"
+PARTIAL_DIR = DOWNLOAD_CACHE_DIR / "partial"
+LOCKS_DIR = DOWNLOAD_CACHE_DIR / "locks"
+_META = "meta.json"
+_ALIASES = "aliases"
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    bytes_evicted: int = 0
+
+CACHE_STATS = CacheStats()
+_stats_lock = threading.Lock()
+_URL_LOCK_STRIPES = 256
+_url_locks = [threading.Lock() for _ in range(_URL_LOCK_STRIPES)]  # indexed by URL digest
+_pins: dict[str, list[int]] = {}  # key -> this process' shared-lock fds on locks/<key>
+_pins_lock = threading.Lock()
+_cache_bytes: int | None = None  # running total of MEDIA_DIR; None until the first scan
+_bytes_lock = threading.Lock()
+# bounds concurrent media transfers (downloads and streams) across all request/job threads
+_transfer_slots = threading.BoundedSemaphore(DOWNLOAD_CONCURRENCY)
+
+def transfer_slot() -> threading.BoundedSemaphore:
+    """Context manager held for the duration of one network media transfer."""
+    return _transfer_slots
+
+def cache_stats() -> dict:
+    with _stats_lock:
+        return asdict(CACHE_STATS)
+
+def _count(**deltas: int):
+    with _stats_lock:
+        for name, d in deltas.items():
+            setattr(CACHE_STATS, name, getattr(CACHE_STATS, name) + d)
+
+def _url_digest(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+def _url_lock(url: str) -> threading.Lock:
+    return _url_locks[int(_url_digest(url)[:8], 16) % _URL_LOCK_STRIPES]
+
+def _media_key(info: dict) -> str:
+    raw = f"{info.get('extractor_key') or 'generic'}-{info.get('id') or uuid.uuid4().hex}"
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", raw)
+
+def _media_file(entry: Path) -> Path | None:
+    files = [p for p in entry.iterdir() if p.is_file() and p.name not in (_META, _ALIASES) and not p.name.endswith(".part")]
+    return max(files, key=lambda p: p.stat().st_size) if files else None
+
+def _dir_size(entry: Path) -> int:
+    return sum(p.stat().st_size for p in entry.rglob("*") if p.is_file())
+
+def _lock_entry(key: str, exclusive: bool = False) -> int | None:
     """
-    Download a video from a URL using yt-dlp and return the local file path.
+    An fd holding the entry's pin lock: shared (waits while the entry is being
+    evicted), or exclusive without waiting (None while anyone has it pinned).
     """
-    TMP_DIR.mkdir(parents=True, exist_ok=True)
-    tmpdir = Path(tempfile.mkdtemp(prefix="dl_", dir=TMP_DIR))
-    out = tmpdir / "%(id)s.%(ext)s"
+    LOCKS_DIR.mkdir(parents=True, exist_ok=True)
+    path = LOCKS_DIR / key
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB if exclusive else fcntl.LOCK_SH)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)  # an evictor unlinked it while we waited: lock the new file
+
+def _pin(key: str):
+    fd = _lock_entry(key)
+    with _pins_lock:
+        _pins.setdefault(key, []).append(fd)
+
+def _unpin(key: str):
+    with _pins_lock:
+        fds = _pins.get(key)
+        if not fds:
+            return
+        fd = fds.pop()
+        if not fds:
+            del _pins[key]
+    os.close(fd)  # drops the shared lock
+
+def _write_alias(url: str, key: str):
+    URLS_DIR.mkdir(parents=True, exist_ok=True)
+    digest = _url_digest(url)
+    with open(MEDIA_DIR / key / _ALIASES, "a", encoding="utf-8") as f:  # so eviction can find it
+        f.write(digest + "\n")
+    alias = URLS_DIR / digest
+    tmp = alias.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    tmp.write_text(key, encoding="utf-8")
+    os.replace(tmp, alias)
+
+def _alias_key(alias: Path) -> str | None:
+    try:
+        return alias.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+
+def _remove_entry(entry: Path) -> bool:
+    """Delete a media entry and the aliases pointing at it, unless some worker has it pinned; True if removed."""
+    trash = PARTIAL_DIR / f"evict-{uuid.uuid4().hex}"
+    fd = _lock_entry(entry.name, exclusive=True)
+    if fd is None:
+        return False
+    try:
+        PARTIAL_DIR.mkdir(parents=True, exist_ok=True)
+        os.rename(entry, trash)  # gone for lookups before the lock is released
+    except OSError:
+        return False
+    finally:
+        (LOCKS_DIR / entry.name).unlink(missing_ok=True)
+        os.close(fd)
+    try:
+        digests = (trash / _ALIASES).read_text(encoding="utf-8").split()
+    except OSError:
+        digests = []
+    for digest in digests:
+        alias = URLS_DIR / digest
+        if _alias_key(alias) == entry.name:  # not re-pointed at a newer download since
+            alias.unlink(missing_ok=True)
+    shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+def _read_meta(entry: Path) -> dict:
+    try:
+        return json.loads((entry / _META).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def _entry_for(url: str) -> Path | None:
+    key = _alias_key(URLS_DIR / _url_digest(url))
+    if not key:
+        return None
+    entry = MEDIA_DIR / key
+    return entry if entry.is_dir() else None
+
+def cached_info(url: str) -> dict | None:
+    """Metadata (id, title, ...) of a cached download of this URL, without touching the network."""
+    entry = _entry_for(url)
+    if entry is None:
+        return None
+    return _read_meta(entry) or None
+
+def _lookup(url: str) -> tuple[Path, dict] | None:
+    """Cached download of this URL, pinned (call with the URL's lock held)."""
+    entry = _entry_for(url)
+    if entry is None:
+        return None
+    _pin(entry.name)  # before the checks below, so eviction can't remove it in between
+    try:
+        media = _media_file(entry)
+        if media is None:
+            raise FileNotFoundError(entry)
+        os.utime(entry)  # LRU: mtime = last use
+    except OSError:
+        _unpin(entry.name)
+        return None
+    return media, _read_meta(entry)
+
+def _added(size: int) -> bool:
+    """Count a new entry into the running total; True when the cache is over budget (or never scanned)."""
+    global _cache_bytes
+    with _bytes_lock:
+        if _cache_bytes is None:
+            return True
+        _cache_bytes += size
+        return _cache_bytes > DOWNLOAD_CACHE_MAX_BYTES
+
+def _evict(budget: int = DOWNLOAD_CACHE_MAX_BYTES):
+    """Rescan the cache, then evict least-recently-used unpinned entries down to the low-water mark."""
+    global _cache_bytes
+    if not MEDIA_DIR.exists():
+        return
+    entries = []
+    for entry in MEDIA_DIR.iterdir():
+        if entry.is_dir():
+            try:
+                entries.append((entry.stat().st_mtime, _dir_size(entry), entry))
+            except OSError:
+                continue
+    total = sum(size for _m, size, _e in entries)
+    if total > budget:
+        target = int(budget * DOWNLOAD_CACHE_LOW_WATER)
+        for _mtime, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= target:
+                break
+            if _remove_entry(entry):
+                total -= size
+                _count(evictions=1, bytes_evicted=size)
+        _sweep_aliases()
+        _sweep_locks()
+    with _bytes_lock:
+        _cache_bytes = total
+
+def _sweep_aliases():
+    """Delete alias files whose entry is gone (evicted by an older version or lost a race)."""
+    if not URLS_DIR.exists():
+        return
+    for alias in URLS_DIR.iterdir():
+        if alias.name.endswith(".tmp"):
+            continue
+        key = _alias_key(alias)
+        if key is not None and not (MEDIA_DIR / key).is_dir():
+            alias.unlink(missing_ok=True)
+
+def _sweep_locks():
+    """Delete pin locks left behind for entries that are gone (a worker died mid-download)."""
+    if not LOCKS_DIR.exists():
+        return
+    for lock in LOCKS_DIR.iterdir():
+        if (MEDIA_DIR / lock.name).is_dir():
+            continue
+        fd = _lock_entry(lock.name, exclusive=True)
+        if fd is None:  # pinned by a download about to publish it
+            continue
+        if not (MEDIA_DIR / lock.name).is_dir():
+            lock.unlink(missing_ok=True)
+        os.close(fd)
+
+def _download(url: str) -> tuple[Path, dict]:
+    PARTIAL_DIR.mkdir(parents=True, exist_ok=True)
+    MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+    partial = PARTIAL_DIR / uuid.uuid4().hex
+    partial.mkdir()
+    out = partial / "%(id)s.%(ext)s"
     ydl_opts = {
         "outtmpl": str(out),
         "quiet": True,
@@ -19,9 +278,68 @@ def download_video(url: str) -> Path:
         "merge_output_format": "mp4",
         "format": "mp4/best",
     }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-        filename = ydl.prepare_filename(info)
-        candidate = Path(filename)
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=True)
+            candidate = Path(ydl.prepare_filename(info))
         mp4 = candidate.with_suffix(".mp4")
-        return mp4 if mp4.exists() else candidate
+        name = (mp4 if mp4.exists() else candidate).name
+        meta = {"id": info.get("id"), "title": info.get("title"),
+                "extractor_key": info.get("extractor_key"),
+                "webpage_url": info.get("webpage_url") or url, "file": name}
+        (partial / _META).write_text(json.dumps(meta), encoding="utf-8")
+        key = _media_key(info)
+        entry = MEDIA_DIR / key
+        _pin(key)  # pinned from the moment it is published
+        try:
+            try:
+                os.rename(partial, entry)  # publish atomically
+            except OSError:
+                # another worker finished the same video first: keep theirs
+                shutil.rmtree(partial, ignore_errors=True)
+                if not entry.is_dir():
+                    raise
+            _write_alias(url, key)
+        except BaseException:
+            _unpin(key)
+            raise
+        media = entry / name
+        return (media if media.exists() else (_media_file(entry) or media)), meta
+    finally:
+        if partial.exists():
+            shutil.rmtree(partial, ignore_errors=True)
+
+def download_video_with_info(url: str) -> tuple[Path, dict]:
+    """
+    Download a video and return (local path, info) from the same yt-dlp call,
+    where info holds id, title, extractor_key and webpage_url. Served from the
+    download cache when this URL was fetched before; the entry stays pinned
+    until release_video(path) is called.
+    """
+    with _url_lock(url):
+        found = _lookup(url)
+        if found is not None:
+            _count(hits=1)
+            return found
+        _count(misses=1)
+        with _transfer_slots, span("download"):
+            found = _download(url)
+        BYTES_DOWNLOADED.inc(found[0].stat().st_size if found[0].exists() else 0)
+    if DOWNLOAD_CACHE_MODE != "ephemeral" and _added(_dir_size(found[0].parent)):
+        _evict()
+    return found
+
+def download_video(url: str) -> Path:
+    """
+    Download a video from a URL using yt-dlp and return the local file path.
+    """
+    return download_video_with_info(url)[0]
+
+def release_video(path: Path):
+    """Done with a downloaded file: unpin it, and delete it right away in ephemeral mode."""
+    entry = Path(path).parent
+    if entry.parent != MEDIA_DIR:
+        return
+    _unpin(entry.name)
+    if DOWNLOAD_CACHE_MODE == "ephemeral":
+        _remove_entry(entry)
@@ -0,0 +1,421 @@
+from __future__ import annotations
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+import numpy as np
+
+from app.config import (
+    STREAM_INGEST, NOT_ORIGINAL_THRESHOLD, SECOND_PASS_TOP_K, FRAME_OVERLAP_THRESHOLD, HAMMING_MAX_BITS,
+    DOWNLOAD_CONCURRENCY, FINGERPRINT_WORKERS, FRAME_SAMPLES,
+    PROGRESSIVE_SAMPLING, PROGRESSIVE_STAGES, SIMILARITY_BAND, OVERLAP_BAND, VERDICT_RECHECK_MAX_ROWS,
+    SEGMENTS_ENABLED, SEGMENT_SECONDS, SEGMENT_FRAMES, SEGMENT_HAMMING_MAX_BITS, SEGMENT_MIN_RUN,
+)
+from app.fetchers import VideoMeta, build_video_meta, remember_video_id, resolve_video_id
+from app.fingerprint import (
+    Fingerprint, NoFramesError, extract_fingerprint, frame_phashes, pair_positions, partial_fingerprint,
+    sample_features, sample_gap,
+)
+from app.frames import progressive_order
+from app.netio import download_video, download_video_with_info, release_video, transfer_slot
+from app.streaming import StreamUnavailable, stream_fingerprint, streaming_available
+from app.shards import Change, get_corpus
+from app.matcher import Match
+from app.hamming import batch_overlap, overlap_fraction
+from app.metrics import FRAMES_DECODED, SECOND_PASS, VERDICTS, call_collected, carry, merge, span
+from app.segments import clear_of_reuse, find_reuse, index_signatures
+from app.verdicts import CachedVerdict, get_verdict_cache
+
+# ---------------- URL -> (metadata, fingerprint) ----------------
+
+@dataclass
+class Ingested:
+    meta: VideoMeta
+    fp: Fingerprint
+    nbytes: int = 0  # size of the downloaded media (0 when streamed)
+
+def _cpu(cpu: Executor | None, fn, *args):
+    """
+    Run CPU-bound work on `cpu` (e.g. a process pool) when given, else inline.
+    Spans recorded in the worker are replayed here.
+    """
+    if cpu is None:
+        return fn(*args)
+    result, spans = cpu.submit(call_collected, fn, *args).result()
+    merge(spans)
+    return result
+
+def ingest(url: str, cpu: Executor | None = None) -> Ingested:
+    """
+    Fetch and fingerprint one URL. Streams at low resolution when STREAM_INGEST
+    is on and possible; otherwise downloads (through the cache) and decodes the file.
+    Decoding and hashing run on `cpu` when given.
+    """
+    if STREAM_INGEST and streaming_available():
+        try:
+            with transfer_slot():
+                fp, info = _cpu(cpu, stream_fingerprint, url)
+            FRAMES_DECODED.inc(fp.frames_decoded)
+            vid = str(info.get("id") or "")
+            if vid:
+                remember_video_id(url, vid)
+                return Ingested(VideoMeta(url=url, id=vid, title=info.get("title"), filepath=None), fp)
+        except StreamUnavailable:
+            pass
+
+    path, info = download_video_with_info(url)
+    try:
+        meta = build_video_meta(url, path, info)
+        fp = _cpu(cpu, extract_fingerprint, path)
+        nbytes = path.stat().st_size
+    finally:
+        release_video(path)
+    FRAMES_DECODED.inc(fp.frames_decoded)
+    return Ingested(meta, fp, nbytes)
+
+def ingest_many(urls: list[str], cpu: Executor | None = None) -> list[Ingested | Exception]:
+    """
+    ingest() for several URLs at once, in input order; a failure is returned in
+    its slot instead of raised. Concurrency is bounded by netio's transfer slots
+    for the network and by `cpu` for decoding.
+    """
+    if not urls:
+        return []
+
+    def one(url: str) -> Ingested | Exception:
+        try:
+            return ingest(url, cpu)
+        except Exception as e:
+            return e
+
+    workers = min(len(urls), DOWNLOAD_CONCURRENCY + FINGERPRINT_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as pool:
+        return list(pool.map(carry(one), urls))
+
+# ---------------- index / analyze ----------------
+
+def _store(ing: Ingested):
+    meta, fp = ing.meta, ing.fp
+    corpus = get_corpus()
+    corpus.add_many([(meta.id, meta.url, meta.title, fp.vec, fp.hashes)])
+    if SEGMENTS_ENABLED and fp.timeline is not None:
+        corpus.add_segments([(meta.id, index_signatures(fp.timeline))])
+
+def index_url(url: str, cpu: Executor | None = None) -> dict:
+    """Download, fingerprint, and store a video for future comparisons."""
+    ing = ingest(url, cpu)
+    _store(ing)
+    return {"indexed": True, "frames_decoded": ing.fp.frames_decoded}
+
+def _already_indexed(url: str) -> bool:
+    # exact same TikTok id already stored -> NOT original, before any media transfer
+    known_id = resolve_video_id(url)
+    return known_id is not None and known_id in get_corpus()
+
+def _decided(by: str, original: bool) -> dict:
+    VERDICTS.inc(decided_by=by, original=str(original).lower())
+    return {"original": original}
+
+def _verdict(ing: Ingested, matches: list[Match], cpu: Executor | None = None) -> dict:
+    """Decision for one fingerprinted query given its first-pass (coarse) matches."""
+    corpus = get_corpus()
+    meta = ing.meta
+    qhashes = ing.fp.hashes
+
+    if not matches and len(corpus) == 0:
+        return _decided("empty_corpus", True)
+
+    # id only known after download (unrecognized URL shape)
+    if meta.id in corpus:
+        return _decided("known_id", False)
+
+    # first pass: coarse similarity (only fingerprints with same dimensionality)
+    if matches and matches[0].similarity >= NOT_ORIGINAL_THRESHOLD:
+        return _decided("coarse", False)
+
+    SECOND_PASS.inc()
+
+    # second pass: precise pHash overlap against the top-k candidates,
+    # using frame hashes stored at index time (legacy rows are re-downloaded once)
+    stored = corpus.get_hashes([m.video_id for m in matches])
+    local = [m for m in matches if m.video_id in stored]
+    if local:
+        overlaps = batch_overlap(qhashes, [stored[m.video_id] for m in local])
+        # enough near-identical frames -> NOT original
+        if (overlaps >= FRAME_OVERLAP_THRESHOLD).any():
+            return _decided("frame_overlap", False)
+
+    # corpus-wide frame lookup: catches re-uploads the coarse vector misses
+    # (e.g. heavy color grading), independent of the top-k candidates
+    min_frames = int(np.ceil(FRAME_OVERLAP_THRESHOLD * len(qhashes)))
+    if corpus.frame_query(qhashes, min_frames=min_frames):
+        return _decided("frame_lookup", False)
+
+    # partial reuse: a time-aligned run of segment windows shared with any
+    # corpus video (e.g. a short clip cut from a long upload)
+    if SEGMENTS_ENABLED:
+        runs = find_reuse(corpus, ing.fp.timeline)
+        if runs:
+            return {**_decided("segment_run", False), "segments": [asdict(r) for r in runs]}
+
+    for m in matches:
+        if m.video_id in stored:
+            continue
+        with span("second_pass_download"):
+            cpath = download_video(m.url)
+            try:
+                chashes = _cpu(cpu, frame_phashes, cpath)
+            finally:
+                release_video(cpath)
+        FRAMES_DECODED.inc(len(chashes))
+        corpus.add_hashes(m.video_id, chashes)
+        if overlap_fraction(qhashes, chashes) >= FRAME_OVERLAP_THRESHOLD:
+            return _decided("second_pass_download", False)
+
+    # otherwise, treat as original
+    return _decided("no_match", True)
+
+def analyze_url(url: str, cpu: Executor | None = None) -> dict:
+    """
+    {"original": True} if the video is original vs the corpus, else {"original": False},
+    plus "frames_decoded" (query frames decoded to get there).
+    Coarse vector first pass, then precise frame-level pHash overlap. Ids
+    analyzed before are answered from the verdict cache ("cached": True).
+    """
+    if _already_indexed(url):
+        return {**_decided("known_id", False), "frames_decoded": 0}
+    cached = _cached_verdict(resolve_video_id(url))
+    if cached is not None:
+        return cached
+    if _progressive():
+        return _analyze_progressive(url, cpu)
+    version = get_corpus().version()  # before the search: rows added meanwhile get re-checked
+    # query features (one decode for both the coarse vector and frame hashes)
+    ing = ingest(url, cpu)
+    matches = get_corpus().search_many([ing.fp.vec], top_k=SECOND_PASS_TOP_K)[0]
+    res = _verdict(ing, matches, cpu)
+    _remember(ing.meta.id, res["original"], ing.fp, version, segments=res.get("segments"))
+    return {**res, "frames_decoded": ing.fp.frames_decoded}
+
+# ---------------- verdict cache ----------------
+
+def _settings() -> tuple:
+    """What a verdict depends on besides the corpus and the query; cached verdicts need the same."""
+    return (NOT_ORIGINAL_THRESHOLD, FRAME_OVERLAP_THRESHOLD, HAMMING_MAX_BITS, SECOND_PASS_TOP_K,
+            FRAME_SAMPLES, SIMILARITY_BAND, OVERLAP_BAND, SEGMENTS_ENABLED, SEGMENT_SECONDS, SEGMENT_FRAMES,
+            SEGMENT_HAMMING_MAX_BITS, SEGMENT_MIN_RUN)
+
+def _remember(video_id: str, original: bool, fp: Fingerprint, version: tuple[int, ...], partial: bool = False,
+              segments: list[dict] | None = None):
+    get_verdict_cache().put(video_id, CachedVerdict(
+        original=original, vec=fp.vec, hashes=fp.hashes, timeline=fp.timeline, partial=partial,
+        version=version, settings=_settings(), created=time.time(), segments=segments,
+    ))
+
+def _recheck(entry: CachedVerdict, rows: list[Change]) -> tuple[bool | None, list[dict] | None]:
+    """
+    A cached "original" against the corpus rows written since it was decided:
+    False on a match (coarse similarity, frame overlap or a segment run, with
+    the runs), True if none comes close, None if unsure (rows without frame
+    hashes, or a partial-sample fingerprint within the progressive bands or
+    close to a new segment).
+    """
+    if any(h is None for _vid, _v, h in rows):
+        return None, None
+    if SEGMENTS_ENABLED and rows:
+        ids = {vid for vid, _v, _h in rows}
+        runs = find_reuse(get_corpus(), entry.timeline, only=ids)
+        if runs:
+            return False, [asdict(r) for r in runs]
+        if entry.timeline is None and not clear_of_reuse(get_corpus(), entry.hashes, only=ids):
+            return None, None  # decided on a partial sample: only a full decode can tell
+    sim_band, overlap_band = (SIMILARITY_BAND, OVERLAP_BAND) if entry.partial else (0.0, 0.0)
+    vecs = [vec for _vid, vec, _h in rows if vec.shape == entry.vec.shape]
+    best = float((np.stack(vecs) @ entry.vec).max()) if vecs else 0.0
+    top = float(batch_overlap(entry.hashes, [h for _vid, _v, h in rows]).max()) if rows else 0.0
+    if best >= NOT_ORIGINAL_THRESHOLD + sim_band or top >= FRAME_OVERLAP_THRESHOLD + overlap_band:
+        return False, None
+    if best >= NOT_ORIGINAL_THRESHOLD - sim_band or top >= FRAME_OVERLAP_THRESHOLD - overlap_band:
+        return None, None
+    return True, None
+
+def _cached_verdict(video_id: str | None) -> dict | None:
+    """
+    Result for an already analyzed id without a download, or None to analyze it.
+    "not original" stands while the corpus only grows; "original" is re-checked
+    against the rows indexed since (more than VERDICT_RECHECK_MAX_ROWS: recompute).
+    Segment runs found with the verdict are returned again.
+    """
+    cache = get_verdict_cache()
+    entry = cache.get(video_id, _settings())
+    if entry is None:
+        return None
+    corpus = get_corpus()
+    if entry.original:
+        delta = corpus.changes_since(entry.version, VERDICT_RECHECK_MAX_ROWS)
+        original, segments = (None, None) if delta is None else _recheck(entry, delta[1])
+        if original is None:
+            cache.discard(video_id)
+            return None
+        cache.advance(video_id, entry, original, delta[0], segments)
+    else:
+        version = corpus.version()
+        if len(version) != len(entry.version) or any(v < e for v, e in zip(version, entry.version)):
+            cache.discard(video_id)  # store rebuilt or re-sharded
+            return None
+    res = _decided("cache", entry.original)
+    if entry.segments:
+        res["segments"] = entry.segments
+    return {**res, "frames_decoded": 0, "cached": True}
+
+# ---------------- progressive sampling ----------------
+
+def _progressive() -> bool:
+    return PROGRESSIVE_SAMPLING and not (STREAM_INGEST and streaming_available())
+
+def _early_verdict(fp: Fingerprint, matches: list[Match], gap: float) -> bool | None:
+    """
+    Verdict ("original") from a partial sample when every check is clear of its
+    threshold by the configured band, else None (decode more). Same checks as
+    _verdict: coarse similarity, overlap with the candidates' stored hashes,
+    corpus-wide frame lookup; with segments, clear_of_reuse() on the sampled
+    frames, whose largest gap is `gap` seconds.
+    """
+    corpus = get_corpus()
+    best = matches[0].similarity if matches else 0.0
+    if best >= NOT_ORIGINAL_THRESHOLD + SIMILARITY_BAND:
+        return False
+    uncertain = best > NOT_ORIGINAL_THRESHOLD - SIMILARITY_BAND
+    stored = corpus.get_hashes([m.video_id for m in matches])
+    if len(stored) < len(matches):
+        uncertain = True  # legacy candidates without stored hashes: left to the full pass
+    n = len(fp.hashes)
+    low = FRAME_OVERLAP_THRESHOLD - OVERLAP_BAND
+    overlaps = list(batch_overlap(fp.hashes, list(stored.values()))) if stored else []
+    hits = corpus.frame_query(fp.hashes, min_frames=max(1, int(np.ceil(low * n))))
+    top = max(overlaps + [c / n for c in hits.values()], default=0.0)
+    if top >= FRAME_OVERLAP_THRESHOLD + OVERLAP_BAND:
+        return False
+    if uncertain or top > low:
+        return None
+    if SEGMENTS_ENABLED and not clear_of_reuse(corpus, fp.hashes, gap):
+        return None  # a lifted clip could sit between the sampled frames, or one is close to a segment
+    return True
+
+def _analyze_progressive(url: str, cpu: Executor | None = None) -> dict:
+    """
+    analyze_url() decoding coarse to fine: PROGRESSIVE_STAGES partial samples
+    (frame pairs at evenly spaced anchors, each stage extending the previous
+    one), scored against the corpus after every stage; the full extraction runs
+    only if none is conclusive.
+    """
+    corpus = get_corpus()
+    version = corpus.version()
+    path, info = download_video_with_info(url)
+    decoded = 0
+    try:
+        meta = build_video_meta(url, path, info)
+        if meta.id in corpus:
+            return {**_decided("known_id", False), "frames_decoded": 0}
+        anchors = [2 * a for a in progressive_order(FRAME_SAMPLES // 2)]
+        parts, done = [], 0
+        for size in PROGRESSIVE_STAGES:
+            if size >= FRAME_SAMPLES:
+                break
+            part = _cpu(cpu, sample_features, path, pair_positions(anchors[done:size // 2]))
+            parts.append(part)
+            decoded += len(part.positions)
+            FRAMES_DECODED.inc(len(part.positions))
+            done = size // 2
+            if part.grid <= size:
+                break  # short video: its whole grid is about this small, decode it properly
+            try:
+                fp = partial_fingerprint(parts)
+            except NoFramesError:
+                break
+            early = _early_verdict(fp, corpus.search_many([fp.vec], top_k=SECOND_PASS_TOP_K)[0], sample_gap(parts))
+            if early is not None:
+                _remember(meta.id, early, fp, version, partial=True)
+                return {**_decided("progressive", early), "frames_decoded": decoded}
+        fp = _cpu(cpu, extract_fingerprint, path)
+        FRAMES_DECODED.inc(fp.frames_decoded)
+        nbytes = path.stat().st_size
+    finally:
+        release_video(path)
+    ing = Ingested(meta, fp, nbytes)
+    matches = corpus.search_many([fp.vec], top_k=SECOND_PASS_TOP_K)[0]
+    res = _verdict(ing, matches, cpu)
+    _remember(meta.id, res["original"], fp, version, segments=res.get("segments"))
+    return {**res, "frames_decoded": decoded + fp.frames_decoded}
+
+# ---------------- batches ----------------
+
+def _error(url: str, e: Exception) -> dict:
+    return {"url": url, "error": str(e) or type(e).__name__}
+
+def index_urls(urls: list[str], cpu: Executor | None = None) -> list[dict]:
+    """index_url() for many URLs fetched concurrently; per-URL results in input order."""
+    unique = list(dict.fromkeys(urls))
+    done: dict[str, dict] = {}
+    for url, ing in zip(unique, ingest_many(unique, cpu)):
+        if isinstance(ing, Exception):
+            done[url] = _error(url, ing)
+            continue
+        try:
+            _store(ing)
+            done[url] = {"url": url, "indexed": True, "frames_decoded": ing.fp.frames_decoded}
+        except Exception as e:
+            done[url] = _error(url, e)
+    return [done[u] for u in urls]
+
+def analyze_urls(urls: list[str], cpu: Executor | None = None) -> list[dict]:
+    """
+    analyze_url() for many URLs: known ids are answered without a transfer, the
+    rest are fetched concurrently and ranked against the corpus in one matrix
+    product. Per-URL results (or errors) in input order.
+    """
+    unique = list(dict.fromkeys(urls))
+    done: dict[str, dict] = {}
+    todo = []
+    for url in unique:
+        try:
+            if _already_indexed(url):
+                done[url] = {"url": url, **_decided("known_id", False), "frames_decoded": 0}
+                continue
+            cached = _cached_verdict(resolve_video_id(url))
+            if cached is not None:
+                done[url] = {"url": url, **cached}
+                continue
+        except Exception as e:
+            done[url] = _error(url, e)
+            continue
+        todo.append(url)
+
+    if todo and _progressive():
+        # each URL stops at its own stage, so they run side by side instead of ranked together
+        def one(url: str) -> dict:
+            try:
+                return {"url": url, **_analyze_progressive(url, cpu)}
+            except Exception as e:
+                return _error(url, e)
+        workers = min(len(todo), DOWNLOAD_CONCURRENCY + FINGERPRINT_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analyze") as pool:
+            done.update(zip(todo, pool.map(carry(one), todo)))
+        return [done[u] for u in urls]
+
+    version = get_corpus().version()
+    fetched = []
+    for url, ing in zip(todo, ingest_many(todo, cpu)):
+        if isinstance(ing, Exception):
+            done[url] = _error(url, ing)
+        else:
+            fetched.append((url, ing))
+
+    ranked = get_corpus().search_many([ing.fp.vec for _, ing in fetched], top_k=SECOND_PASS_TOP_K)
+    for (url, ing), matches in zip(fetched, ranked):
+        try:
+            res = _verdict(ing, matches, cpu)
+            _remember(ing.meta.id, res["original"], ing.fp, version, segments=res.get("segments"))
+            done[url] = {"url": url, **res, "frames_decoded": ing.fp.frames_decoded}
+        except Exception as e:
+            done[url] = _error(url, e)
+    return [done[u] for u in urls]
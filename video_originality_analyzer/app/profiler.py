@@ -0,0 +1,91 @@
+from __future__ import annotations
+import sys
+import threading
+import time
+from collections import Counter
+
+from app.config import PROFILER_INTERVAL_SECONDS, PROFILER_MAX_SECONDS
+
+# ---------------- sampling profiler (switched on at runtime) ----------------
+#
+# A daemon thread snapshots every other thread's Python stack each `interval`
+# seconds (sys._current_frames) and counts identical stacks. Nothing runs until
+# start(); stop() returns the counts as folded stacks ("a;b;c 42" per line),
+# the input of flamegraph.pl and speedscope. It sees this process only: work
+# on the fingerprint process pool shows up as job threads waiting on results.
+
+def _stack(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._counts: Counter[str] = Counter()
+        self.samples = 0
+        self.started_at: float | None = None
+        self.interval = PROFILER_INTERVAL_SECONDS
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = PROFILER_INTERVAL_SECONDS, max_seconds: float = PROFILER_MAX_SECONDS) -> bool:
+        """
+        Begin sampling (fresh counts); False if already running. Stops itself after
+        max_seconds, capped at PROFILER_MAX_SECONDS.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self._counts, self.samples = Counter(), 0
+            self.interval, self.started_at = max(interval, 0.001), time.time()
+            self._stop.clear()
+            max_seconds = min(max_seconds, PROFILER_MAX_SECONDS)
+            self._thread = threading.Thread(target=self._run, args=(max_seconds,),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> str:
+        """Stop sampling and return the folded stacks collected since start()."""
+        with self._lock:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+            self._thread = None
+            return self.folded()
+
+    def folded(self) -> str:
+        counts = dict(self._counts)
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(counts.items(), key=lambda kv: -kv[1]))
+
+    def status(self) -> dict:
+        return {"running": self.running, "interval": self.interval, "samples": self.samples,
+                "started_at": self.started_at, "stacks": len(self._counts)}
+
+    def _run(self, max_seconds: float):
+        me = threading.get_ident()
+        deadline = time.monotonic() + max_seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            for tid, frame in sys._current_frames().items():
+                if tid != me:
+                    self._counts[_stack(frame)] += 1
+            self.samples += 1
+
+_PROFILER: SamplingProfiler | None = None
+_PROFILER_LOCK = threading.Lock()
+
+def get_profiler() -> SamplingProfiler:
+    global _PROFILER
+    if _PROFILER is None:
+        with _PROFILER_LOCK:
+            if _PROFILER is None:
+                _PROFILER = SamplingProfiler()
+    return _PROFILER
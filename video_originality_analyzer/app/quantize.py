@@ -0,0 +1,103 @@
+from __future__ import annotations
+import struct
+import numpy as np
+
+from app.config import HASH_SIZE, HSV_BINS, EDGE_GRID, MOTION_BINS
+
+# ---------------- compact fingerprint encoding ----------------
+#
+# The coarse vector is [hash bit means | HSV histogram | edge densities |
+# motion histogram], L2-normalized, all non-negative. The compact form stores
+# each block as uint8 codes with one float32 scale per block and row
+# (x ~= code * scale), i.e. 736 + 16 bytes instead of 2944. The scales also
+# absorb the norm of the dequantized row, so a plain dot product with a
+# float32 query is already the cosine; queries are never quantized.
+
+FORMAT_FLOAT32 = 0
+FORMAT_COMPACT = 1
+
+_BLOCK_SIZES = (3 * HASH_SIZE * HASH_SIZE, int(np.prod(HSV_BINS)), EDGE_GRID * EDGE_GRID, MOTION_BINS)
+BLOCKS = tuple(
+    slice(sum(_BLOCK_SIZES[:i]), sum(_BLOCK_SIZES[:i + 1])) for i in range(len(_BLOCK_SIZES))
+)
+COMPACT_DIM = sum(_BLOCK_SIZES)  # 736 with the default config
+N_BLOCKS = len(BLOCKS)
+
+_SCALES = struct.Struct(f"<{N_BLOCKS}f")
+_CHUNK_ROWS = 16384  # rows dequantized per step while scoring, bounds temporaries
+
+def compactable(dim: int) -> bool:
+    return dim == COMPACT_DIM
+
+def encode(vecs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(n, COMPACT_DIM) float32 -> (uint8 codes (n, COMPACT_DIM), float32 scales (n, N_BLOCKS))."""
+    x = np.clip(np.atleast_2d(np.asarray(vecs, dtype=np.float32)), 0.0, None)
+    n = x.shape[0]
+    codes = np.empty(x.shape, dtype=np.uint8)
+    scales = np.zeros((n, N_BLOCKS), dtype=np.float32)
+    for b, sl in enumerate(BLOCKS):
+        peak = x[:, sl].max(axis=1)
+        step = np.where(peak > 0, peak / 255.0, 1.0).astype(np.float32)
+        codes[:, sl] = np.rint(x[:, sl] / step[:, None])
+        scales[:, b] = np.where(peak > 0, step, 0.0)
+    # fold the dequantized norm into the scales: decode(...) is unit length again
+    norm = np.sqrt(sum(
+        (scales[:, b] ** 2) * np.einsum("ij,ij->i", codes[:, sl].astype(np.float32), codes[:, sl].astype(np.float32))
+        for b, sl in enumerate(BLOCKS)
+    ))
+    scales /= np.where(norm > 0, norm, 1.0)[:, None]
+    return codes, scales
+
+def decode(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Inverse of encode() (up to quantization error); float32 rows."""
+    codes = np.atleast_2d(codes)
+    scales = np.atleast_2d(scales)
+    out = codes.astype(np.float32)
+    for b, sl in enumerate(BLOCKS):
+        out[:, sl] *= scales[:, b:b + 1]
+    return out
+
+def scores(codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Dot products of a float32 query with every compact row, shape (n,), float32."""
+    q = np.asarray(query, dtype=np.float32).reshape(-1)
+    n = codes.shape[0]
+    out = np.empty((n,), dtype=np.float32)
+    qb = [q[sl] for sl in BLOCKS]
+    for s in range(0, n, _CHUNK_ROWS):
+        c = codes[s:s + _CHUNK_ROWS].astype(np.float32)
+        # per-block dot products (rows, N_BLOCKS), then weight by each row's scales
+        partial = np.stack([c[:, sl] @ qb[b] for b, sl in enumerate(BLOCKS)], axis=1)
+        out[s:s + _CHUNK_ROWS] = np.einsum("ij,ij->i", partial, scales[s:s + _CHUNK_ROWS])
+    return out
+
+def scores_many(codes: np.ndarray, scales: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """scores() for a (m, COMPACT_DIM) query stack: (m, n) float32."""
+    Q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    n = codes.shape[0]
+    out = np.empty((Q.shape[0], n), dtype=np.float32)
+    for s in range(0, n, _CHUNK_ROWS):
+        c = codes[s:s + _CHUNK_ROWS].astype(np.float32)
+        sc = scales[s:s + _CHUNK_ROWS]
+        acc = np.zeros((Q.shape[0], c.shape[0]), dtype=np.float32)
+        for b, sl in enumerate(BLOCKS):
+            acc += (Q[:, sl] @ c[:, sl].T) * sc[:, b][None, :]
+        out[:, s:s + _CHUNK_ROWS] = acc
+    return out
+
+# ----- blobs (store format FORMAT_COMPACT) -----
+
+def to_blob(codes: np.ndarray, scales: np.ndarray) -> bytes:
+    return _SCALES.pack(*np.asarray(scales, dtype=np.float32).reshape(-1)) + \
+        np.ascontiguousarray(codes, dtype=np.uint8).tobytes()
+
+def from_blob(blob: bytes) -> tuple[np.ndarray, np.ndarray]:
+    scales = np.array(_SCALES.unpack_from(blob), dtype=np.float32)
+    codes = np.frombuffer(blob, dtype=np.uint8, offset=_SCALES.size)
+    return codes, scales
+
+def vec_from_blob(fmt: int, blob: bytes) -> np.ndarray:
+    """float32 vector from a stored blob of either format."""
+    if fmt == FORMAT_COMPACT:
+        codes, scales = from_blob(blob)
+        return decode(codes, scales)[0]
+    return np.frombuffer(blob, dtype=np.float32)
@@ -0,0 +1,133 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import numpy as np
+
+from app.config import SEGMENT_SECONDS, SEGMENT_FRAMES, SEGMENT_HAMMING_MAX_BITS, SEGMENT_MIN_RUN
+from app.hamming import pack_bits, popcount
+
+# ---------------- segment-level temporal fingerprints ----------------
+#
+# The timeline of a video is hashed as frame pHashes every
+# SEGMENT_SECONDS / SEGMENT_FRAMES seconds. A window signature is the bitwise
+# majority of SEGMENT_FRAMES consecutive frame hashes (one 64-bit value per
+# SEGMENT_SECONDS). Indexed videos store back-to-back windows; a query uses
+# windows at half that stride, so one of them starts within a quarter window
+# of every corpus window whatever the cut point of the clip. Window signatures
+# go into a multi-index hashing inverted index (app/frame_index.py) that
+# returns (query window, video, corpus window) hits; a clip reused from a
+# corpus video shows up as a run of consecutive corpus windows all hit at the
+# same time offset.
+
+QUERY_STRIDE = max(1, SEGMENT_FRAMES // 2)  # timeline frames between query windows
+
+@dataclass
+class SegmentMatch:
+    video_id: str
+    offset: float       # seconds into the corpus video where the shared run starts
+    query_start: float  # seconds into the query where it starts
+    duration: float     # seconds covered by the run
+    windows: int        # consecutive corpus windows in the run
+
+def _bits(hashes: np.ndarray) -> np.ndarray:
+    """(n, 64) uint8 bits of packed hashes, in pack_bits order (first bit = MSB)."""
+    h = np.ascontiguousarray(hashes, dtype=np.uint64).astype(">u8")
+    return np.unpackbits(h.view(np.uint8).reshape(-1, 8), axis=1)
+
+def window_signatures(timeline: np.ndarray, stride: int = SEGMENT_FRAMES) -> np.ndarray:
+    """Majority-vote signature of every SEGMENT_FRAMES-frame window starting each `stride` frames."""
+    t = np.asarray(timeline, dtype=np.uint64).reshape(-1)
+    n = (t.size - SEGMENT_FRAMES) // stride + 1 if t.size >= SEGMENT_FRAMES else 0
+    if n <= 0:
+        return np.empty((0,), dtype=np.uint64)
+    sums = np.concatenate([np.zeros((1, 64), np.int32), np.cumsum(_bits(t), axis=0, dtype=np.int32)])
+    starts = np.arange(n) * stride
+    votes = sums[starts + SEGMENT_FRAMES] - sums[starts]  # (n, 64) ones per bit in each window
+    return pack_bits(2 * votes > SEGMENT_FRAMES)
+
+def index_signatures(timeline: np.ndarray) -> np.ndarray:
+    """Back-to-back window signatures stored for an indexed video (window k = [k, k + 1) * SEGMENT_SECONDS)."""
+    return window_signatures(timeline, SEGMENT_FRAMES)
+
+def query_signatures(timeline: np.ndarray) -> np.ndarray:
+    """Window signatures of a query at half-window stride."""
+    return window_signatures(timeline, QUERY_STRIDE)
+
+def informative(signatures: np.ndarray) -> np.ndarray:
+    """
+    Mask of windows worth looking up. A pHash sets about half its bits (median
+    threshold); far fewer or more means flat frames (black, fades, title
+    cards) that every video shares.
+    """
+    ones = popcount(np.asarray(signatures, dtype=np.uint64)).astype(np.int32)
+    return np.abs(ones - 32) <= 16
+
+def find_runs(hits: list[tuple[int, str, int]], min_run: int = SEGMENT_MIN_RUN) -> list[SegmentMatch]:
+    """
+    Longest time-aligned run per corpus video from (query window, video id,
+    corpus window) hits; runs of at least `min_run` windows, longest first.
+    A query window q starts at q * QUERY_STRIDE timeline frames and corpus
+    window c at c * SEGMENT_FRAMES, so a fixed shift keeps
+    d = c * SEGMENT_FRAMES - q * QUERY_STRIDE within one query stride.
+    """
+    by_video: dict[str, list[tuple[int, int]]] = {}
+    for q, vid, c in hits:
+        by_video.setdefault(vid, []).append((q, c))
+    frame_seconds = SEGMENT_SECONDS / SEGMENT_FRAMES
+    out = []
+    for vid, pairs in by_video.items():
+        qc = np.array(pairs, dtype=np.int64)
+        d = qc[:, 1] * SEGMENT_FRAMES - qc[:, 0] * QUERY_STRIDE
+        best = None  # (windows, hits exactly at the shift, first corpus window, shift)
+        shifts, exact = np.unique(d, return_counts=True)
+        for shift, n_exact in zip(shifts, exact):
+            cs = np.unique(qc[np.abs(d - shift) <= QUERY_STRIDE, 1])
+            # longest stretch of consecutive corpus windows
+            breaks = np.flatnonzero(np.diff(cs) != 1)
+            starts = np.r_[0, breaks + 1]
+            ends = np.r_[breaks, cs.size - 1]
+            i = int(np.argmax(ends - starts))
+            cand = (int(ends[i] - starts[i] + 1), int(n_exact), int(cs[starts[i]]), int(shift))
+            if best is None or cand[:2] > best[:2]:
+                best = cand
+        run, _exact, first, shift = best
+        if run >= min_run:
+            out.append(SegmentMatch(
+                video_id=vid,
+                offset=round(first * SEGMENT_SECONDS, 3),
+                query_start=round(max(0, first * SEGMENT_FRAMES - shift) * frame_seconds, 3),
+                duration=round(run * SEGMENT_SECONDS, 3),
+                windows=run,
+            ))
+    return sorted(out, key=lambda m: -m.windows)
+
+def clear_of_reuse(corpus, hashes: np.ndarray, gap: float | None = None, only: set[str] | None = None) -> bool:
+    """
+    Cheap segment check for a partial sample (sparse frame pHashes, no
+    timeline): True when no reused run of SEGMENT_MIN_RUN windows can hide in
+    it. That needs every stretch between sampled frames (`gap` seconds, None =
+    already checked) shorter than such a run less one window, so a frame lands
+    inside any of them, and no sampled frame close to an indexed window
+    signature (`only`: of these ids).
+    """
+    if gap is not None and gap > (SEGMENT_MIN_RUN - 1) * SEGMENT_SECONDS:
+        return False
+    h = np.asarray(hashes, dtype=np.uint64).reshape(-1)
+    hits = corpus.segment_query(h[informative(h)], SEGMENT_HAMMING_MAX_BITS)
+    return not any(only is None or vid in only for _q, vid, _c in hits)
+
+def find_reuse(corpus, timeline: np.ndarray | None, only: set[str] | None = None,
+               min_run: int = SEGMENT_MIN_RUN) -> list[SegmentMatch]:
+    """
+    Corpus videos sharing a run of at least `min_run` time-aligned windows with
+    the query timeline (`only`: restrict to these ids). `corpus` is the
+    ShardedCorpus (see app/shards.py).
+    """
+    if timeline is None:
+        return []
+    sigs = query_signatures(timeline)
+    keep = np.flatnonzero(informative(sigs))
+    if keep.size < min_run:
+        return []
+    hits = corpus.segment_query(sigs[keep], SEGMENT_HAMMING_MAX_BITS)
+    hits = [(int(keep[q]), vid, c) for q, vid, c in hits if only is None or vid in only]
+    return find_runs(hits, min_run)
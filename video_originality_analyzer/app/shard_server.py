@@ -0,0 +1,129 @@
+from __future__ import annotations
+from dataclasses import asdict
+import numpy as np
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from app import metrics
+from app.shards import LocalShard, pack_array, unpack_array
+
+# ---------------- shard server: one LocalShard over HTTP ----------------
+#
+# The protocol RemoteShard speaks. Every call is a JSON POST; vectors and
+# frame hashes travel as base64 of little-endian float32 / uint64 arrays.
+#
+#   /shard/stats        {}                         -> {"size", "version"}
+#   /shard/contains     {"ids"}                    -> {"ids": [present ids]}
+#   /shard/add          {"rows": [{video_id, url, title, vec, hashes|null}]} -> {"added"}
+#   /shard/search       {"vectors", "top_k"}       -> {"results": [[{video_id, url, title, similarity}]]}
+#   /shard/changes      {"since", "limit"}         -> {"version", "rows": [{video_id, vec, hashes|null}] | null}
+#   /shard/hashes       {"ids"}                    -> {"hashes": {id: hashes}}
+#   /shard/hashes/add   {"video_id", "hashes"}     -> {}
+#   /shard/frames       {"hashes", "min_frames"}   -> {"matches": {id: matched query frames}}
+#   /shard/segments     {"hashes", "radius"}       -> {"hits": [[query window, id, corpus window]]}
+#   /shard/segments/add {"records": [{video_id, hashes}]} -> {"added"}
+#
+# GET /metrics serves this process' stage timings (store, rank, frame lookup).
+
+class IdsRequest(BaseModel):
+    ids: list[str]
+
+class ShardRow(BaseModel):
+    video_id: str
+    url: str
+    title: str | None = None
+    vec: str
+    hashes: str | None = None
+
+class AddRequest(BaseModel):
+    rows: list[ShardRow]
+
+class SearchRequest(BaseModel):
+    vectors: list[str]
+    top_k: int = 5
+
+class ChangesRequest(BaseModel):
+    since: int
+    limit: int
+
+class HashesAddRequest(BaseModel):
+    video_id: str
+    hashes: str
+
+class FramesRequest(BaseModel):
+    hashes: str
+    min_frames: int = 1
+
+class SegmentsRequest(BaseModel):
+    hashes: str
+    radius: int
+
+class SegmentRecord(BaseModel):
+    video_id: str
+    hashes: str
+
+class SegmentsAddRequest(BaseModel):
+    records: list[SegmentRecord]
+
+def create_app(shard: LocalShard) -> FastAPI:
+    app = FastAPI(title="Video Originality Analyzer shard")
+
+    # plain `def` endpoints: FastAPI runs them on its thread pool
+    @app.post("/shard/stats")
+    def stats():
+        return {"size": shard.size(), "version": shard.version()}
+
+    @app.post("/shard/contains")
+    def contains(req: IdsRequest):
+        return {"ids": sorted(shard.contains(req.ids))}
+
+    @app.post("/shard/add")
+    def add(req: AddRequest):
+        shard.add_many([
+            (r.video_id, r.url, r.title, unpack_array(r.vec, "<f4"),
+             None if r.hashes is None else unpack_array(r.hashes, "<u8").astype(np.uint64))
+            for r in req.rows
+        ])
+        return {"added": len(req.rows)}
+
+    @app.post("/shard/search")
+    def search(req: SearchRequest):
+        res = shard.search_many([unpack_array(v, "<f4") for v in req.vectors], req.top_k)
+        return {"results": [[asdict(m) for m in ms] for ms in res]}
+
+    @app.post("/shard/changes")
+    def changes(req: ChangesRequest):
+        version, rows = shard.changes(req.since, req.limit)
+        if rows is not None:
+            rows = [{"video_id": vid, "vec": pack_array(vec, "<f4"),
+                     "hashes": None if h is None else pack_array(h, "<u8")} for vid, vec, h in rows]
+        return {"version": version, "rows": rows}
+
+    @app.post("/shard/hashes")
+    def hashes(req: IdsRequest):
+        return {"hashes": {vid: pack_array(h, "<u8") for vid, h in shard.get_hashes(req.ids).items()}}
+
+    @app.post("/shard/hashes/add")
+    def hashes_add(req: HashesAddRequest):
+        shard.add_hashes(req.video_id, unpack_array(req.hashes, "<u8").astype(np.uint64))
+        return {}
+
+    @app.post("/shard/frames")
+    def frames(req: FramesRequest):
+        return {"matches": shard.frame_query(unpack_array(req.hashes, "<u8").astype(np.uint64), req.min_frames)}
+
+    @app.post("/shard/segments")
+    def segments(req: SegmentsRequest):
+        return {"hits": shard.segment_query(unpack_array(req.hashes, "<u8").astype(np.uint64), req.radius)}
+
+    @app.post("/shard/segments/add")
+    def segments_add(req: SegmentsAddRequest):
+        shard.add_segments([(r.video_id, unpack_array(r.hashes, "<u8").astype(np.uint64)) for r in req.records])
+        return {"added": len(req.records)}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    return app
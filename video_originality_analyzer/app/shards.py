@@ -0,0 +1,364 @@
+from __future__ import annotations
+import base64
+import heapq
+import http.client
+import json
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+import numpy as np
+
+from app.config import (
+    DATA_DIR, DB_PATH, FRAME_INDEX_PATH, ANN_PATH, SEGMENT_INDEX_PATH, SHARDS, SHARD_URLS, SHARD_TIMEOUT_SECONDS,
+    SEGMENTS_ENABLED,
+)
+from app.corpus import CorpusIndex, get_corpus_index
+from app.frame_index import FrameHashIndex, append_records, get_frame_index, seed_log
+from app.matcher import Match
+from app.metrics import carry, timed
+from app.store import FingerprintStore
+
+# ---------------- sharded corpus: partition by video id, scatter-gather queries ----------------
+#
+# A shard is one partition of the corpus with its own store file, corpus index,
+# frame hash index and segment index. Videos are assigned by a stable hash of
+# their id, so every process agrees on the owner without coordination: writes
+# and id lookups go to the owning shard, while similarity queries fan out to
+# all shards in parallel and the per-shard results are merged. A shard lives
+# in this process (LocalShard) or behind a shard server (RemoteShard, see
+# app/shard_server.py for the protocol). One local shard on the classic paths
+# is the unsharded setup.
+
+Row = tuple[str, str, "str | None", np.ndarray, "np.ndarray | None"]  # video_id, url, title, vec, hashes
+Change = tuple[str, np.ndarray, "np.ndarray | None"]                   # video_id, vec, hashes
+Segments = tuple[str, np.ndarray]                                       # video_id, window signatures
+SegmentHit = tuple[int, str, int]   # query window, video_id, window within that video
+
+def shard_of(video_id: str, n: int) -> int:
+    """Owning shard of a video id (crc32: identical in every process, unlike hash())."""
+    return zlib.crc32(video_id.encode("utf-8")) % n if n > 1 else 0
+
+def shard_paths(i: int, n: int, data_dir: Path = DATA_DIR) -> tuple[Path, Path, Path, Path]:
+    """(store, frame log, ANN model, segment log) paths of shard i of n; a single shard uses the classic names."""
+    tag = f".{i}-of-{n}" if n > 1 else ""
+    return tuple(Path(data_dir) / f"{p.stem}{tag}{p.suffix}"
+                 for p in (DB_PATH, FRAME_INDEX_PATH, ANN_PATH, SEGMENT_INDEX_PATH))
+
+def pack_array(a: np.ndarray, dtype) -> str:
+    return base64.b64encode(np.ascontiguousarray(a, dtype=dtype).tobytes()).decode("ascii")
+
+def unpack_array(s: str, dtype) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(s), dtype=dtype)
+
+class LocalShard:
+    """One partition in this process; indexes load on first query."""
+
+    def __init__(self, db_path: Path = DB_PATH, frame_path: Path = FRAME_INDEX_PATH, ann_path: Path = ANN_PATH,
+                 segment_path: Path = SEGMENT_INDEX_PATH):
+        self.db_path, self.frame_path, self.ann_path = Path(db_path), Path(frame_path), Path(ann_path)
+        self.segment_path = Path(segment_path)
+        self.store = FingerprintStore(self.db_path)
+        self._seeded = False
+        self._segments_seeded = False
+
+    @property
+    def index(self) -> CorpusIndex:
+        return get_corpus_index(self.db_path, self.ann_path)
+
+    @property
+    def frames(self) -> FrameHashIndex:
+        return get_frame_index(self.frame_path, self.store)
+
+    @property
+    def segments(self) -> FrameHashIndex:
+        return get_frame_index(self.segment_path, self.store, table="segment_hashes")
+
+    def size(self) -> int:
+        return len(self.index)
+
+    def warm(self) -> int:
+        """Load the vector, frame hash and segment indexes now; returns the row count."""
+        self.frames
+        if SEGMENTS_ENABLED:
+            self.segments
+        return len(self.index)
+
+    def version(self) -> int:
+        return self.store.version()
+
+    def contains(self, video_ids: list[str]) -> set[str]:
+        index = self.index
+        return {vid for vid in video_ids if vid in index}
+
+    def persist_many(self, rows: list[Row]):
+        """Write rows to the store and frame log only (bulk loads: indexes pick them up when loaded)."""
+        if not self._seeded:
+            seed_log(self.frame_path, self.store)  # keep the log complete before appending to it
+            self._seeded = True
+        self.store.upsert_many(rows)
+        append_records(self.frame_path, [(vid, hashes) for vid, _u, _t, _v, hashes in rows if hashes is not None])
+
+    def add_many(self, rows: list[Row]):
+        """Store rows and add them to the in-memory indexes."""
+        self.store.upsert_many(rows)
+        index, frames = self.index, self.frames
+        for vid, url, title, vec, hashes in rows:
+            index.add(vid, url, title, vec)
+            if hashes is not None:
+                frames.add(vid, hashes)
+
+    def search_many(self, vecs: list[np.ndarray], top_k: int) -> list[list[Match]]:
+        return self.index.search_many(vecs, top_k)
+
+    def changes(self, since: int, limit: int) -> tuple[int, list[Change] | None]:
+        """
+        (version, rows written after `since` with their hashes), or (version, None)
+        when there are more than `limit` or the store is behind `since` (rebuilt).
+        version covers exactly the rows returned.
+        """
+        if self.version() < since:
+            return self.version(), None
+        rows = []
+        for row in self.store.iter_rows(("video_id", "vec", "seq"), since=since):
+            if len(rows) == limit:
+                return self.version(), None
+            rows.append(row)
+        hashes = self.store.get_hashes([vid for vid, _v, _s in rows])
+        version = max((seq for *_, seq in rows), default=since)
+        return version, [(vid, vec, hashes.get(vid)) for vid, vec, _s in rows]
+
+    def get_hashes(self, video_ids: list[str]) -> dict[str, np.ndarray]:
+        return self.store.get_hashes(video_ids)
+
+    def add_hashes(self, video_id: str, hashes: np.ndarray):
+        self.store.upsert_hashes(video_id, hashes)
+        self.frames.add(video_id, hashes)
+
+    def frame_query(self, hashes: np.ndarray, min_frames: int) -> dict[str, int]:
+        return self.frames.query(hashes, min_frames=min_frames)
+
+    def persist_segments(self, records: list[Segments]):
+        """Write window signatures to the store and segment log only (bulk loads: queries replay the log)."""
+        if not self._segments_seeded:
+            seed_log(self.segment_path, self.store, "segment_hashes")
+            self._segments_seeded = True
+        self.store.upsert_hashes_many(records, "segment_hashes")
+        append_records(self.segment_path, records)
+
+    def add_segments(self, records: list[Segments]):
+        """Store window signatures and add them to the in-memory segment index."""
+        self.store.upsert_hashes_many(records, "segment_hashes")
+        segments = self.segments
+        for vid, sigs in records:
+            segments.add(vid, sigs)
+
+    def segment_query(self, signatures: np.ndarray, radius: int) -> list[SegmentHit]:
+        return self.segments.positions(signatures, radius)
+
+class ShardError(RuntimeError):
+    """A shard server failed or answered with an error."""
+
+class RemoteShard:
+    """A partition behind a shard server; JSON over one keep-alive connection per thread."""
+
+    def __init__(self, url: str, timeout: float = SHARD_TIMEOUT_SECONDS):
+        parts = urlsplit(url)
+        self.url = url
+        self._host, self._port = parts.hostname, parts.port or 80
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def _call(self, path: str, payload: dict | None = None) -> dict:
+        body = json.dumps(payload or {}).encode("utf-8")
+        for attempt in (0, 1):  # one retry on a dropped keep-alive connection
+            con = getattr(self._local, "con", None)
+            if con is None:
+                con = self._local.con = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+            try:
+                con.request("POST", path, body, {"Content-Type": "application/json"})
+                resp = con.getresponse()
+                data = resp.read()
+            except (ConnectionError, http.client.HTTPException, OSError) as e:
+                con.close()
+                self._local.con = None
+                if attempt:
+                    raise ShardError(f"{self.url}{path}: {e}") from e
+                continue
+            if resp.status != 200:
+                raise ShardError(f"{self.url}{path}: HTTP {resp.status} {data[:200]!r}")
+            return json.loads(data)
+
+    def size(self) -> int:
+        return self._call("/shard/stats")["size"]
+
+    warm = size  # opens the connection; the server warms its own indexes
+
+    def version(self) -> int:
+        return self._call("/shard/stats")["version"]
+
+    def contains(self, video_ids: list[str]) -> set[str]:
+        return set(self._call("/shard/contains", {"ids": list(video_ids)})["ids"])
+
+    def _rows(self, rows: list[Row]) -> list[dict]:
+        return [{"video_id": vid, "url": url, "title": title, "vec": pack_array(vec, "<f4"),
+                 "hashes": None if hashes is None else pack_array(hashes, "<u8")}
+                for vid, url, title, vec, hashes in rows]
+
+    def add_many(self, rows: list[Row]):
+        self._call("/shard/add", {"rows": self._rows(rows)})
+
+    persist_many = add_many  # the server keeps its indexes current either way
+
+    def search_many(self, vecs: list[np.ndarray], top_k: int) -> list[list[Match]]:
+        res = self._call("/shard/search", {"vectors": [pack_array(v, "<f4") for v in vecs], "top_k": top_k})
+        return [[Match(**m) for m in ms] for ms in res["results"]]
+
+    def changes(self, since: int, limit: int) -> tuple[int, list[Change] | None]:
+        res = self._call("/shard/changes", {"since": since, "limit": limit})
+        if res["rows"] is None:
+            return res["version"], None
+        return res["version"], [
+            (r["video_id"], unpack_array(r["vec"], "<f4"),
+             None if r["hashes"] is None else unpack_array(r["hashes"], "<u8").astype(np.uint64))
+            for r in res["rows"]
+        ]
+
+    def get_hashes(self, video_ids: list[str]) -> dict[str, np.ndarray]:
+        res = self._call("/shard/hashes", {"ids": list(video_ids)})
+        return {vid: unpack_array(h, "<u8").astype(np.uint64) for vid, h in res["hashes"].items()}
+
+    def add_hashes(self, video_id: str, hashes: np.ndarray):
+        self._call("/shard/hashes/add", {"video_id": video_id, "hashes": pack_array(hashes, "<u8")})
+
+    def frame_query(self, hashes: np.ndarray, min_frames: int) -> dict[str, int]:
+        return self._call("/shard/frames", {"hashes": pack_array(hashes, "<u8"), "min_frames": min_frames})["matches"]
+
+    def add_segments(self, records: list[Segments]):
+        self._call("/shard/segments/add", {"records": [{"video_id": vid, "hashes": pack_array(sigs, "<u8")}
+                                                       for vid, sigs in records]})
+
+    persist_segments = add_segments
+
+    def segment_query(self, signatures: np.ndarray, radius: int) -> list[SegmentHit]:
+        res = self._call("/shard/segments", {"hashes": pack_array(signatures, "<u8"), "radius": radius})
+        return [(q, vid, c) for q, vid, c in res["hits"]]
+
+class ShardedCorpus:
+    """
+    The corpus as seen by the pipeline: routes by owner, fans queries out to
+    every shard on a thread pool (numpy and sockets release the GIL) and merges.
+    """
+
+    def __init__(self, shards: list):
+        if not shards:
+            raise ValueError("At least one shard is required")
+        self.shards = shards
+        self._pool = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard") \
+            if len(shards) > 1 else None
+
+    def owner(self, video_id: str):
+        return self.shards[shard_of(video_id, len(self.shards))]
+
+    def _all(self, fn) -> list:
+        """fn(shard) on every shard in parallel, results in shard order."""
+        if self._pool is None:
+            return [fn(self.shards[0])]
+        return list(self._pool.map(carry(fn), self.shards))
+
+    def _routed(self, keys: list[str], fn) -> list:
+        """fn(shard, positions) for each shard owning some of `keys`, in parallel."""
+        parts: dict[int, list[int]] = {}
+        for pos, key in enumerate(keys):
+            parts.setdefault(shard_of(key, len(self.shards)), []).append(pos)
+        if self._pool is None or len(parts) == 1:
+            return [fn(self.shards[i], p) for i, p in parts.items()]
+        return list(self._pool.map(carry(lambda item: fn(self.shards[item[0]], item[1])), parts.items()))
+
+    def __len__(self) -> int:
+        return sum(self._all(lambda s: s.size()))
+
+    def warm(self) -> int:
+        """Load every shard's indexes (in parallel); returns the corpus size."""
+        return sum(self._all(lambda s: s.warm()))
+
+    def version(self) -> tuple[int, ...]:
+        """Per-shard store watermarks; changes whenever any shard's corpus does."""
+        return tuple(self._all(lambda s: s.version()))
+
+    def __contains__(self, video_id: str) -> bool:
+        return video_id in self.owner(video_id).contains([video_id])
+
+    def add_many(self, rows: list[Row]):
+        self._routed([r[0] for r in rows], lambda s, pos: s.add_many([rows[p] for p in pos]))
+
+    def persist_many(self, rows: list[Row]):
+        self._routed([r[0] for r in rows], lambda s, pos: s.persist_many([rows[p] for p in pos]))
+
+    def add_segments(self, records: list[Segments]):
+        self._routed([r[0] for r in records], lambda s, pos: s.add_segments([records[p] for p in pos]))
+
+    def persist_segments(self, records: list[Segments]):
+        self._routed([r[0] for r in records], lambda s, pos: s.persist_segments([records[p] for p in pos]))
+
+    @timed("segment_lookup")
+    def segment_query(self, signatures: np.ndarray, radius: int) -> list[SegmentHit]:
+        """(query window, video id, corpus window) hits within `radius` bits, from every shard."""
+        return [hit for part in self._all(lambda s: s.segment_query(signatures, radius)) for hit in part]
+
+    @timed("search")
+    def search_many(self, vecs: list[np.ndarray], top_k: int = 5) -> list[list[Match]]:
+        """Top-k per query over all shards: each shard returns its own top-k, merged by similarity."""
+        per_shard = self._all(lambda s: s.search_many(vecs, top_k))
+        return [
+            heapq.nlargest(top_k, (m for res in per_shard for m in res[q]), key=lambda m: m.similarity)
+            for q in range(len(vecs))
+        ]
+
+    def changes_since(self, version: tuple[int, ...], limit: int) -> tuple[tuple[int, ...], list[Change]] | None:
+        """
+        (new version, rows written after `version` on any shard), or None when that
+        can't be answered incrementally: more than `limit` rows per shard, or a
+        version from another shard layout / a store that went backwards.
+        """
+        if len(version) != len(self.shards):
+            return None
+        def one(i: int):
+            return self.shards[i].changes(version[i], limit)
+        parts = [one(0)] if self._pool is None else list(self._pool.map(carry(one), range(len(self.shards))))
+        if any(rows is None for _v, rows in parts):
+            return None
+        return tuple(v for v, _r in parts), [row for _v, rows in parts for row in rows]
+
+    def get_hashes(self, video_ids: list[str]) -> dict[str, np.ndarray]:
+        out: dict[str, np.ndarray] = {}
+        for part in self._routed(video_ids, lambda s, pos: s.get_hashes([video_ids[p] for p in pos])):
+            out.update(part)
+        return out
+
+    def add_hashes(self, video_id: str, hashes: np.ndarray):
+        self.owner(video_id).add_hashes(video_id, hashes)
+
+    @timed("frame_lookup")
+    def frame_query(self, hashes: np.ndarray, min_frames: int = 1) -> dict[str, int]:
+        out: dict[str, int] = {}
+        for part in self._all(lambda s: s.frame_query(hashes, min_frames)):
+            out.update(part)
+        return out
+
+def local_shards(n: int = SHARDS, data_dir: Path = DATA_DIR) -> list[LocalShard]:
+    return [LocalShard(*shard_paths(i, n, data_dir)) for i in range(n)]
+
+_CORPUS: ShardedCorpus | None = None
+_CORPUS_LOCK = threading.Lock()
+
+def get_corpus() -> ShardedCorpus:
+    """Process-wide corpus: SHARD_URLS servers if configured, else SHARDS local partitions."""
+    global _CORPUS
+    if _CORPUS is None:
+        with _CORPUS_LOCK:
+            if _CORPUS is None:
+                shards = [RemoteShard(u) for u in SHARD_URLS] if SHARD_URLS else local_shards()
+                _CORPUS = ShardedCorpus(shards)
+    return _CORPUS
@@ -0,0 +1,94 @@
+from __future__ import annotations
+import threading
+import time
+from typing import Callable
+
+from app.config import WARMUP_ON_STARTUP
+from app.lazyimport import load_all
+
+# ---------------- startup warmup / readiness ----------------
+#
+# Importing the API is kept cheap (heavy dependencies load lazily, see
+# app/lazyimport.py), so the process answers liveness checks right away. The
+# warmup then runs once on a background thread: load the corpus indexes,
+# import the decode / download stack, and start the fingerprinting workers
+# with their decoder warmed. Readiness is reported only after every step has
+# finished; a failed step leaves the service not ready, with the error.
+
+Step = tuple[str, Callable[[], object]]
+
+def _corpus():
+    from app.shards import get_corpus
+    return get_corpus().warm()
+
+def _imports():
+    from app import pipeline  # noqa: F401  (registers the lazy modules it uses)
+    return load_all()
+
+def _workers():
+    from app.jobs import get_job_manager
+    return get_job_manager().warm()
+
+STEPS: list[Step] = [("corpus", _corpus), ("imports", _imports), ("workers", _workers)]
+
+class Warmup:
+    def __init__(self, steps: list[Step] = STEPS):
+        self.steps = steps
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._done = threading.Event()
+        self.phase: str | None = None
+        self.error: str | None = None
+        self.seconds: dict[str, float] = {}
+        self.results: dict[str, object] = {}
+        self.started_at: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and self.error is None
+
+    def start(self, enabled: bool = WARMUP_ON_STARTUP) -> bool:
+        """Run the steps on a daemon thread (or mark ready at once when disabled); False if already started."""
+        with self._lock:
+            if self.started_at is not None:
+                return False
+            self.started_at = time.time()
+            if not enabled:
+                self._done.set()
+                return True
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+            return True
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until the warmup has finished (successfully or not); returns ready."""
+        self._done.wait(timeout)
+        return self.ready
+
+    def _run(self):
+        try:
+            for name, fn in self.steps:
+                self.phase = name
+                t0 = time.perf_counter()
+                self.results[name] = fn()
+                self.seconds[name] = round(time.perf_counter() - t0, 4)
+            self.phase = None
+        except Exception as e:
+            self.error = f"{self.phase}: {e}"
+        finally:
+            self._done.set()
+
+    def status(self) -> dict:
+        return {"ready": self.ready, "phase": self.phase, "error": self.error,
+                "seconds": dict(self.seconds), "results": dict(self.results), "started_at": self.started_at}
+
+_WARMUP: Warmup | None = None
+_WARMUP_LOCK = threading.Lock()
+
+def get_warmup() -> Warmup:
+    global _WARMUP
+    if _WARMUP is None:
+        with _WARMUP_LOCK:
+            if _WARMUP is None:
+                _WARMUP = Warmup()
+    return _WARMUP
@@ -1,9 +1,19 @@
 from __future__ import annotations
+import os
 import sqlite3
+import threading
 from pathlib import Path
 import numpy as np
-from typing import Iterable
-from app.config import DB_PATH
+from typing import Iterable, Iterator
+from app import quantize
+from app.metrics import timed
+from app.vecfile import VectorFile
+from app.config import (
+    DB_PATH, SQLITE_CACHE_KIB, SQLITE_MMAP_BYTES, SQLITE_BUSY_TIMEOUT_MS, FINGERPRINT_ENCODING,
+    SHARED_VECTORS,
+)
+
+SCHEMA_VERSION = 6
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS fingerprints (
@@ -15,51 +25,352 @@ CREATE TABLE IF NOT EXISTS fingerprints (
 );
 """
 
+# v2: packed uint64 frame pHashes, so the second pass never re-downloads a candidate
+FRAME_HASHES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS frame_hashes (
+    video_id    TEXT PRIMARY KEY,
+    n_hashes    INTEGER NOT NULL,
+    hash_blob   BLOB NOT NULL
+);
+"""
+
+# v3: per-row change sequence (corpus watermark) + vec_len filter index
+SEQ_SCHEMA = """
+ALTER TABLE fingerprints ADD COLUMN seq INTEGER;
+UPDATE fingerprints SET seq = rowid;
+CREATE INDEX IF NOT EXISTS idx_fingerprints_seq ON fingerprints(seq);
+CREATE INDEX IF NOT EXISTS idx_fingerprints_vec_len ON fingerprints(vec_len);
+"""
+
+# v4: vec_blob encoding per row (quantize.FORMAT_*); old rows stay float32 until rewritten
+FORMAT_SCHEMA = """
+ALTER TABLE fingerprints ADD COLUMN vec_format INTEGER NOT NULL DEFAULT 0;
+"""
+
+# v5: segment window signatures (app/segments.py), same layout as frame_hashes
+SEGMENT_HASHES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segment_hashes (
+    video_id    TEXT PRIMARY KEY,
+    n_hashes    INTEGER NOT NULL,
+    hash_blob   BLOB NOT NULL
+);
+"""
+
+# v6: random per-database id, so files derived from a store (the shared vector
+# file) can tell a database recreated at the same path from the one they were built from
+META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key         TEXT PRIMARY KEY,
+    value       TEXT NOT NULL
+);
+"""
+
+HASH_TABLES = ("frame_hashes", "segment_hashes")
+
+# every insert or update takes the next seq, so "seq > watermark" = changed since
+_UPSERT_FINGERPRINT = """
+INSERT INTO fingerprints (video_id, url, title, vec_len, vec_format, vec_blob, seq)
+VALUES (?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM fingerprints))
+ON CONFLICT(video_id) DO UPDATE SET
+    url=excluded.url,
+    title=excluded.title,
+    vec_len=excluded.vec_len,
+    vec_format=excluded.vec_format,
+    vec_blob=excluded.vec_blob,
+    seq=excluded.seq
+"""
+
+_UPSERT_HASHES = """
+INSERT INTO {table} (video_id, n_hashes, hash_blob)
+VALUES (?, ?, ?)
+ON CONFLICT(video_id) DO UPDATE SET
+    n_hashes=excluded.n_hashes,
+    hash_blob=excluded.hash_blob
+"""
+
+# projected column name -> SQL expression; "vec" is decoded (float32) from vec_format + vec_blob
+_COLUMNS = {
+    "video_id": "video_id", "url": "url", "title": "title", "vec_len": "vec_len",
+    "vec": "vec_format, vec_blob", "vec_format": "vec_format", "vec_blob": "vec_blob", "seq": "seq",
+}
+
+def _encode_vec(vec: np.ndarray, encoding: str = FINGERPRINT_ENCODING) -> tuple[int, bytes]:
+    vec = np.asarray(vec, dtype=np.float32).reshape(-1)
+    if encoding == "compact" and quantize.compactable(vec.size):
+        return quantize.FORMAT_COMPACT, quantize.to_blob(*quantize.encode(vec))
+    return quantize.FORMAT_FLOAT32, vec.tobytes()
+
+def _hash_table(table: str) -> str:
+    if table not in HASH_TABLES:
+        raise ValueError(f"Unknown hash table: {table}")
+    return table
+
+_SQL_VARS = 500  # ids per IN (...) query, below SQLite's host parameter limit
+
+# ---------------- connections ----------------
+#
+# One connection per (thread, database), reused by every FingerprintStore on
+# that thread; the schema check runs once per database per process.
+
+_local = threading.local()
+_ready: set[str] = set()
+_ready_lock = threading.Lock()
+_vector_files: dict[str, VectorFile] = {}  # db path -> shared vector file (one per process)
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    con = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+    con.execute("PRAGMA journal_mode=WAL")       # readers don't block the writer
+    con.execute("PRAGMA synchronous=NORMAL")     # durable at checkpoints; safe with WAL
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute(f"PRAGMA cache_size=-{int(SQLITE_CACHE_KIB)}")
+    con.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_BYTES)}")
+    con.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+    return con
+
+def _connection(db_path: Path) -> sqlite3.Connection:
+    cons = getattr(_local, "cons", None)
+    if cons is None:
+        cons = _local.cons = {}
+    key = str(db_path)
+    con = cons.get(key)
+    if con is None:
+        con = cons[key] = _connect(db_path)
+    return con
+
 class FingerprintStore:
     def __init__(self, db_path: Path = DB_PATH):
         self.db_path = db_path
-        self._ensure_schema()
+        key = str(db_path)
+        if key not in _ready:
+            with _ready_lock:
+                if key not in _ready:
+                    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+                    self._ensure_schema()
+                    _ready.add(key)
+
+    @property
+    def _con(self) -> sqlite3.Connection:
+        return _connection(self.db_path)
 
     def _ensure_schema(self):
-        with sqlite3.connect(self.db_path) as con:
+        con = self._con
+        with con:
             con.execute(SCHEMA)
-            con.commit()
-
-    def upsert(self, video_id: str, url: str, title: str | None, vec: np.ndarray):
-        blob = vec.tobytes()
-        with sqlite3.connect(self.db_path) as con:
-            con.execute(
-                """
-                INSERT INTO fingerprints (video_id, url, title, vec_len, vec_blob)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(video_id) DO UPDATE SET
-                    url=excluded.url,
-                    title=excluded.title,
-                    vec_len=excluded.vec_len,
-                    vec_blob=excluded.vec_blob
-                """,
-                (video_id, url, title, int(vec.size), blob),
-            )
-            con.commit()
+            version = con.execute("PRAGMA user_version").fetchone()[0]
+            if version < 2:
+                con.execute(FRAME_HASHES_SCHEMA)
+            if version < 3:
+                for stmt in SEQ_SCHEMA.strip().split(";"):
+                    if stmt.strip():
+                        con.execute(stmt)
+            if version < 4:
+                con.execute(FORMAT_SCHEMA)
+            if version < 5:
+                con.execute(SEGMENT_HASHES_SCHEMA)
+            if version < 6:
+                con.execute(META_SCHEMA)
+                con.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('store_id', ?)", (os.urandom(8).hex(),))
+            if version < SCHEMA_VERSION:
+                con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        """Close this thread's connection to the database (reopened on next use)."""
+        con = getattr(_local, "cons", {}).pop(str(self.db_path), None)
+        if con is not None:
+            con.close()
+
+    # ----- writes -----
+
+    def upsert(self, video_id: str, url: str, title: str | None, vec: np.ndarray,
+               hashes: np.ndarray | None = None):
+        self.upsert_many([(video_id, url, title, vec, hashes)])
+
+    @timed("store_write")
+    def upsert_many(self, rows: Iterable[tuple[str, str, str | None, np.ndarray, np.ndarray | None]]) -> int:
+        """
+        Upsert (video_id, url, title, vec, hashes-or-None) rows in one transaction
+        with executemany; returns the number of rows written.
+        """
+        fps, hs = [], []
+        for video_id, url, title, vec, hashes in rows:
+            fmt, blob = _encode_vec(vec)
+            fps.append((video_id, url, title, int(np.asarray(vec).size), fmt, blob))
+            if hashes is not None:
+                h = np.ascontiguousarray(hashes, dtype=np.uint64)
+                hs.append((video_id, int(h.size), h.tobytes()))
+        if not fps:
+            return 0
+        con = self._con
+        with con:
+            con.executemany(_UPSERT_FINGERPRINT, fps)
+            con.executemany(_UPSERT_HASHES.format(table="frame_hashes"), hs)
+        if SHARED_VECTORS:
+            self.sync_vectors()
+        return len(fps)
+
+    def upsert_hashes(self, video_id: str, hashes: np.ndarray, table: str = "frame_hashes"):
+        self.upsert_hashes_many([(video_id, hashes)], table)
+
+    @timed("store_write")
+    def upsert_hashes_many(self, records: Iterable[tuple[str, np.ndarray]], table: str = "frame_hashes") -> int:
+        """Upsert (video_id, uint64 hashes) records into one of HASH_TABLES in one transaction."""
+        rows = []
+        for video_id, hashes in records:
+            h = np.ascontiguousarray(hashes, dtype=np.uint64)
+            rows.append((video_id, int(h.size), h.tobytes()))
+        con = self._con
+        with con:
+            con.executemany(_UPSERT_HASHES.format(table=_hash_table(table)), rows)
+        return len(rows)
 
-    def all(self) -> Iterable[tuple[str, str, str | None, np.ndarray]]:
-        with sqlite3.connect(self.db_path) as con:
-            cur = con.execute("SELECT video_id, url, title, vec_len, vec_blob FROM fingerprints")
-            for video_id, url, title, veclen, blob in cur.fetchall():
-                vec = np.frombuffer(blob, dtype=np.float32)
-                assert vec.size == veclen
-                yield video_id, url, title, vec
+    def migrate_encoding(self, encoding: str = FINGERPRINT_ENCODING, limit: int = 10_000) -> int:
+        """
+        Rewrite up to `limit` rows not yet in `encoding` (lazy migration: reads
+        accept every format, so this can run in small steps whenever convenient).
+        seq is left alone, the fingerprints themselves don't change. Returns rows rewritten.
+        """
+        if encoding == "compact":
+            where, params = "vec_format != ? AND vec_len = ?", [quantize.FORMAT_COMPACT, quantize.COMPACT_DIM]
+        else:
+            where, params = "vec_format != ?", [quantize.FORMAT_FLOAT32]
+        rows = self._con.execute(
+            f"SELECT video_id, vec_format, vec_blob FROM fingerprints WHERE {where} LIMIT ?",
+            params + [int(limit)],
+        ).fetchall()
+        updates = []
+        for video_id, fmt, blob in rows:
+            new_fmt, new_blob = _encode_vec(quantize.vec_from_blob(fmt, blob), encoding)
+            updates.append((new_fmt, new_blob, video_id))
+        con = self._con
+        with con:
+            con.executemany("UPDATE fingerprints SET vec_format = ?, vec_blob = ? WHERE video_id = ?", updates)
+        return len(updates)
+
+    # ----- shared vector file -----
+
+    def vectors(self) -> VectorFile:
+        """This database's shared vector file for the configured encoding (opened once per process)."""
+        key = str(self.db_path)
+        vf = _vector_files.get(key)
+        if vf is None:
+            with _ready_lock:
+                vf = _vector_files.get(key)
+                if vf is None:
+                    fmt = quantize.FORMAT_COMPACT if FINGERPRINT_ENCODING == "compact" else quantize.FORMAT_FLOAT32
+                    vf = _vector_files[key] = VectorFile.for_store(self.db_path, fmt)
+        return vf
+
+    def sync_vectors(self) -> int:
+        """Copy rows committed since the vector file's watermark into it; returns rows added."""
+        return self.vectors().sync(self)
+
+    # ----- reads -----
+
+    def store_id(self) -> bytes:
+        """Random 8-byte id given to this database when it was created."""
+        return bytes.fromhex(self._con.execute("SELECT value FROM meta WHERE key = 'store_id'").fetchone()[0])
+
+    def version(self) -> int:
+        """Corpus watermark: grows with every fingerprint insert/update (0 = empty)."""
+        return self._con.execute("SELECT COALESCE(MAX(seq), 0) FROM fingerprints").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._con.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+
+    def iter_rows(self, columns: Iterable[str] = ("video_id", "url", "title", "vec"),
+                  vec_len: int | None = None, since: int = 0,
+                  chunk_size: int = 1000, skip_vec_len: int | None = None) -> Iterator[tuple]:
+        """
+        Stream fingerprint rows in seq order, `chunk_size` at a time, with only the
+        requested columns (see _COLUMNS). `vec_len` keeps only that vector length,
+        `skip_vec_len` drops it, and `since` returns only rows written after that
+        watermark (see version()).
+        """
+        columns = list(columns)
+        unknown = [c for c in columns if c not in _COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown columns: {unknown}")
+        where, params = ["seq > ?"], [since]
+        if vec_len is not None:
+            where.append("vec_len = ?")
+            params.append(int(vec_len))
+        if skip_vec_len is not None:  # two ranges, so the vec_len index still applies
+            where.append("(vec_len < ? OR vec_len > ?)")
+            params += [int(skip_vec_len), int(skip_vec_len)]
+        sql = (f"SELECT {', '.join(_COLUMNS[c] for c in columns)} FROM fingerprints "
+               f"WHERE {' AND '.join(where)} ORDER BY seq")
+        vec_at = columns.index("vec") if "vec" in columns else -1
+        cur = self._con.execute(sql, params)
+        try:
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    return
+                for row in rows:
+                    if vec_at >= 0:  # "vec" occupies two SQL columns: format, blob
+                        vec = quantize.vec_from_blob(row[vec_at], row[vec_at + 1])
+                        row = row[:vec_at] + (vec,) + row[vec_at + 2:]
+                    yield row
+        finally:
+            cur.close()
+
+    def all(self, vec_len: int | None = None) -> Iterable[tuple[str, str, str | None, np.ndarray]]:
+        yield from self.iter_rows(vec_len=vec_len)
 
     def get(self, video_id: str) -> np.ndarray | None:
-        with sqlite3.connect(self.db_path) as con:
-            cur = con.execute(
-                "SELECT vec_len, vec_blob FROM fingerprints WHERE video_id = ?",
-                (video_id,),
+        row = self._con.execute(
+            "SELECT vec_len, vec_format, vec_blob FROM fingerprints WHERE video_id = ?",
+            (video_id,),
+        ).fetchone()
+        if not row:
+            return None
+        veclen, fmt, blob = row
+        vec = quantize.vec_from_blob(fmt, blob)
+        assert vec.size == veclen
+        return vec
+
+    def get_meta(self, video_ids: list[str]) -> dict[str, tuple[str, str | None]]:
+        """(url, title) for the given ids (unknown ids are omitted)."""
+        ids = list(video_ids)
+        out: dict[str, tuple[str, str | None]] = {}
+        for s in range(0, len(ids), _SQL_VARS):
+            part = ids[s:s + _SQL_VARS]
+            marks = ",".join("?" * len(part))
+            for video_id, url, title in self._con.execute(
+                f"SELECT video_id, url, title FROM fingerprints WHERE video_id IN ({marks})", part,
+            ):
+                out[video_id] = (url, title)
+        return out
+
+    def all_hashes(self, chunk_size: int = 1000, table: str = "frame_hashes") -> Iterable[tuple[str, np.ndarray]]:
+        cur = self._con.execute(f"SELECT video_id, n_hashes, hash_blob FROM {_hash_table(table)}")
+        try:
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    return
+                for video_id, n, blob in rows:
+                    h = np.frombuffer(blob, dtype=np.uint64)
+                    assert h.size == n
+                    yield video_id, h
+        finally:
+            cur.close()
+
+    @timed("store_hashes")
+    def get_hashes(self, video_ids: list[str], table: str = "frame_hashes") -> dict[str, np.ndarray]:
+        """Stored frame pHashes (or other HASH_TABLES rows) for the given ids (ids without are omitted)."""
+        table = _hash_table(table)
+        ids = list(video_ids)
+        out: dict[str, np.ndarray] = {}
+        for s in range(0, len(ids), _SQL_VARS):
+            part = ids[s:s + _SQL_VARS]
+            marks = ",".join("?" * len(part))
+            cur = self._con.execute(
+                f"SELECT video_id, n_hashes, hash_blob FROM {table} WHERE video_id IN ({marks})",
+                part,
             )
-            row = cur.fetchone()
-            if not row:
-                return None
-            veclen, blob = row
-            vec = np.frombuffer(blob, dtype=np.float32)
-            assert vec.size == veclen
-            return vec
+            for video_id, n, blob in cur.fetchall():
+                h = np.frombuffer(blob, dtype=np.uint64)
+                assert h.size == n
+                out[video_id] = h
+        return out
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import shutil
+import subprocess
+from typing import Iterator
+import numpy as np
+
+from app.config import FRAME_SAMPLES, STREAM_MIN_SIDE, STREAM_DECODE_SIZE
+from app.fingerprint import Fingerprint, fingerprint_frames
+from app.frames import frame_indices
+from app.lazyimport import lazy_module
+from app.metrics import span
+
+yt_dlp = lazy_module("yt_dlp")
+
+# ---------------- streaming ingest ----------------
+#
+# Instead of downloading the full-resolution file and then decoding it, pick
+# the smallest video format that still covers the fingerprint resolution and
+# let ffmpeg read it straight from the media URL: it selects only the sampled
+# frame numbers, scales them at decode time and writes raw BGR to a pipe, so
+# fingerprinting starts while bytes are still arriving and nothing touches disk.
+
+class StreamUnavailable(RuntimeError):
+    """Streaming can't be used for this URL (no ffmpeg, no direct format, unknown length)."""
+
+def streaming_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+def _short_side(fmt: dict) -> int | None:
+    w, h = fmt.get("width"), fmt.get("height")
+    if w and h:
+        return min(int(w), int(h))
+    return int(h) if h else None
+
+def select_format(info: dict, min_side: int = STREAM_MIN_SIDE) -> dict:
+    """Smallest format with video whose short side covers `min_side` (else the largest one)."""
+    formats = [
+        f for f in info.get("formats") or [info]
+        if f.get("url") and f.get("vcodec") != "none"
+        and (f.get("protocol") or "https").split("+")[0] in ("http", "https", "m3u8", "m3u8_native")
+    ]
+    sized = [f for f in formats if _short_side(f)]
+    if not sized:
+        if not formats:
+            raise StreamUnavailable("No directly streamable video format.")
+        return formats[-1]  # yt-dlp sorts worst -> best
+    def cost(f: dict):
+        return (_short_side(f), f.get("tbr") or f.get("filesize") or 0)
+    covering = [f for f in sized if _short_side(f) >= min_side]
+    return min(covering, key=cost) if covering else max(sized, key=cost)
+
+def _total_frames(info: dict, fmt: dict) -> int:
+    duration = fmt.get("duration") or info.get("duration")
+    fps = fmt.get("fps") or info.get("fps")
+    if not duration or not fps:
+        raise StreamUnavailable("Unknown duration/fps; can't place samples before decoding.")
+    return max(1, int(float(duration) * float(fps)))
+
+def stream_frames(fmt: dict, indices: list[int], size: int = STREAM_DECODE_SIZE) -> Iterator[np.ndarray]:
+    """Yield the frames at `indices` (decode order) from a remote format, scaled to size x size."""
+    if not indices:
+        return
+    select = "+".join(f"eq(n\\,{i})" for i in sorted(set(indices)))
+    headers = "".join(f"{k}: {v}\r\n" for k, v in (fmt.get("http_headers") or {}).items())
+    cmd = ["ffmpeg", "-v", "error", "-nostdin"]
+    if headers and fmt["url"].startswith(("http://", "https://")):
+        cmd += ["-headers", headers]  # http-only input option
+    cmd += [
+        "-i", fmt["url"], "-an", "-sn",
+        "-vf", f"select='{select}',scale={size}:{size}:flags=area",
+        "-vsync", "passthrough", "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1",
+    ]
+    frame_bytes = size * size * 3
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(len(set(indices))):
+            buf = proc.stdout.read(frame_bytes)
+            if len(buf) < frame_bytes:
+                break
+            yield np.frombuffer(buf, dtype=np.uint8).reshape(size, size, 3)
+    finally:
+        # all samples read (or consumer stopped): stop the transfer right away
+        proc.kill()
+        proc.wait()
+
+def stream_fingerprint(url: str, samples: int = FRAME_SAMPLES) -> tuple[Fingerprint, dict]:
+    """
+    Fingerprint a URL without downloading it: one metadata round trip to list
+    formats, then ffmpeg streams the lowest usable resolution. Returns (fingerprint, info).
+    """
+    if not streaming_available():
+        raise StreamUnavailable("ffmpeg not found on PATH.")
+    with span("metadata"), yt_dlp.YoutubeDL({"quiet": True, "noprogress": True, "skip_download": True}) as ydl:
+        info = ydl.extract_info(url, download=False)
+    fmt = select_format(info)
+    idxs = frame_indices(_total_frames(info, fmt), samples)
+    return fingerprint_frames(stream_frames(fmt, idxs)), info
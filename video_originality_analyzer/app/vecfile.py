@@ -0,0 +1,203 @@
+from __future__ import annotations
+import fcntl
+import os
+import struct
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+
+from app import quantize
+
+# ---------------- shared memory-mapped vector file ----------------
+#
+# An append-only, fixed-stride copy of the store's standard-length vectors that
+# every worker process maps read-only, so the page cache holds one copy no
+# matter how many uvicorn workers run. SQLite stays the source of truth: the
+# file is filled by pulling rows from the store in seq order (sync), so with
+# the workers stopped it can be deleted and is rebuilt on next use.
+#
+#   <db>.<fmt>.vec   64-byte header, then one row per entry at HEADER_SIZE + i * row_bytes
+#   <db>.<fmt>.ids   row i's video id, length-prefixed, in the same order
+#
+# Writers serialize on an exclusive flock, write rows and ids past the published
+# end, then publish them by rewriting the header. The header carries a
+# generation counter used as a seqlock: odd while a header write is in
+# progress, so readers retry instead of seeing a torn (count, ids_bytes) pair.
+# A video indexed twice gets a second row; readers keep the newest one.
+#
+# The header also names the store the rows came from (FingerprintStore.store_id).
+# When a sync finds another id, or a watermark past the store's newest seq, the
+# database was replaced under the file: it is emptied and refilled, and the
+# header's epoch goes up so readers drop every row they had pulled. The data
+# file is never shrunk, so pages readers have mapped stay valid.
+
+_MAGIC = b"MMV1"
+_HEADER = struct.Struct("<4sIIIQQQQ8sQ")  # magic, format, dim, row_bytes, generation, count, ids_bytes,
+                                          # watermark, store_id, epoch
+HEADER_SIZE = 64
+_GEN_OFFSET = 16                       # byte offset of the generation field
+_GEN = struct.Struct("<Q")
+_ID_LEN = struct.Struct("<H")
+_GROW_ROWS = 16384                     # data file grows by at least this many rows at a time
+_SYNC_CHUNK = 4096                     # rows published per header update during a sync
+
+@dataclass(frozen=True)
+class Header:
+    fmt: int
+    dim: int
+    row_bytes: int
+    generation: int
+    count: int
+    ids_bytes: int
+    watermark: int  # store seq of the newest row copied into the file
+    store_id: bytes = bytes(8)  # store the rows were copied from (zeros: none yet)
+    epoch: int = 0              # times the file was emptied for another store
+
+def _row_bytes(fmt: int, dim: int) -> int:
+    # compact rows are quantize.to_blob(): float32 block scales, then uint8 codes
+    return 4 * quantize.N_BLOCKS + dim if fmt == quantize.FORMAT_COMPACT else 4 * dim
+
+class VectorFile:
+    """Shared vectors of one length and format; see the module comment for the layout."""
+
+    def __init__(self, path: Path, fmt: int = quantize.FORMAT_FLOAT32, dim: int = quantize.COMPACT_DIM):
+        if fmt == quantize.FORMAT_COMPACT and not quantize.compactable(dim):
+            raise ValueError(f"Compact rows need length {quantize.COMPACT_DIM}, not {dim}")
+        self.path = Path(path)
+        self.ids_path = self.path.with_suffix(".ids")
+        self.fmt, self.dim = fmt, dim
+        self.row_bytes = _row_bytes(fmt, dim)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._ids_fd = os.open(self.ids_path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked():
+            if os.fstat(self._fd).st_size < HEADER_SIZE:
+                self._write_header(Header(fmt, dim, self.row_bytes, 0, 0, 0, 0))
+        h = self.header()
+        if (h.fmt, h.dim, h.row_bytes) != (fmt, dim, self.row_bytes):
+            raise RuntimeError(f"{self.path} holds format {h.fmt} x {h.dim}, expected {fmt} x {dim}")
+
+    @classmethod
+    def for_store(cls, db_path: Path, fmt: int) -> "VectorFile":
+        suffix = "u8" if fmt == quantize.FORMAT_COMPACT else "f32"
+        return cls(Path(db_path).with_suffix(f".{suffix}.vec"), fmt)
+
+    def close(self):
+        os.close(self._fd)
+        os.close(self._ids_fd)
+
+    # ----- header -----
+
+    def header(self) -> Header:
+        """Latest published header (seqlock read: retried while a writer is mid-update)."""
+        while True:
+            raw = os.pread(self._fd, _HEADER.size, 0)
+            magic, *fields = _HEADER.unpack(raw)
+            if magic != _MAGIC:
+                raise RuntimeError(f"Not a vector file: {self.path}")
+            h = Header(*fields)
+            if h.generation % 2 == 0 and _GEN.unpack(os.pread(self._fd, _GEN.size, _GEN_OFFSET))[0] == h.generation:
+                return h
+
+    def _write_header(self, h: Header):
+        os.pwrite(self._fd, _HEADER.pack(_MAGIC, h.fmt, h.dim, h.row_bytes, h.generation, h.count,
+                                         h.ids_bytes, h.watermark, h.store_id, h.epoch).ljust(HEADER_SIZE, b"\0"), 0)
+
+    def _publish(self, h: Header, count: int, ids_bytes: int, watermark: int,
+                 store_id: bytes | None = None, epoch: int | None = None) -> Header:
+        gen = h.generation
+        store_id = h.store_id if store_id is None else store_id
+        epoch = h.epoch if epoch is None else epoch
+        os.pwrite(self._fd, _GEN.pack(gen + 1), _GEN_OFFSET)  # odd: readers retry
+        self._write_header(Header(h.fmt, h.dim, h.row_bytes, gen + 1, count, ids_bytes, watermark, store_id, epoch))
+        os.pwrite(self._fd, _GEN.pack(gen + 2), _GEN_OFFSET)
+        return Header(h.fmt, h.dim, h.row_bytes, gen + 2, count, ids_bytes, watermark, store_id, epoch)
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # ----- writes -----
+
+    def _row(self, fmt: int, blob: bytes) -> bytes:
+        """A stored vec_blob in this file's row format (copied as is when it already matches)."""
+        if fmt == self.fmt:
+            return bytes(blob)
+        vec = quantize.vec_from_blob(fmt, blob)
+        if self.fmt == quantize.FORMAT_COMPACT:
+            return quantize.to_blob(*quantize.encode(vec))
+        return np.asarray(vec, dtype=np.float32).tobytes()
+
+    def sync(self, store) -> int:
+        """
+        Append every store row of this length written after the file's watermark;
+        returns rows added. A file built from another store (or from rows the store
+        no longer has) is emptied and refilled first.
+        """
+        added = 0
+        with self._locked():
+            h = self.header()
+            store_id = store.store_id()
+            if h.store_id != store_id or h.watermark > store.version():
+                os.ftruncate(self._ids_fd, 0)
+                h = self._publish(h, 0, 0, 0, store_id, h.epoch + 1)
+            rows = store.iter_rows(("video_id", "vec_format", "vec_blob", "seq"),
+                                   vec_len=self.dim, since=h.watermark)
+            batch: list[tuple[str, int, bytes, int]] = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= _SYNC_CHUNK:
+                    h = self._append(h, batch)
+                    added += len(batch)
+                    batch = []
+            if batch:
+                h = self._append(h, batch)
+                added += len(batch)
+        return added
+
+    def _append(self, h: Header, batch: list[tuple[str, int, bytes, int]]) -> Header:
+        data = b"".join(self._row(fmt, blob) for _vid, fmt, blob, _seq in batch)
+        ids = b"".join(_ID_LEN.pack(len(v)) + v for v in (vid.encode("utf-8") for vid, *_ in batch))
+        count = h.count + len(batch)
+        need = HEADER_SIZE + count * self.row_bytes
+        if os.fstat(self._fd).st_size < need:  # grow ahead so readers remap rarely
+            os.ftruncate(self._fd, HEADER_SIZE + max(count, 2 * h.count, _GROW_ROWS) * self.row_bytes)
+        os.pwrite(self._fd, data, HEADER_SIZE + h.count * self.row_bytes)
+        os.pwrite(self._ids_fd, ids, h.ids_bytes)
+        return self._publish(h, count, h.ids_bytes + len(ids), max(seq for *_, seq in batch))
+
+    # ----- reads -----
+
+    def capacity(self) -> int:
+        """Rows the data file currently has room for (what map() covers)."""
+        return (os.fstat(self._fd).st_size - HEADER_SIZE) // self.row_bytes
+
+    def map(self) -> tuple[np.ndarray, np.ndarray | None]:
+        """
+        Read-only views over every row slot: (float32 rows, None), or for compact
+        files (uint8 codes, float32 scales). Only rows below header().count are valid.
+        """
+        cap = self.capacity()
+        if cap == 0:  # nothing synced yet (an empty file can't be mapped)
+            if self.fmt != quantize.FORMAT_COMPACT:
+                return np.empty((0, self.dim), dtype=np.float32), None
+            return np.empty((0, self.dim), dtype=np.uint8), np.empty((0, quantize.N_BLOCKS), dtype=np.float32)
+        if self.fmt != quantize.FORMAT_COMPACT:
+            return np.memmap(self.path, dtype=np.float32, mode="r", offset=HEADER_SIZE, shape=(cap, self.dim)), None
+        raw = np.memmap(self.path, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(cap, self.row_bytes))
+        head = self.row_bytes - self.dim  # to_blob layout: scales, then codes
+        return raw[:, head:], raw[:, :head].view(np.float32)
+
+    def read_ids(self, start: int, stop: int) -> list[str]:
+        """Ids stored in bytes [start, stop) of the id table (published offsets only)."""
+        data = os.pread(self._ids_fd, stop - start, start)
+        out, pos = [], 0
+        while pos < len(data):
+            (n,) = _ID_LEN.unpack_from(data, pos)
+            out.append(data[pos + _ID_LEN.size:pos + _ID_LEN.size + n].decode("utf-8"))
+            pos += _ID_LEN.size + n
+        return out
@@ -0,0 +1,96 @@
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+import numpy as np
+
+from app.config import VERDICT_CACHE_SIZE, VERDICT_CACHE_TTL_SECONDS
+
+# ---------------- analyze verdict cache ----------------
+#
+# Remembers the verdict of each analyzed video id together with the query's
+# fingerprint, the corpus version it was decided against, and the decision
+# settings in force. A later analyze of the same id reuses it without a
+# download: "not original" stands while the corpus only grows, and "original"
+# is re-checked against just the rows written since its version (see
+# pipeline._cached_verdict). Entries decided under other settings, or older
+# than the TTL, are dropped. In-memory, per process, bounded LRU.
+
+@dataclass
+class CachedVerdict:
+    original: bool
+    vec: np.ndarray            # query coarse vector
+    hashes: np.ndarray         # query frame pHashes
+    timeline: np.ndarray | None  # query timeline pHashes for segment re-checks (None: no segments)
+    partial: bool              # fingerprint from a progressive partial sample
+    version: tuple[int, ...]   # corpus version (per-shard watermarks) the verdict holds for
+    settings: tuple            # decision settings it was computed under
+    created: float
+    segments: list[dict] | None = None  # segment runs reported with a "not original" verdict
+
+class VerdictCache:
+    def __init__(self, max_entries: int = VERDICT_CACHE_SIZE, ttl: float = VERDICT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, CachedVerdict] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.rechecks = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, video_id: str | None, settings: tuple) -> CachedVerdict | None:
+        """Live entry for the id decided under `settings`, else None (stale ones are dropped)."""
+        with self._lock:
+            entry = self._entries.get(video_id) if video_id else None
+            if entry is not None and (entry.settings != settings or time.time() - entry.created > self.ttl):
+                del self._entries[video_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            return entry
+
+    def put(self, video_id: str, entry: CachedVerdict):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[video_id] = entry
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def advance(self, video_id: str, entry: CachedVerdict, original: bool, version: tuple[int, ...],
+                segments: list[dict] | None = None):
+        """Record a re-check: the entry now holds `original` (and its segment runs) as of `version` (keeps its TTL)."""
+        with self._lock:
+            self.rechecks += 1
+            if self._entries.get(video_id) is entry:
+                entry.original, entry.version, entry.segments = original, version, segments
+
+    def discard(self, video_id: str):
+        with self._lock:
+            self._entries.pop(video_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "rechecks": self.rechecks}
+
+_CACHE: VerdictCache | None = None
+_CACHE_LOCK = threading.Lock()
+
+def get_verdict_cache() -> VerdictCache:
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = VerdictCache()
+    return _CACHE
@@ -0,0 +1,84 @@
+"""
+Recall@k and QPS of the IVF(-PQ) first pass against the exact scan.
+
+Usage:
+  python scripts/bench_ann.py [--synthetic 200000] [--queries 500] [--top-k 10]
+                              [--nlist 0] [--pq-m 0] [--nprobe 1,4,16,64] [--compact]
+
+Uses the stored fingerprints, or --synthetic N clustered vectors with the
+fingerprint layout. Queries are perturbed corpus rows. Prints one JSON line
+per configuration (exact scan first).
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+
+import numpy as np
+
+from app import quantize
+from app.config import ANN_NLIST, ANN_PQ_M
+from app.corpus import CorpusIndex
+from app.store import FingerprintStore
+
+def synthetic(n: int, rng: np.random.Generator, clusters: int = 2000) -> np.ndarray:
+    """Clustered non-negative unit vectors shaped like fingerprints (near-duplicate families)."""
+    d = quantize.COMPACT_DIM
+    centers = np.abs(rng.normal(size=(clusters, d))).astype(np.float32)
+    centers[:, quantize.BLOCKS[1]] **= 4  # peaky colour histograms
+    X = centers[rng.integers(0, clusters, n)] + np.abs(rng.normal(0, 0.3, (n, d))).astype(np.float32)
+    return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+def timed_search(index: CorpusIndex, Q: np.ndarray, k: int, batch: int = 64):
+    out, t0 = [], time.perf_counter()
+    for s in range(0, len(Q), batch):
+        out += index.search_many(list(Q[s:s + batch]), top_k=k)
+    return out, len(Q) / (time.perf_counter() - t0)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--synthetic", type=int, default=0)
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--top-k", type=int, default=10)
+    ap.add_argument("--nlist", type=int, default=ANN_NLIST)
+    ap.add_argument("--pq-m", type=int, default=ANN_PQ_M)
+    ap.add_argument("--nprobe", default="1,4,16,64")
+    ap.add_argument("--compact", action="store_true", help="score on the compact encoding")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.synthetic:
+        X = synthetic(args.synthetic, rng)
+    else:
+        X = np.stack([v for (v,) in FingerprintStore().iter_rows(("vec",), vec_len=quantize.COMPACT_DIM)])
+    index = CorpusIndex(compact=args.compact)
+    for i, v in enumerate(X):
+        index.add(str(i), "", None, v)
+
+    Q = X[rng.integers(0, len(X), args.queries)] + rng.normal(0, 0.01, (args.queries, X.shape[1]))
+    Q = (np.clip(Q, 0, None) / np.linalg.norm(np.clip(Q, 0, None), axis=1, keepdims=True)).astype(np.float32)
+    k = args.top_k
+
+    exact, qps = timed_search(index, Q, k)
+    truth = [{m.video_id for m in r} for r in exact]
+    base = {"rows": len(X), "top_k": k, "compact": args.compact}
+    print(json.dumps({**base, "mode": "exact", "recall": 1.0, "qps": round(qps, 1)}), flush=True)
+
+    t0 = time.perf_counter()
+    ann = index.build_ann(nlist=args.nlist, pq_m=args.pq_m, seed=args.seed)
+    train_s = time.perf_counter() - t0
+    import app.corpus as corpus
+    corpus.ANN_MIN_ROWS = 0  # benchmark the ANN path at any size
+    for nprobe in [int(p) for p in args.nprobe.split(",")]:
+        index.nprobe = nprobe
+        approx, qps_ann = timed_search(index, Q, k)
+        recall = np.mean([len(t & {m.video_id for m in r}) / max(len(t), 1) for t, r in zip(truth, approx)])
+        print(json.dumps({**base, "mode": "ivf", "nlist": ann.nlist, "pq_m": ann.pq_m, "nprobe": nprobe,
+                          "train_s": round(train_s, 1), "recall": round(float(recall), 4),
+                          "qps": round(qps_ann, 1), "speedup": round(qps_ann / qps, 2)}), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark frame sampling strategies against the per-sample seek baseline.
+
+Usage:
+  python scripts/bench_frame_source.py [--samples 64] [--repeat 3] <video1> [<video2> ...]
+
+Prints one JSON line per (video, mode) with wall time, frames returned,
+speedup vs seek, and whether the frames match the seek baseline exactly.
+"""
+import argparse
+import json
+import shutil
+import sys
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+
+import cv2
+import numpy as np
+
+from app.config import FRAME_SAMPLES
+from app.frames import (
+    SEEK, SEQUENTIAL, KEYFRAME, AUTO, sample_frames, estimate_gop, choose_mode, frame_indices
+)
+
+def _run(path: Path, samples: int, mode: str) -> tuple[float, list[tuple[int, np.ndarray]]]:
+    t0 = time.perf_counter()
+    frames = list(sample_frames(path, samples, mode))
+    return time.perf_counter() - t0, frames
+
+def bench(path: Path, samples: int, repeat: int):
+    cap = cv2.VideoCapture(str(path))
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    gop = estimate_gop(path)
+    auto_pick = choose_mode(total, len(frame_indices(total, samples)), gop)
+
+    modes = [SEEK, SEQUENTIAL, AUTO] + ([KEYFRAME] if shutil.which("ffmpeg") else [])
+    baseline = None
+    for mode in modes:
+        times, frames = [], []
+        for _ in range(repeat):
+            dt, frames = _run(path, samples, mode)
+            times.append(dt)
+        best = min(times)
+        if mode == SEEK:
+            baseline = (best, frames)
+        identical = None
+        if mode != KEYFRAME:
+            identical = len(frames) == len(baseline[1]) and all(
+                i == j and np.array_equal(a, b) for (i, a), (j, b) in zip(frames, baseline[1])
+            )
+        print(json.dumps({
+            "video": str(path),
+            "total_frames": total,
+            "gop": gop,
+            "mode": mode if mode != AUTO else f"auto->{auto_pick}",
+            "samples": samples,
+            "frames": len(frames),
+            "seconds": round(best, 4),
+            "speedup_vs_seek": round(baseline[0] / best, 2) if best > 0 else None,
+            "identical_to_seek": identical,
+        }))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("videos", nargs="+", type=Path)
+    ap.add_argument("--samples", type=int, default=FRAME_SAMPLES)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+    for path in args.videos:
+        bench(path, args.samples, args.repeat)
+
+if __name__ == "__main__":
+    main()
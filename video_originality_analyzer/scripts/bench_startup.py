@@ -0,0 +1,126 @@
+"""
+Measure the API's import time and time to first request (cold start).
+
+Usage:
+  python scripts/bench_startup.py [--repeat 5] [--port 8765] [--timeout 120]
+                                  [--analyze-url URL] [--out results.json]
+
+Import: `import app.app` in fresh interpreters with -X importtime; reports
+wall time, the slowest top-level imports, and which heavy dependencies
+(cv2, PIL, imagehash, scipy, yt_dlp, numpy) were loaded by the import.
+
+Startup: launches uvicorn on the API in a fresh process (default data dir)
+and polls until GET /health (liveness) and GET /ready (warmup finished)
+answer 200, then times the first /health and /metrics requests, and with
+--analyze-url the first /analyze. Writes one JSON document to --out
+(default stdout).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+HEAVY = ("cv2", "PIL", "imagehash", "scipy", "yt_dlp", "numpy")
+
+_PROBE = (
+    "import sys, time; t0 = time.perf_counter(); import app.app; "
+    "print(time.perf_counter() - t0); print(','.join(m for m in %r if m in sys.modules))" % (HEAVY,)
+)
+
+def import_once() -> dict:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+    seconds, loaded = proc.stdout.splitlines()[-2:]
+    top = []  # (cumulative us, module) of imports made directly by the probe
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _self, cum, name = line.split(":", 1)[1].split("|")
+        if cum.strip().isdigit() and not name.startswith("  "):  # nested imports are indented further
+            top.append((int(cum), name.strip()))
+    return {"seconds": float(seconds), "loaded": [m for m in loaded.split(",") if m],
+            "top": sorted(top, reverse=True)[:10]}
+
+def bench_import(repeat: int) -> dict:
+    runs = [import_once() for _ in range(repeat)]
+    ms = np.array([r["seconds"] for r in runs]) * 1000
+    return {
+        "name": "import_app", "n": repeat,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3), "min_ms": round(float(ms.min()), 3),
+        "heavy_loaded": runs[-1]["loaded"],
+        "slowest_ms": {name: round(us / 1000, 3) for us, name in runs[-1]["top"]},
+    }
+
+def _get(url: str, data: bytes | None = None) -> tuple[int, float]:
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"} if data else {})
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=600) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - t0
+
+def _poll(url: str, t_start: float, deadline: float) -> float:
+    """Seconds from t_start until `url` answers 200."""
+    while time.perf_counter() < deadline:
+        try:
+            if _get(url)[0] == 200:
+                return time.perf_counter() - t_start
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(f"{url} not ready within the timeout")
+
+def bench_startup(port: int, timeout: float, analyze_url: str | None) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    t_start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.app:app", "--port", str(port),
+                             "--log-level", "warning"], cwd=ROOT, env={**os.environ, "PYTHONPATH": str(ROOT)})
+    try:
+        deadline = t_start + timeout
+        live = _poll(f"{base}/health", t_start, deadline)
+        ready = _poll(f"{base}/ready", t_start, deadline)
+        out = {"name": "startup", "live_s": round(live, 3), "ready_s": round(ready, 3),
+               "first_health_ms": round(_get(f"{base}/health")[1] * 1000, 3),
+               "first_metrics_ms": round(_get(f"{base}/metrics")[1] * 1000, 3)}
+        with urllib.request.urlopen(f"{base}/ready", timeout=10) as resp:
+            out["warmup_s"] = json.loads(resp.read())["seconds"]
+        if analyze_url:
+            status, dt = _get(f"{base}/analyze", json.dumps({"url": analyze_url}).encode())
+            out["first_analyze_ms"], out["first_analyze_status"] = round(dt * 1000, 3), status
+        return out
+    finally:
+        proc.terminate()
+        proc.wait(30)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--analyze-url")
+    ap.add_argument("--out", type=Path)
+    args = ap.parse_args()
+
+    report = {"python": sys.version.split()[0], "cpus": os.cpu_count(),
+              "benchmarks": [bench_import(args.repeat), bench_startup(args.port, args.timeout, args.analyze_url)]}
+    for b in report["benchmarks"]:
+        print(f"    {json.dumps({k: v for k, v in b.items() if k != 'slowest_ms'})}", file=sys.stderr)
+    text = json.dumps(report, indent=1)
+    if args.out:
+        args.out.write_text(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Offline benchmark suite: speed and detection accuracy on synthetic videos, no network.
+
+Usage:
+  python scripts/bench_suite.py [--work DIR] [--bases 8] [--sizes 0,10000,100000] [--repeat 3]
+                                [--download-latency 0] [--out results.json]
+                                [--baseline old.json] [--tolerance 0.25] [--max-fpr 0.1]
+
+Generates (or reuses) a synthetic dataset in DIR/videos (see synth_videos.py)
+and replaces yt-dlp with LocalYDL, which "downloads" https://bench.local/<id> by
+copying DIR/videos/<id>.mp4. Measures:
+
+  fingerprint_video, frame_phashes     per video, in this process
+  rank_matches                         per query over in-memory corpora of each size
+  store_load, corpus_search,           per corpus size, each in a fresh child process
+  frame_lookup, index, analyze_cold,   with its own data dir, the store pre-filled with
+  analyze_warm                         that many synthetic fingerprints; /index and
+                                       /analyze go through the FastAPI app
+
+For each size, the first half of the base clips is indexed. The queries are
+their near-duplicates (expected "not original"), plus the held-out clips and
+their variants (expected "original"). Accuracy is reported next to speed, with
+the check that decided each verdict. Writes one JSON document to --out
+(default stdout). The exit status is 1 when any size has a false positive
+rate above --max-fpr (distinct synthetic clips should not match each other,
+or the accuracy numbers mean nothing), and with --baseline when benchmarks
+got slower by more than --tolerance (p50) or accuracy dropped.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+sys.path.append(str(Path(__file__).resolve().parent))      # synth_videos
+
+import numpy as np
+import yt_dlp
+
+from synth_videos import generate
+
+BENCH_HOST = "https://bench.local/"
+
+# ---------------- offline yt-dlp ----------------
+
+class LocalYDL:
+    """yt_dlp.YoutubeDL stand-in serving BENCH_HOST/<id> from a directory of <id>.mp4 files."""
+    videos: Path = Path(".")
+    latency: float = 0.0  # seconds added per download (simulated transfer)
+
+    def __init__(self, opts: dict | None = None):
+        self.opts = opts or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @classmethod
+    def install(cls, videos: Path, latency: float = 0.0):
+        cls.videos, cls.latency = Path(videos), latency
+        yt_dlp.YoutubeDL = cls  # app modules look it up at call time
+
+    def extract_info(self, url: str, download: bool = True, process: bool = True) -> dict:
+        vid = url.rstrip("/").rsplit("/", 1)[-1]
+        src = self.videos / f"{vid}.mp4"
+        if not url.startswith(BENCH_HOST) or not src.exists():
+            raise yt_dlp.utils.DownloadError(f"ERROR: no local video for {url}")
+        info = {"id": vid, "title": vid, "extractor_key": "BenchLocal", "ext": "mp4", "webpage_url": url}
+        if download:
+            time.sleep(self.latency)
+            dst = Path(self.prepare_filename(info))
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(src, dst)
+        return info
+
+    def prepare_filename(self, info: dict) -> str:
+        return self.opts["outtmpl"] % info
+
+# ---------------- measurement helpers ----------------
+
+def summarize(name: str, seconds: list[float], size: int | None = None, **extra) -> dict:
+    ms = np.array(seconds) * 1000.0
+    return {
+        "name": name, "size": size, "n": len(seconds),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "per_s": round(1000.0 / float(ms.mean()), 2) if ms.mean() > 0 else None,
+        **extra,
+    }
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - t0, out
+
+def filler(n: int, seed: int = 1):
+    """n synthetic corpus rows (random unit vectors and frame hashes), in chunks."""
+    from app import quantize
+    rng = np.random.default_rng(seed)
+    for s in range(0, n, 5000):
+        m = min(5000, n - s)
+        X = np.abs(rng.normal(size=(m, quantize.COMPACT_DIM))).astype(np.float32)
+        X /= np.linalg.norm(X, axis=1, keepdims=True)
+        H = rng.integers(0, 2 ** 63, size=(m, 64), dtype=np.int64).astype(np.uint64)
+        yield [(f"fill{s + i}", f"https://filler.local/{s + i}", None, X[i], H[i]) for i in range(m)]
+
+def split(manifest: dict) -> tuple[list[dict], list[dict]]:
+    """(clips to index, queries with "expect_original") per the module docstring."""
+    bases = [v for v in manifest["videos"] if v["variant"] is None]
+    indexed = {v["id"] for v in bases[:max(1, len(bases) // 2)]}
+    corpus = [v for v in bases if v["id"] in indexed]
+    queries = [{**v, "expect_original": v["base"] not in indexed}
+               for v in manifest["videos"] if v["id"] not in indexed]
+    return corpus, queries
+
+# ---------------- in-process micro benchmarks ----------------
+
+def bench_fingerprints(videos: Path, manifest: dict, repeat: int) -> list[dict]:
+    from app.fingerprint import fingerprint_video, frame_phashes
+    paths = [videos / v["file"] for v in manifest["videos"]]
+    frames = sum(min(v["frames"], 64) for v in manifest["videos"])
+    out = []
+    for name, fn in (("fingerprint_video", fingerprint_video), ("frame_phashes", frame_phashes)):
+        secs = []
+        for _ in range(repeat):
+            secs += [timed(fn, p)[0] for p in paths]
+        out.append(summarize(name, secs, frames_per_s=round(frames * repeat / sum(secs), 1)))
+    return out
+
+def bench_rank(sizes: list[int], queries: int = 50) -> list[dict]:
+    from app import quantize
+    from app.matcher import rank_matches
+    rng = np.random.default_rng(2)
+    out = []
+    for size in sizes:
+        if size == 0:
+            continue
+        X = np.abs(rng.normal(size=(size, quantize.COMPACT_DIM))).astype(np.float32)
+        X /= np.linalg.norm(X, axis=1, keepdims=True)
+        corpus = [(f"v{i}", "", None, X[i]) for i in range(size)]
+        Q = X[rng.integers(0, size, queries)]
+        out.append(summarize("rank_matches", [timed(rank_matches, q, corpus, 5)[0] for q in Q], size))
+    return out
+
+# ---------------- per-size child process ----------------
+
+def _isolate(work: Path):
+    """Point every data path at `work` and turn off what would bypass the measured paths."""
+    import app.config as config
+    config.DATA_DIR = work
+    config.TMP_DIR = work / "tmp"
+    config.DB_PATH = work / "fingerprints.sqlite"
+    config.FRAME_INDEX_PATH = work / "frame_hashes.mih"
+    config.ANN_PATH = work / "ann_ivf.npz"
+    config.DOWNLOAD_CACHE_DIR = work / "tmp" / "cache"
+    config.STREAM_INGEST = False  # LocalYDL serves files, not streamable formats
+    config.VERDICT_CACHE_SIZE = 0  # repeat analyses should measure the pipeline
+    config.SHARDS, config.SHARD_URLS = 1, []
+
+def run_size(size: int, work: Path, repeat: int, latency: float) -> dict:
+    run_dir = work / f"run-{size}"
+    shutil.rmtree(run_dir, ignore_errors=True)
+    run_dir.mkdir(parents=True)
+    _isolate(run_dir)
+    LocalYDL.install(work / "videos", latency)
+    # app modules bind config values at import time: import only after _isolate()
+    from fastapi.testclient import TestClient
+    from app import metrics, quantize
+    from app.app import app
+    from app.config import SECOND_PASS_TOP_K
+    from app.corpus import load_corpus_index
+    from app.shards import get_corpus
+    from app.startup import get_warmup
+    from app.store import FingerprintStore
+    import app.config as config
+
+    manifest = json.loads((work / "videos" / "manifest.json").read_text())
+    corpus_videos, queries = split(manifest)
+    corpus = get_corpus()
+    t0 = time.perf_counter()
+    for rows in filler(size):
+        corpus.persist_many(rows)
+    fill_s = time.perf_counter() - t0
+
+    results = []
+    loads = [timed(load_corpus_index, FingerprintStore(config.DB_PATH), config.ANN_PATH)[0] for _ in range(repeat)]
+    results.append(summarize("store_load", loads, size, cold_ms=round(loads[0] * 1000, 3)))
+
+    rng = np.random.default_rng(3)
+    with TestClient(app) as client:
+        get_warmup().wait()  # measure requests against a warmed service, as behind /ready
+        post = lambda path, vid: client.post(f"{path}?timings=true", json={"url": BENCH_HOST + vid}).json()
+        index_s, stages = [], {}
+        for v in corpus_videos:
+            dt, res = timed(post, "/index", v["id"])
+            index_s.append(dt)
+            for k, s in res["timings"].items():
+                stages[k] = stages.get(k, 0.0) + s / len(corpus_videos)
+        results.append(summarize("index", index_s, size, stages_ms={k: round(s * 1000, 3) for k, s in stages.items()}))
+
+        # warm the corpus index, then time the query-side primitives at this size
+        Q = [np.asarray(x, dtype=np.float32) for x in np.abs(rng.normal(size=(100, quantize.COMPACT_DIM)))]
+        Q = [q / np.linalg.norm(q) for q in Q]
+        corpus.search_many(Q[:1], top_k=SECOND_PASS_TOP_K)
+        results.append(summarize("corpus_search", [timed(corpus.search_many, [q], SECOND_PASS_TOP_K)[0] for q in Q], size))
+        H = [rng.integers(0, 2 ** 63, size=64, dtype=np.int64).astype(np.uint64) for _ in range(50)]
+        results.append(summarize("frame_lookup", [timed(corpus.frame_query, h, 16)[0] for h in H], size))
+
+        verdicts, rounds = [], {"analyze_cold": [], "analyze_warm": []}
+        stages = {}
+        for r in range(max(2, repeat)):
+            for q in queries:
+                before = metrics.VERDICTS.values()
+                dt, res = timed(post, "/analyze", q["id"])
+                key = "analyze_cold" if r == 0 else "analyze_warm"
+                rounds[key].append(dt)
+                for k, s in res.get("timings", {}).items():
+                    stages.setdefault(key, {})
+                    stages[key][k] = stages[key].get(k, 0.0) + s / len(queries) / (1 if r == 0 else max(2, repeat) - 1)
+                if r == 0:
+                    after = metrics.VERDICTS.values()
+                    decided = [labels[0] for labels, n in after.items() if n > before.get(labels, 0)]
+                    verdicts.append({**q, "original": res.get("original"), "error": res.get("detail"),
+                                     "decided_by": decided[0] if decided else None})
+        for key, secs in rounds.items():
+            results.append(summarize(key, secs, size,
+                                     stages_ms={k: round(s * 1000, 3) for k, s in stages.get(key, {}).items()}))
+    return {"size": size, "fill_seconds": round(fill_s, 2), "benchmarks": results,
+            "accuracy": accuracy(verdicts, size)}
+
+def accuracy(verdicts: list[dict], size: int) -> dict:
+    pos = [v for v in verdicts if not v["expect_original"]]  # near-duplicates of indexed clips
+    neg = [v for v in verdicts if v["expect_original"]]
+    tp = sum(v["original"] is False for v in pos)
+    fp = sum(v["original"] is False for v in neg)
+    by_variant: dict[str, list[bool]] = {}
+    for v in pos:
+        by_variant.setdefault(v["variant"], []).append(v["original"] is False)
+    decided: dict[str, dict[str, int]] = {"duplicates": {}, "originals": {}}
+    for group, vs in (("duplicates", pos), ("originals", neg)):
+        for v in vs:
+            decided[group][str(v["decided_by"])] = decided[group].get(str(v["decided_by"]), 0) + 1
+    return {
+        "size": size, "duplicates": len(pos), "originals": len(neg),
+        "errors": sum(v["original"] is None for v in verdicts),
+        "recall": round(tp / len(pos), 4) if pos else None,
+        "false_positive_rate": round(fp / len(neg), 4) if neg else None,
+        "precision": round(tp / (tp + fp), 4) if tp + fp else None,
+        "accuracy": round((tp + len(neg) - fp) / len(verdicts), 4) if verdicts else None,
+        "recall_by_variant": {k: round(sum(x) / len(x), 4) for k, x in sorted(by_variant.items())},
+        "decided_by": decided,
+    }
+
+# ---------------- report / regression check ----------------
+
+def meta() -> dict:
+    import cv2
+    from app import config
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).resolve().parent).stdout.strip() or None
+    except OSError:
+        rev = None
+    return {
+        "git": rev, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+        "numpy": np.__version__, "opencv": cv2.__version__, "cpus": os.cpu_count(),
+        "platform": platform.platform(),
+        "config": {k: getattr(config, k) for k in (
+            "FRAME_SAMPLES", "FRAME_SOURCE_MODE", "FINGERPRINT_ENCODING", "NOT_ORIGINAL_THRESHOLD",
+            "FRAME_OVERLAP_THRESHOLD", "HAMMING_MAX_BITS", "PROGRESSIVE_SAMPLING", "SHARED_VECTORS")},
+    }
+
+def sanity(report: dict, max_fpr: float) -> list[str]:
+    """Accuracy numbers too poor for the dataset to be telling anything (empty when fine)."""
+    return [f"false_positive_rate (size {a['size']}): {a['false_positive_rate']} > {max_fpr}, "
+            f"decided by {a['decided_by']['originals']}"
+            for a in report["accuracy"]
+            if a.get("false_positive_rate") is not None and a["false_positive_rate"] > max_fpr]
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Human-readable regressions of `report` against `baseline` (empty when none)."""
+    old = {(b["name"], b["size"]): b for b in baseline.get("benchmarks", [])}
+    problems = []
+    for b in report["benchmarks"]:
+        prev = old.get((b["name"], b["size"]))
+        if prev and prev["p50_ms"] > 0 and b["p50_ms"] > prev["p50_ms"] * (1 + tolerance):
+            problems.append(f"{b['name']} (size {b['size']}): p50 {prev['p50_ms']} -> {b['p50_ms']} ms")
+    old_acc = {a["size"]: a for a in baseline.get("accuracy", [])}
+    for a in report["accuracy"]:
+        prev = old_acc.get(a["size"])
+        for key, worse in (("recall", lambda n, o: n < o), ("false_positive_rate", lambda n, o: n > o)):
+            if prev and prev.get(key) is not None and a.get(key) is not None and worse(a[key], prev[key]):
+                problems.append(f"{key} (size {a['size']}): {prev[key]} -> {a[key]}")
+    return problems
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--work", type=Path, default=Path("data/bench"))
+    ap.add_argument("--bases", type=int, default=8)
+    ap.add_argument("--sizes", default="0,10000,100000")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--download-latency", type=float, default=0.0)
+    ap.add_argument("--out", type=Path)
+    ap.add_argument("--baseline", type=Path)
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--max-fpr", type=float, default=0.1)
+    ap.add_argument("--child", type=int, help=argparse.SUPPRESS)  # internal: run one corpus size
+    args = ap.parse_args()
+
+    if args.child is not None:
+        res = run_size(args.child, args.work, args.repeat, args.download_latency)
+        (args.work / f"result-{args.child}.json").write_text(json.dumps(res))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    videos = args.work / "videos"
+    print(f"[*] dataset in {videos}", file=sys.stderr)
+    manifest = generate(videos, args.bases)
+    print(f"[+] {len(manifest['videos'])} videos", file=sys.stderr)
+
+    report = {"meta": meta(), "dataset": manifest["settings"], "benchmarks": [], "accuracy": []}
+    report["benchmarks"] += bench_fingerprints(videos, manifest, args.repeat)
+    report["benchmarks"] += bench_rank(sizes)
+    for size in sizes:
+        print(f"[*] corpus size {size}", file=sys.stderr)
+        subprocess.run([sys.executable, str(Path(__file__).resolve()), "--child", str(size),
+                        "--work", str(args.work), "--repeat", str(args.repeat),
+                        "--download-latency", str(args.download_latency)], check=True)
+        res = json.loads((args.work / f"result-{size}.json").read_text())
+        report["benchmarks"] += res["benchmarks"]
+        report["accuracy"].append(res["accuracy"])
+
+    for b in report["benchmarks"]:
+        print(f"    {b['name']:<18} size={str(b['size']):<7} p50={b['p50_ms']:>9.3f} ms  "
+              f"p95={b['p95_ms']:>9.3f} ms  n={b['n']}", file=sys.stderr)
+    for a in report["accuracy"]:
+        print(f"    accuracy size={a['size']}: recall={a['recall']} fpr={a['false_positive_rate']} "
+              f"by variant {a['recall_by_variant']}", file=sys.stderr)
+
+    text = json.dumps(report, indent=1)
+    if args.out:
+        args.out.write_text(text)
+    else:
+        print(text)
+    problems = [f"accuracy: {p}" for p in sanity(report, args.max_fpr)]
+    if args.baseline:
+        problems += [f"regression: {p}" for p in compare(report, json.loads(args.baseline.read_text()), args.tolerance)]
+    for p in problems:
+        print(f"[!] {p}", file=sys.stderr)
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Train the IVF(-PQ) model for the coarse vectors and save it next to the DB.
+
+Usage:
+  python scripts/build_ann.py [--nlist 0] [--pq-m 0] [--seed 0]
+
+The API loads ANN_PATH at startup and keeps it up to date with /index adds;
+rerun this after the corpus has grown a lot (e.g. 4x) to re-fit the cells.
+With SHARDS > 1 every local shard gets its own model next to its store.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+
+from app.config import ANN_NLIST, ANN_PQ_M
+from app.corpus import CorpusIndex
+from app.shards import local_shards
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nlist", type=int, default=ANN_NLIST, help="0 = 4 * sqrt(rows)")
+    ap.add_argument("--pq-m", type=int, default=ANN_PQ_M)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    for shard in local_shards():
+        t0 = time.perf_counter()
+        index = CorpusIndex.from_store(shard.store)
+        print(f"[+] Loaded {len(index)} fingerprints from {shard.db_path.name} ({time.perf_counter() - t0:.1f}s)")
+        if len(index) == 0:
+            continue
+        t0 = time.perf_counter()
+        ann = index.build_ann(nlist=args.nlist, pq_m=args.pq_m, seed=args.seed)
+        print(f"[+] Trained nlist={ann.nlist} pq_m={ann.pq_m} ({time.perf_counter() - t0:.1f}s)")
+        index.save_ann(shard.ann_path)
+        print(f"[+] Saved {shard.ann_path}")
+
+if __name__ == "__main__":
+    main()
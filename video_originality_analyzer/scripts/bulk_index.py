@@ -0,0 +1,166 @@
+"""
+Bulk-index a large list of URLs into the local corpus, in parallel and resumably.
+
+Usage:
+  python scripts/bulk_index.py urls.txt [--checkpoint urls.txt.done] [--workers 8] [--cpu 4] [--commit-every 200]
+  cat urls.txt | python scripts/bulk_index.py - --checkpoint run.done
+
+One URL per line (blank lines and # comments are skipped). Downloads run on
+worker threads (bounded by DOWNLOAD_CONCURRENCY), fingerprinting on a process
+pool, and results are written to the store in batched transactions. After
+every commit the finished URLs and ids are appended to the checkpoint, so a
+rerun skips them; failed URLs go to <checkpoint>.failed and are retried on
+the next run. With SHARDS / SHARD_URLS set, each batch is split across the
+owning shards. Progress lines report videos/min and MB/s.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+
+from app.config import FINGERPRINT_WORKERS, DOWNLOAD_CONCURRENCY, SEGMENTS_ENABLED
+from app.fetchers import resolve_video_id
+from app.pipeline import ingest
+from app.segments import index_signatures
+from app.shards import get_corpus
+
+def read_urls(source: str):
+    f = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    try:
+        for line in f:
+            url = line.strip()
+            if url and not url.startswith("#"):
+                yield url
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def load_checkpoint(path: Path) -> tuple[set[str], set[str]]:
+    """(finished URLs, finished video ids) recorded by previous runs."""
+    urls, ids = set(), set()
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                url, _, vid = line.rstrip("\n").partition("\t")
+                if url:
+                    urls.add(url)
+                if vid:
+                    ids.add(vid)
+    return urls, ids
+
+class Progress:
+    def __init__(self, every: float):
+        self.every = every
+        self.t0 = self.last = time.perf_counter()
+        self.done = self.failed = self.skipped = 0
+        self.bytes = 0
+
+    def line(self) -> str:
+        dt = max(time.perf_counter() - self.t0, 1e-9)
+        return (f"[+] done={self.done} failed={self.failed} skipped={self.skipped} "
+                f"{self.done * 60.0 / dt:.1f} videos/min {self.bytes / dt / 1e6:.2f} MB/s "
+                f"elapsed={dt:.0f}s")
+
+    def tick(self):
+        now = time.perf_counter()
+        if now - self.last >= self.every:
+            self.last = now
+            print(self.line(), flush=True)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("source", help="file with one URL per line, or - for stdin")
+    ap.add_argument("--checkpoint", type=Path, help="default: <source>.done (required for stdin)")
+    ap.add_argument("--workers", type=int, default=DOWNLOAD_CONCURRENCY + FINGERPRINT_WORKERS,
+                    help="URLs in flight (download + fingerprint)")
+    ap.add_argument("--cpu", type=int, default=FINGERPRINT_WORKERS, help="fingerprinting processes")
+    ap.add_argument("--commit-every", type=int, default=200, help="rows per store transaction")
+    ap.add_argument("--report-every", type=float, default=10.0, help="seconds between progress lines")
+    args = ap.parse_args()
+
+    if args.checkpoint is None:
+        if args.source == "-":
+            ap.error("--checkpoint is required when reading from stdin")
+        args.checkpoint = Path(args.source + ".done")
+    failed_path = args.checkpoint.with_name(args.checkpoint.name + ".failed")
+
+    done_urls, done_ids = load_checkpoint(args.checkpoint)
+    if done_urls:
+        print(f"[+] Resuming: {len(done_urls)} URLs already indexed", flush=True)
+
+    corpus = get_corpus()
+    progress = Progress(args.report_every)
+    pending_rows, pending_segments, pending_ck = [], [], []
+
+    def flush():
+        if not pending_rows:
+            return
+        corpus.persist_many(pending_rows)  # store + frame log; no in-memory index is loaded
+        if pending_segments:
+            corpus.persist_segments(pending_segments)
+        # checkpoint only after the rows are committed: a crash redoes at most one batch
+        with open(args.checkpoint, "a", encoding="utf-8") as f:
+            f.writelines(f"{url}\t{vid}\n" for url, vid in pending_ck)
+            f.flush()
+            os.fsync(f.fileno())
+        pending_rows.clear()
+        pending_segments.clear()
+        pending_ck.clear()
+
+    def collect(fut, url):
+        try:
+            ing = fut.result()
+        except Exception as e:
+            progress.failed += 1
+            with open(failed_path, "a", encoding="utf-8") as f:
+                f.write(f"{url}\t{str(e).splitlines()[0] if str(e) else type(e).__name__}\n")
+            return
+        meta, fp = ing.meta, ing.fp
+        pending_rows.append((meta.id, meta.url, meta.title, fp.vec, fp.hashes))
+        if SEGMENTS_ENABLED and fp.timeline is not None:
+            pending_segments.append((meta.id, index_signatures(fp.timeline)))
+        pending_ck.append((url, meta.id))
+        done_ids.add(meta.id)
+        progress.done += 1
+        progress.bytes += ing.nbytes
+        if len(pending_rows) >= args.commit_every:
+            flush()
+
+    cpu = ProcessPoolExecutor(max_workers=args.cpu, mp_context=multiprocessing.get_context("spawn"))
+    threads = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="ingest")
+    inflight: dict = {}
+    seen: set[str] = set()
+    try:
+        for url in read_urls(args.source):
+            if url in done_urls or url in seen:
+                progress.skipped += 1
+                continue
+            vid = resolve_video_id(url)  # URL shape / download cache only, no network
+            if vid is not None and vid in done_ids:
+                progress.skipped += 1
+                continue
+            seen.add(url)
+            # bounded window: never queue more than 2x the workers (the list may be huge)
+            while len(inflight) >= 2 * args.workers:
+                finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    collect(fut, inflight.pop(fut))
+                progress.tick()
+            inflight[threads.submit(ingest, url, cpu)] = url
+        while inflight:
+            finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                collect(fut, inflight.pop(fut))
+            progress.tick()
+    finally:
+        flush()
+        threads.shutdown(wait=False, cancel_futures=True)
+        cpu.shutdown(wait=False, cancel_futures=True)
+    print(progress.line(), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Check the batched feature extractor against the per-frame imagehash/OpenCV reference.
+
+Usage:
+  python scripts/check_batch_features.py [--samples 64] <video1> [<video2> ...]
+
+Reports, per feature block, how many frames differ and the max abs difference,
+plus the time spent by each implementation. Exit code 1 if any hash bit differs.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+
+import numpy as np
+
+from app.config import FRAME_SAMPLES
+from app.features import frame_features
+from app.fingerprint import _per_frame_feature, _prepare_frame
+from app.frames import sample_frames
+
+BLOCKS = {
+    "phash": slice(0, 64),
+    "dhash": slice(64, 128),
+    "ahash": slice(128, 192),
+    "hsv": slice(192, 704),
+    "edge": slice(704, 720),
+}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("videos", nargs="+", type=Path)
+    ap.add_argument("--samples", type=int, default=FRAME_SAMPLES)
+    args = ap.parse_args()
+
+    hash_mismatch = False
+    for path in args.videos:
+        frames = [f for _i, f in sample_frames(path, args.samples)]
+        t0 = time.perf_counter()
+        ref = np.vstack([_per_frame_feature(f) for f in frames])
+        t_ref = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        new = frame_features(np.stack([_prepare_frame(f) for f in frames]))
+        t_new = time.perf_counter() - t0
+
+        print(f"[+] {path}  frames={len(frames)}  reference={t_ref:.3f}s  batched={t_new:.3f}s")
+        for name, sl in BLOCKS.items():
+            diff = np.abs(ref[:, sl] - new[:, sl])
+            bad = int(np.count_nonzero(diff.max(axis=1) > 0))
+            print(f"    {name:6s} frames_differing={bad}  max_abs_diff={float(diff.max()):.3g}")
+            if name.endswith("hash") and bad:
+                hash_mismatch = True
+    sys.exit(1 if hash_mismatch else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Compare ranking on the compact fingerprint encoding against the float32 baseline.
+
+Usage:
+  python scripts/check_compact.py [--queries 200] [--top-k 10] [--noise 0.01]
+
+Loads the stored 736-dim fingerprints, encodes them, and ranks perturbed
+copies of random corpus rows with both forms. Reports recall@k, top-1
+agreement, agreement of the NOT_ORIGINAL_THRESHOLD decision, the max
+similarity error, and memory per fingerprint.
+"""
+import argparse
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+
+import numpy as np
+
+from app import quantize
+from app.config import NOT_ORIGINAL_THRESHOLD
+from app.store import FingerprintStore
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--top-k", type=int, default=10)
+    ap.add_argument("--noise", type=float, default=0.01, help="std of the perturbation added to queries")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rows = [vec for (vec,) in FingerprintStore().iter_rows(("vec",), vec_len=quantize.COMPACT_DIM)]
+    if not rows:
+        print("No fingerprints of the standard length in the store.")
+        sys.exit(1)
+    X = np.stack(rows).astype(np.float32)
+    codes, scales = quantize.encode(X)
+
+    rng = np.random.default_rng(args.seed)
+    Q = X[rng.integers(0, len(X), args.queries)]
+    Q = np.clip(Q + rng.normal(0.0, args.noise, Q.shape), 0.0, None).astype(np.float32)
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True) + 1e-12
+
+    exact = Q @ X.T
+    approx = quantize.scores_many(codes, scales, Q)
+    k = min(args.top_k, len(X))
+    a = np.argsort(-exact, axis=1)[:, :k]
+    b = np.argsort(-approx, axis=1)[:, :k]
+    recall = np.mean([len(set(x) & set(y)) / k for x, y in zip(a, b)])
+    decided = (exact.max(axis=1) >= NOT_ORIGINAL_THRESHOLD) == (approx.max(axis=1) >= NOT_ORIGINAL_THRESHOLD)
+
+    print(f"fingerprints        {len(X)}")
+    print(f"bytes/fingerprint   {codes.shape[1] + 4 * scales.shape[1]} (float32: {4 * X.shape[1]})")
+    print(f"recall@{k:<12}{recall:.4f}")
+    print(f"top-1 agreement     {np.mean(a[:, 0] == b[:, 0]):.4f}")
+    print(f"threshold agreement {np.mean(decided):.4f}")
+    print(f"max |sim error|     {np.abs(exact - approx).max():.5f}")
+
+if __name__ == "__main__":
+    main()
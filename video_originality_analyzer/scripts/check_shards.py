@@ -0,0 +1,104 @@
+"""
+Check scatter-gather over shard server processes against a single unsharded corpus.
+
+Usage:
+  python scripts/check_shards.py [--shards 4] [--rows 20000] [--queries 200] [--top-k 5] [--base-port 8150]
+
+Starts --shards shard servers (scripts/shard_server.py) on local ports with a
+temporary data dir, indexes the same synthetic fingerprints (and frame hashes)
+through them and into one in-process shard, then compares top-k results,
+frame lookups and id routing, and reports queries/s for both.
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+
+import numpy as np
+
+from app import quantize
+from app.shards import LocalShard, RemoteShard, ShardedCorpus, shard_paths
+
+SCRIPT = Path(__file__).resolve().parent / "shard_server.py"
+
+def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"shard server for {url} exited with {proc.returncode}")
+        try:
+            urllib.request.urlopen(urllib.request.Request(url + "/shard/stats", data=b"{}",
+                                                          headers={"Content-Type": "application/json"}), timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"shard server at {url} did not start")
+
+def timed(corpus: ShardedCorpus, Q: np.ndarray, k: int, batch: int = 16):
+    out, t0 = [], time.perf_counter()
+    for s in range(0, len(Q), batch):
+        out += corpus.search_many(list(Q[s:s + batch]), top_k=k)
+    return out, len(Q) / (time.perf_counter() - t0)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--shards", type=int, default=4)
+    ap.add_argument("--rows", type=int, default=20_000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--base-port", type=int, default=8150)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    X = np.abs(rng.normal(size=(args.rows, quantize.COMPACT_DIM))).astype(np.float32)
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    H = rng.integers(0, 2 ** 63, size=(args.rows, 8), dtype=np.int64).astype(np.uint64)
+    rows = [(f"vid{i}", f"https://example.com/{i}", None, X[i], H[i]) for i in range(args.rows)]
+
+    tmp = Path(tempfile.mkdtemp(prefix="shards-"))
+    (tmp / "single").mkdir()
+    single = ShardedCorpus([LocalShard(*shard_paths(0, 1, tmp / "single"))])
+    procs, urls = [], []
+    try:
+        for i in range(args.shards):
+            port = args.base_port + i
+            procs.append(subprocess.Popen([sys.executable, str(SCRIPT), "--shard", str(i), "--shards",
+                                           str(args.shards), "--port", str(port), "--data-dir", str(tmp / "shards")]))
+            urls.append(f"http://127.0.0.1:{port}")
+        for url, proc in zip(urls, procs):
+            wait_ready(url, proc)
+        sharded = ShardedCorpus([RemoteShard(u) for u in urls])
+
+        for s in range(0, len(rows), 1000):
+            single.add_many(rows[s:s + 1000])
+            sharded.add_many(rows[s:s + 1000])
+        sizes = [shard.size() for shard in sharded.shards]
+        print(f"[+] {len(sharded)} rows over {args.shards} shards: {sizes}")
+
+        Q = X[rng.integers(0, args.rows, args.queries)] + rng.normal(0, 0.01, (args.queries, X.shape[1]))
+        Q = (Q / np.linalg.norm(Q, axis=1, keepdims=True)).astype(np.float32)
+        a, qps_single = timed(single, Q, args.top_k)
+        b, qps_sharded = timed(sharded, Q, args.top_k)
+        same = np.mean([[m.video_id for m in x] == [m.video_id for m in y] for x, y in zip(a, b)])
+        print(f"[+] top-{args.top_k} identical: {same:.3f}  single {qps_single:.0f} q/s, "
+              f"sharded {qps_sharded:.0f} q/s (HTTP, {args.shards} processes)")
+
+        probe = [f"vid{i}" for i in rng.integers(0, args.rows, 50)]
+        print(f"[+] contains: {all(v in sharded for v in probe)}, unknown id: {'nope' in sharded}")
+        got = sharded.get_hashes(probe)
+        print(f"[+] hashes round trip: {all(np.array_equal(got[v], H[int(v[3:])]) for v in probe)}")
+        hits = sharded.frame_query(H[7], min_frames=8)
+        print(f"[+] frame lookup: {sorted(hits)} (expect ['vid7'])")
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+if __name__ == "__main__":
+    main()
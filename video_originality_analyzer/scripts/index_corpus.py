@@ -3,24 +3,23 @@ Index one or more URLs into the local corpus.
 
 Usage:
   python scripts/index_corpus.py <url1> [<url2> ...]
+
+For large URL lists use scripts/bulk_index.py (parallel, batched, resumable).
 """
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
 
-from app.netio import download_video
-from app.fetchers import build_video_meta
-from app.fingerprint import fingerprint_video
-from app.store import FingerprintStore
+from app.pipeline import ingest
+from app.shards import get_corpus
 
 def main(urls):
-    store = FingerprintStore()
+    corpus = get_corpus()
     for url in urls:
         print(f"[+] Indexing {url}")
-        path = download_video(url)
-        meta = build_video_meta(url, path)
-        vec = fingerprint_video(path)
-        store.upsert(meta.id, meta.url, meta.title, vec)
+        ing = ingest(url)
+        meta, fp = ing.meta, ing.fp
+        corpus.persist_many([(meta.id, meta.url, meta.title, fp.vec, fp.hashes)])
         print(f"    -> stored id={meta.id}")
 
 if __name__ == "__main__":
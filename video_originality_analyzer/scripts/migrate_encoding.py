@@ -0,0 +1,39 @@
+"""
+Rewrite stored fingerprints into the configured encoding, a batch at a time.
+
+Usage:
+  python scripts/migrate_encoding.py [--encoding compact|float32] [--batch 10000] [--max-rows N]
+
+Reads accept every stored format, so this is optional and can be stopped
+and resumed at any point; each batch is one transaction. Runs over every
+local shard (SHARDS) in turn.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+
+from app.config import FINGERPRINT_ENCODING
+from app.shards import local_shards
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--encoding", choices=["compact", "float32"], default=FINGERPRINT_ENCODING)
+    ap.add_argument("--batch", type=int, default=10_000)
+    ap.add_argument("--max-rows", type=int, default=0, help="stop after this many rows (0 = all)")
+    args = ap.parse_args()
+
+    total, t0 = 0, time.perf_counter()
+    for shard in local_shards():
+        while not args.max_rows or total < args.max_rows:
+            limit = args.batch if not args.max_rows else min(args.batch, args.max_rows - total)
+            n = shard.store.migrate_encoding(args.encoding, limit=limit)
+            if n == 0:
+                break
+            total += n
+            print(f"[+] {total} rows -> {args.encoding} ({time.perf_counter() - t0:.1f}s)", flush=True)
+    print(f"[+] Done: {total} rows rewritten")
+
+if __name__ == "__main__":
+    main()
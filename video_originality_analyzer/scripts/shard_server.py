@@ -0,0 +1,40 @@
+"""
+Serve one corpus shard over HTTP (the protocol in app/shard_server.py).
+
+Usage:
+  python scripts/shard_server.py --shard 0 --shards 4 [--port 8100] [--host 127.0.0.1] [--data-dir data]
+
+Shard i of n keeps its files in the data dir under the names from
+app.shards.shard_paths. Point the API at the servers with SHARD_URLS in
+app/config.py, one URL per shard in shard order. The default port is
+8100 + shard.
+"""
+import argparse
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+
+import uvicorn
+
+from app.config import DATA_DIR
+from app.shard_server import create_app
+from app.shards import LocalShard, shard_paths
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--shard", type=int, required=True)
+    ap.add_argument("--shards", type=int, required=True)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, help="default 8100 + shard")
+    ap.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    args = ap.parse_args()
+    if not 0 <= args.shard < args.shards:
+        ap.error("--shard must be in [0, --shards)")
+
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    shard = LocalShard(*shard_paths(args.shard, args.shards, args.data_dir))
+    shard.warm()  # load before accepting queries
+    uvicorn.run(create_app(shard), host=args.host, port=args.port or 8100 + args.shard, log_level="warning")
+
+if __name__ == "__main__":
+    main()
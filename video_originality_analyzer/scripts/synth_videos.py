@@ -0,0 +1,230 @@
+"""
+Generate synthetic test videos: distinct base clips plus near-duplicates of each.
+
+Usage:
+  python scripts/synth_videos.py --out DIR [--bases 8] [--seed 0] [--variants reencode,crop,color,letterbox,resize]
+
+Base clips are procedural scenes (textured backgrounds, moving shapes, text,
+camera pans, cuts) that vary in length, resolution, frame rate and GOP, written
+with cv2.VideoWriter. Each base has its own style shared by all its scenes: a
+palette, a coarse brightness layout and a motion profile (calm to busy), so
+distinct bases differ in what the coarse fingerprint measures (colors,
+low-frequency structure, motion histogram) the way unrelated uploads do.
+GOPs are set by re-encoding with ffmpeg/libx264 when it is available (cv2's
+mp4v writer has a fixed GOP). Every variant of a base is
+rendered from the same frames with one edit applied. Writes DIR/<id>.mp4 and
+DIR/manifest.json; an existing manifest with the same settings is reused.
+"""
+from __future__ import annotations
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import Callable, Iterator
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # add project root
+
+import cv2
+import numpy as np
+
+RESOLUTIONS = [(360, 640), (480, 480), (640, 360), (288, 512), (540, 960)]  # (width, height)
+FPS = [24, 25, 30]
+SECONDS = (3.0, 9.0)
+GOPS = [12, 60, 250]
+GENERATOR_VERSION = 2  # bump when the rendering changes, so cached datasets are regenerated
+_WORDS = ["sale", "wow", "daily", "vlog", "recipe", "news", "goal", "dance", "tips", "live"]
+# motion profiles: scene length (s), pan speed and shape speed (px/frame), shape size, flicker amplitude
+MOTION = {
+    "calm": {"scene": (3.0, 6.0), "pan": 0.5, "speed": 0.5, "size": (0.04, 0.12), "flicker": 0},
+    "steady": {"scene": (1.5, 3.0), "pan": 3.0, "speed": 4.0, "size": (0.06, 0.2), "flicker": 30},
+    "busy": {"scene": (0.3, 1.0), "pan": 12.0, "speed": 18.0, "size": (0.15, 0.35), "flicker": 60},
+}
+
+# ---------------- base clips ----------------
+
+def _style(rng: np.random.Generator) -> dict:
+    """Per-base look shared by all its scenes."""
+    return {
+        "palette": rng.integers(0, 256, (4, 3)).tolist(),
+        "layout": rng.choice([0.0, 0.5, 1.0], (4, 4)).tolist(),  # brightness over a 4x4 grid of the frame
+        "motion": str(rng.choice(list(MOTION))),
+    }
+
+def _texture(rng: np.random.Generator, w: int, h: int, palette: np.ndarray) -> np.ndarray:
+    """Smooth color field + finer detail in the base palette, jittered per scene (BGR uint8)."""
+    palette = np.clip(palette + rng.normal(0, 20, palette.shape), 0, 255).astype(np.float32)
+    coarse = cv2.resize(rng.random((rng.integers(2, 6), rng.integers(2, 6), 4), dtype=np.float32),
+                        (w, h), interpolation=cv2.INTER_CUBIC)
+    weights = np.clip(coarse, 0, None) ** 2
+    weights /= weights.sum(axis=2, keepdims=True) + 1e-6
+    img = weights @ palette
+    gh, gw = int(rng.integers(8, 48)), int(rng.integers(8, 48))
+    detail = cv2.resize(rng.random((gh, gw), dtype=np.float32), (w, h), interpolation=cv2.INTER_LINEAR)
+    img += (detail[..., None] - 0.5) * rng.uniform(20, 120)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def _scene(rng: np.random.Generator, w: int, h: int, style: dict) -> dict:
+    motion = MOTION[style["motion"]]
+    palette = np.array(style["palette"], dtype=np.float32)
+    shapes = []
+    for _ in range(int(rng.integers(2, 7))):
+        shapes.append({
+            "kind": rng.choice(["circle", "rect", "line"]),
+            "pos": rng.random(2) * (w, h),
+            "vel": rng.normal(0, motion["speed"], 2),
+            "size": float(rng.uniform(*motion["size"]) * min(w, h)),
+            "color": tuple(int(c) for c in palette[rng.integers(len(palette))]),
+        })
+    bg = _texture(rng, w + w // 2, h, palette)  # wider than the frame: the camera pans over it
+    layout = cv2.resize(np.array(style["layout"], dtype=np.float32), (bg.shape[1], h), interpolation=cv2.INTER_CUBIC)
+    return {
+        "bg": np.clip(bg * (0.15 + 1.5 * np.clip(layout, 0, 1))[..., None], 0, 255).astype(np.uint8),
+        "pan": float(rng.uniform(-1, 1) * motion["pan"]),
+        "shapes": shapes,
+        "text": " ".join(rng.choice(_WORDS, 2)),
+        "text_pos": (int(rng.integers(0, w // 2)), int(rng.integers(h // 6, h))),
+    }
+
+def base_frames(spec: dict) -> Iterator[np.ndarray]:
+    """Frames of a base clip, deterministic in spec["seed"]; scene length follows its motion profile."""
+    rng = np.random.default_rng(spec["seed"])
+    w, h, fps = spec["width"], spec["height"], spec["fps"]
+    motion = MOTION[spec["style"]["motion"]]
+    scene, t_scene = None, 0
+    for i in range(spec["frames"]):
+        if scene is None or i - t_scene >= scene["length"]:
+            scene, t_scene = _scene(rng, w, h, spec["style"]), i
+            scene["length"] = max(1, int(rng.uniform(*motion["scene"]) * fps))
+        t = i - t_scene
+        x0 = int(np.clip(w // 4 + scene["pan"] * t, 0, scene["bg"].shape[1] - w))
+        img = scene["bg"][:, x0:x0 + w].copy()
+        for s in scene["shapes"]:
+            x, y = (s["pos"] + s["vel"] * t) % (w, h)
+            r = int(s["size"])
+            if s["kind"] == "circle":
+                cv2.circle(img, (int(x), int(y)), r, s["color"], -1)
+            elif s["kind"] == "rect":
+                cv2.rectangle(img, (int(x) - r, int(y) - r // 2), (int(x) + r, int(y) + r // 2), s["color"], -1)
+            else:
+                cv2.line(img, (int(x) - r, int(y)), (int(x) + r, int(y) + r // 3), s["color"], max(2, r // 6))
+        cv2.putText(img, scene["text"], scene["text_pos"], cv2.FONT_HERSHEY_SIMPLEX,
+                    min(w, h) / 300, (255, 255, 255), 2, cv2.LINE_AA)
+        if motion["flicker"]:  # strobing lights / flashes, of uneven strength
+            img = cv2.add(img, np.full_like(img, motion["flicker"] * (i * 7919 % 13) // 12))
+        yield img
+
+def base_spec(seed: int) -> dict:
+    rng = np.random.default_rng(10_000 + seed)
+    w, h = RESOLUTIONS[int(rng.integers(len(RESOLUTIONS)))]
+    fps = int(rng.choice(FPS))
+    return {"seed": seed, "width": w, "height": h, "fps": fps,
+            "frames": int(rng.uniform(*SECONDS) * fps), "gop": int(rng.choice(GOPS)), "style": _style(rng)}
+
+# ---------------- near-duplicate edits ----------------
+
+def _jpeg(img: np.ndarray, quality: int = 30) -> np.ndarray:
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+def _crop(img: np.ndarray, keep: float = 0.8) -> np.ndarray:
+    h, w = img.shape[:2]
+    ch, cw = int(h * keep), int(w * keep)
+    y, x = (h - ch) // 2, (w - cw) // 2
+    return cv2.resize(img[y:y + ch, x:x + cw], (w, h), interpolation=cv2.INTER_LINEAR)
+
+def _color(img: np.ndarray) -> np.ndarray:
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV).astype(np.int16)
+    hsv[..., 0] = (hsv[..., 0] + 8) % 180
+    hsv[..., 1] = np.clip(hsv[..., 1] * 0.8, 0, 255)
+    hsv[..., 2] = np.clip(hsv[..., 2] + 20, 0, 255)
+    return cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+
+def _letterbox(img: np.ndarray, scale: float = 0.75) -> np.ndarray:
+    h, w = img.shape[:2]
+    sh = int(h * scale)
+    out = np.zeros_like(img)
+    out[(h - sh) // 2:(h - sh) // 2 + sh] = cv2.resize(img, (w, sh), interpolation=cv2.INTER_AREA)
+    return out
+
+# name -> (per-frame edit, output size from base (w, h), GOP override)
+VARIANTS: dict[str, tuple[Callable[[np.ndarray], np.ndarray], Callable[[int, int], tuple[int, int]], int | None]] = {
+    "reencode": (_jpeg, lambda w, h: (w, h), 30),
+    "crop": (_crop, lambda w, h: (w, h), None),
+    "color": (_color, lambda w, h: (w, h), None),
+    "letterbox": (_letterbox, lambda w, h: (w, h), None),
+    "resize": (lambda img: img, lambda w, h: (w // 2 // 2 * 2, h // 2 // 2 * 2), None),
+}
+
+# ---------------- writing ----------------
+
+def _x264_available() -> bool:
+    if not shutil.which("ffmpeg"):
+        return False
+    out = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], stdout=subprocess.PIPE,
+                         stderr=subprocess.DEVNULL, text=True).stdout
+    return "libx264" in out
+
+def write_video(path: Path, frames: Iterator[np.ndarray], fps: int, size: tuple[int, int],
+                gop: int | None = None, x264: bool = False) -> int:
+    """Write frames (resized to `size`) as mp4; with x264, re-encode to the given GOP. Returns frames written."""
+    raw = path.with_suffix(".raw.mp4") if x264 and gop else path
+    vw = cv2.VideoWriter(str(raw), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    n = 0
+    for img in frames:
+        if (img.shape[1], img.shape[0]) != size:
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        vw.write(img)
+        n += 1
+    vw.release()
+    if raw != path:
+        subprocess.run(["ffmpeg", "-v", "error", "-y", "-i", str(raw), "-c:v", "libx264", "-preset", "veryfast",
+                        "-crf", "23", "-g", str(gop), "-pix_fmt", "yuv420p", str(path)], check=True)
+        raw.unlink()
+    return n
+
+def generate(out: Path, bases: int = 8, seed: int = 0, variants: list[str] | None = None) -> dict:
+    """Write the dataset into `out` (reused when the manifest matches) and return the manifest."""
+    variants = list(VARIANTS) if variants is None else variants
+    out.mkdir(parents=True, exist_ok=True)
+    x264 = _x264_available()
+    settings = {"bases": bases, "seed": seed, "variants": variants, "x264": x264, "generator": GENERATOR_VERSION}
+    manifest_path = out / "manifest.json"
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest.get("settings") == settings and all((out / v["file"]).exists() for v in manifest["videos"]):
+            return manifest
+    videos = []
+    for b in range(bases):
+        spec = base_spec(seed * 1000 + b)
+        base_id = f"b{b:03d}"
+        w, h = spec["width"], spec["height"]
+        n = write_video(out / f"{base_id}.mp4", base_frames(spec), spec["fps"], (w, h), spec["gop"], x264)
+        videos.append({"id": base_id, "file": f"{base_id}.mp4", "base": base_id, "variant": None,
+                       "width": w, "height": h, "fps": spec["fps"], "frames": n,
+                       "gop": spec["gop"] if x264 else None})
+        for name in variants:
+            edit, sized, gop = VARIANTS[name]
+            vid = f"{base_id}-{name}"
+            vw, vh = sized(w, h)
+            n = write_video(out / f"{vid}.mp4", (edit(f) for f in base_frames(spec)), spec["fps"], (vw, vh),
+                            gop or spec["gop"], x264)
+            videos.append({"id": vid, "file": f"{vid}.mp4", "base": base_id, "variant": name,
+                           "width": vw, "height": vh, "fps": spec["fps"], "frames": n,
+                           "gop": (gop or spec["gop"]) if x264 else None})
+    manifest = {"settings": settings, "videos": videos}
+    manifest_path.write_text(json.dumps(manifest, indent=1))
+    return manifest
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", type=Path, required=True)
+    ap.add_argument("--bases", type=int, default=8)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--variants", default=",".join(VARIANTS))
+    args = ap.parse_args()
+    manifest = generate(args.out, args.bases, args.seed, [v for v in args.variants.split(",") if v])
+    print(f"[+] {len(manifest['videos'])} videos in {args.out}")
+
+if __name__ == "__main__":
+    main()